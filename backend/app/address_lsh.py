@@ -0,0 +1,128 @@
+"""
+住所の近似重複検索（MinHash + LSH）
+
+正規化した住所の文字 n-gram（シングル）から MinHash シグネチャを作り、
+bands × rows に分割したバケットで類似住所の候補を部分線形時間で取得する。
+バンドのハッシュ値は customer_address_bands テーブルにも保存され、SQL 側の候補検索に使う。
+bands/rows を変更した場合は backfill-match-keys でバンドを再計算すること。
+"""
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import hashlib
+import os
+from .canonicalize import canonical_address
+
+# メルセンヌ素数 2^31 - 1（a * x + b が uint64 に収まる）
+_PRIME = (1 << 31) - 1
+
+DEFAULT_BANDS = int(os.getenv("ADDRESS_LSH_BANDS", "20"))
+DEFAULT_ROWS = int(os.getenv("ADDRESS_LSH_ROWS", "4"))
+DEFAULT_SHINGLE_SIZE = int(os.getenv("ADDRESS_LSH_SHINGLE_SIZE", "2"))
+
+
+def shingles(text: str, size: int) -> Set[str]:
+    """文字 n-gram の集合"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _stable_hash(value: str) -> int:
+    """プロセス間で安定した 31bit ハッシュ"""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "little") % _PRIME
+
+
+class AddressLSH:
+    """住所の MinHash/LSH インデックス"""
+
+    def __init__(
+        self,
+        bands: int = DEFAULT_BANDS,
+        rows: int = DEFAULT_ROWS,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        seed: int = 42
+    ):
+        self.bands = bands
+        self.rows = rows
+        self.shingle_size = shingle_size
+        import numpy as np  # 起動時間短縮のため初回利用時に import
+
+        rng = np.random.RandomState(seed)
+        num_perm = bands * rows
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+        self._prime = np.uint64(_PRIME)
+        self._np = np
+        self._buckets: Dict[int, List[int]] = {}
+        # 既定の設定なら address_band_hashes のキャッシュを共有できる（チャンクごとに同じ顧客を読み直すため）
+        self._shared_cache = (bands, rows, shingle_size, seed) == (
+            DEFAULT_BANDS, DEFAULT_ROWS, DEFAULT_SHINGLE_SIZE, 42
+        )
+
+    def signature(self, address: str) -> Optional["np.ndarray"]:
+        """住所の MinHash シグネチャ（住所が空なら None）"""
+        key = canonical_address(address) if address else ""
+        grams = shingles(key, self.shingle_size)
+        if not grams:
+            return None
+        np = self._np
+        hashes = np.fromiter((_stable_hash(g) for g in grams), dtype=np.uint64, count=len(grams))
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % self._prime
+        return permuted.min(axis=1)
+
+    def band_hashes(self, address: str) -> List[int]:
+        """バンドごとのバケットハッシュ（符号付き 64bit、DB保存用）"""
+        if self._shared_cache and address:
+            return list(_cached_band_hashes(str(address)))
+        return self._compute_band_hashes(address)
+
+    def _compute_band_hashes(self, address: str) -> List[int]:
+        sig = self.signature(address)
+        if sig is None:
+            return []
+        result = []
+        for band in range(self.bands):
+            chunk = sig[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(
+                band.to_bytes(2, "little") + chunk.tobytes(), digest_size=8
+            ).digest()
+            result.append(int.from_bytes(digest, "little", signed=True))
+        return result
+
+    def add(self, customer_id: int, address: str):
+        """顧客の住所を登録"""
+        for bucket in self.band_hashes(address):
+            self._buckets.setdefault(bucket, []).append(customer_id)
+
+    def add_many(self, customers: Iterable[Dict]):
+        """顧客dictのリストを登録"""
+        for customer in customers:
+            address = customer.get("address_line1") or customer.get("address")
+            if address:
+                self.add(customer["id"], address)
+
+    def query(self, address: str) -> Set[int]:
+        """同じバケットに入る顧客IDを返す（類似度の検証は呼び出し側で行う）"""
+        result = set()
+        for bucket in self.band_hashes(address):
+            result.update(self._buckets.get(bucket, ()))
+        return result
+
+
+@lru_cache(maxsize=1)
+def default_lsh() -> AddressLSH:
+    """DB保存用のデフォルト設定インスタンス（初回利用時に作成）"""
+    return AddressLSH()
+
+
+@lru_cache(maxsize=65536)
+def _cached_band_hashes(address: str) -> Tuple[int, ...]:
+    return tuple(default_lsh()._compute_band_hashes(address))
+
+
+def address_band_hashes(address: Optional[str]) -> Tuple[int, ...]:
+    """デフォルト設定でのバンドハッシュ"""
+    if not address:
+        return ()
+    return _cached_band_hashes(str(address))
@@ -0,0 +1,222 @@
+"""
+日本語データの正規化（マッチキー生成）
+
+表記ゆれ（全角/半角、ひらがな/カタカナ、丁目/番地、電話番号の書式）を吸収し、
+完全一致ハッシュで比較できる安定したキーを生成する。
+同じ値は何度も出現するため、各関数は値ごとにメモ化する。
+"""
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import re
+import unicodedata
+
+CACHE_SIZE = 65536
+
+# ひらがな（ぁ〜ゖ）→ カタカナ（ァ〜ヶ）
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+# ハイフン・長音記号の揺れ
+_HYPHENS = "‐‑‒–—―−－ｰ-"
+
+_SPACE_RE = re.compile(r"[\s　]+")
+
+# 敬称（末尾）
+_HONORIFIC_RE = re.compile(r"(様|さま|サマ|殿|御中|さん|サン|氏)$")
+
+_KANJI_DIGITS = {"〇": 0, "零": 0, "一": 1, "二": 2, "三": 3, "四": 4,
+                 "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_KANJI_UNITS = {"十": 10, "百": 100, "千": 1000}
+_KANJI_NUMBER = "〇零一二三四五六七八九十百千"
+
+# 番地表記の後ろに付く単位
+_ADDRESS_UNIT_RE = re.compile(
+    rf"([{_KANJI_NUMBER}]+)(?=\s*(?:丁目|番地|番|号|-|の\s*[\d{_KANJI_NUMBER}]))"
+)
+_ADDRESS_TAIL_RE = re.compile(r"(\d)\s*(丁目|番地の|番地|番の|番|号|の)\s*(?=\d|$)")
+
+
+def kanji_to_int(text: str) -> int:
+    """漢数字を整数に変換（例: 二十三 → 23, 二〇 → 20）"""
+    if all(ch in _KANJI_DIGITS for ch in text):
+        # 位取り表記（一二三 → 123）
+        value = 0
+        for ch in text:
+            value = value * 10 + _KANJI_DIGITS[ch]
+        return value
+
+    total = 0
+    current = 0
+    for ch in text:
+        if ch in _KANJI_DIGITS:
+            current = _KANJI_DIGITS[ch]
+        elif ch in _KANJI_UNITS:
+            total += (current or 1) * _KANJI_UNITS[ch]
+            current = 0
+    return total + current
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def nfkc(value: str) -> str:
+    """NFKC正規化 + 空白の統一（全角英数・半角カナを吸収）"""
+    s = unicodedata.normalize("NFKC", value)
+    return _SPACE_RE.sub(" ", s).strip()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def fold_kana(value: str) -> str:
+    """ひらがなをカタカナに寄せる（NFKC適用済みの文字列を想定）"""
+    return value.translate(_HIRAGANA_TO_KATAKANA)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_email(value: str) -> str:
+    """メールアドレスの正規化キー"""
+    return nfkc(value).replace(" ", "").lower()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_phone(value: str) -> str:
+    """
+    電話番号を E.164 形式に正規化
+    国内形式（03-1234-5678, 090-1234-5678）、国際形式（+81 (0)3...、0081...、010-81...）に対応。
+    判別できない番号は数字のみを返す。
+    """
+    s = nfkc(value)
+    if not s:
+        return ""
+
+    has_plus = s.startswith("+")
+    # "+81 (0)3-..." の (0) は国内プレフィックスなので除去
+    s = re.sub(r"\(0\)", "", s)
+    digits = re.sub(r"\D", "", s)
+    if not digits:
+        return ""
+
+    if not has_plus:
+        if digits.startswith("010"):
+            # 日本からの国際電話プレフィックス
+            digits = digits[3:]
+            has_plus = True
+        elif digits.startswith("00"):
+            digits = digits[2:]
+            has_plus = True
+
+    if has_plus:
+        if digits.startswith("81") and digits[2:3] == "0":
+            digits = "81" + digits[3:]
+        return "+" + digits
+
+    if digits.startswith("0") and len(digits) in (10, 11):
+        return "+81" + digits[1:]
+
+    return digits
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_name(value: str) -> str:
+    """
+    氏名の正規化キー
+    NFKC、小文字化、かな統一、空白・中黒の除去、末尾の敬称除去
+    """
+    s = fold_kana(nfkc(value)).lower()
+    s = s.replace(" ", "").replace("・", "").replace("･", "")
+    s = _HONORIFIC_RE.sub("", s)
+    return s
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_address(value: str) -> str:
+    """
+    住所の正規化キー
+    漢数字の番地を算用数字に、丁目/番地/番/号/の を "-" に統一する。
+    例: 東京都千代田区丸の内一丁目2番3号 → 東京都千代田区丸の内1-2-3
+    """
+    s = nfkc(value)
+    if not s:
+        return ""
+
+    # 数字に挟まれたハイフン類・長音記号を "-" に
+    s = re.sub(rf"(?<=[\d{_KANJI_NUMBER}])\s*[{re.escape(_HYPHENS)}ー]\s*(?=[\d{_KANJI_NUMBER}])", "-", s)
+
+    # 番地単位の前の漢数字を算用数字に
+    s = _ADDRESS_UNIT_RE.sub(lambda m: str(kanji_to_int(m.group(1))), s)
+
+    # 丁目/番地/番/号/の → "-"
+    s = _ADDRESS_TAIL_RE.sub(r"\1-", s)
+    s = s.replace(" ", "")
+    s = re.sub(r"-+", "-", s).rstrip("-")
+    return s.lower()
+
+
+# 小書きかな → 通常のかな（カタカナ）
+_SMALL_KANA = str.maketrans("ァィゥェォッャュョヮヵヶ", "アイウエオツヤユヨワカケ")
+_VOWELS_RE = re.compile(r"(?<=.)[aeiouy]")
+# 長音の揺れ（オ段+ウ、エ段+イ）
+_LONG_VOWEL_RE = re.compile(r"(?<=[オコソトノホモヨロヲ])ウ|(?<=[エケセテネヘメレ])イ")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def name_token_key(value: str) -> str:
+    """氏名のトークンを並べ替えたキー（姓名の順序違いを吸収）"""
+    s = fold_kana(nfkc(value)).lower().replace("・", " ").replace("･", " ")
+    tokens = [_HONORIFIC_RE.sub("", t) for t in s.split(" ")]
+    return " ".join(sorted(t for t in tokens if t))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def phonetic_key(value: str) -> str:
+    """
+    氏名の読みキー
+    濁点/半濁点・小書きかな・長音を落とし、英字は先頭以外の母音と連続文字を除去する
+    """
+    s = unicodedata.normalize("NFD", canonical_name(value))
+    s = s.replace("\u3099", "").replace("\u309a", "")
+    s = unicodedata.normalize("NFC", s).translate(_SMALL_KANA).replace("ー", "")
+    s = _LONG_VOWEL_RE.sub("", s)
+    s = _VOWELS_RE.sub("", s)
+    return re.sub(r"(.)\1+", r"\1", s)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def address_block_key(value: str) -> str:
+    """住所のブロックキー（丁目-番 までで切る。例: 丸の内1-2-3 → 丸の内1-2）"""
+    s = canonical_address(value)
+    match = re.match(r"^\D*\d+(?:-\d+)?", s)
+    return match.group(0) if match else s
+
+
+def customer_match_keys(full_name: Any, phone: Any, address: Any) -> Dict[str, Optional[str]]:
+    """Customer に永続化するマッチキー（空値は None）"""
+    name = str(full_name) if full_name else ""
+    return {
+        "name_key": canonical_name(name)[:255] or None,
+        "name_token_key": name_token_key(name)[:255] or None,
+        "name_kana_key": phonetic_key(name)[:255] or None,
+        "phone_key": (canonical_phone(str(phone)) if phone else "")[:32] or None,
+        "address_key": (address_block_key(str(address)) if address else "")[:255] or None,
+    }
+
+
+def match_keys(row: Dict[str, Any]) -> Dict[str, str]:
+    """行（dict）から完全一致用のマッチキーを生成"""
+    email = row.get("email") or ""
+    phone = row.get("phone") or ""
+    name = row.get("full_name") or ""
+    address = row.get("address_line1") or row.get("address") or ""
+
+    return {
+        "email": canonical_email(str(email)) if email else "",
+        "phone": canonical_phone(str(phone)) if phone else "",
+        "name": canonical_name(str(name)) if name else "",
+        "address": canonical_address(str(address)) if address else "",
+    }
+
+
+def cache_info() -> Dict[str, Dict[str, int]]:
+    """メモ化のヒット状況（計測用）"""
+    result = {}
+    for func in (nfkc, fold_kana, canonical_email, canonical_phone, canonical_name, canonical_address,
+                 name_token_key, phonetic_key, address_block_key):
+        info = func.cache_info()
+        result[func.__name__] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    return result
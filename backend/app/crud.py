@@ -1,6 +1,15 @@
 from sqlalchemy.orm import Session
 from . import models
-from typing import List, Dict, Optional
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.dialects import mysql, sqlite
+from typing import Iterable, List, Dict, Optional
+from .canonicalize import canonical_email, customer_match_keys
+from .address_lsh import address_band_hashes
+
+# set-based upsert の1文あたりの行数
+UPSERT_BATCH_SIZE = 1000
+# インポートで上書きできる顧客列（email は一致キー）
+UPSERT_COLUMNS = ("full_name", "phone", "address", "city", "state", "zip_code")
 
 def create_import(db: Session, filename: str, s3_key: Optional[str] = None) -> models.Import:
     """インポートレコードを作成"""
@@ -33,6 +42,14 @@ def update_import_status(
         db_import.candidate_count = candidate_count
         db.commit()
 
+def _commit_or_flush(db: Session, obj, commit: bool):
+    """commit=True ならコミットして再読み込み、False ならフラッシュだけ（チャンク単位のトランザクション用）"""
+    if commit:
+        db.commit()
+        db.refresh(obj)
+    else:
+        db.flush()
+
 def create_import_row(
     db: Session,
     import_id: int,
@@ -41,9 +58,11 @@ def create_import_row(
     mapped_data: Dict,
     normalized_data: Dict,
     validation_errors: List[str],
-    status: str
+    status: str,
+    row_hash: Optional[str] = None,
+    commit: bool = True
 ) -> models.ImportRow:
-    """インポート行を作成"""
+    """インポート行を作成（commit=False ならフラッシュだけ。コミットは呼び出し側）"""
     db_row = models.ImportRow(
         import_id=import_id,
         row_index=row_index,
@@ -51,17 +70,124 @@ def create_import_row(
         mapped_data=mapped_data,
         normalized_data=normalized_data,
         validation_errors=validation_errors,
-        status=status
+        status=status,
+        row_hash=row_hash
     )
     db.add(db_row)
-    db.commit()
-    db.refresh(db_row)
+    _commit_or_flush(db, db_row, commit)
     return db_row
 
+def create_import_rows(db: Session, rows: List[Dict], commit: bool = True):
+    """インポート行をまとめて作成（1文の executemany）"""
+    if rows:
+        db.execute(insert(models.ImportRow), rows)
+        if commit:
+            db.commit()
+
+def get_reusable_import(
+    db: Session,
+    content_hash: str,
+    mapping_hash: str,
+    exclude_id: int
+) -> Optional[models.Import]:
+    """同じ内容・同じマッピングで完了済みの最新インポートを取得"""
+    return db.query(models.Import).filter(
+        models.Import.content_hash == content_hash,
+        models.Import.mapping_hash == mapping_hash,
+        models.Import.status == models.ImportStatus.completed,
+        models.Import.id != exclude_id
+    ).order_by(models.Import.id.desc()).first()
+
+def has_reusable_import(db: Session, mapping_hash: str, customers_fingerprint: str, exclude_id: int) -> bool:
+    """同じマッピングで完了し、その後顧客に変更がないインポートがあるか（内容が同じなら引き継げる候補）"""
+    return db.query(models.Import.id).filter(
+        models.Import.mapping_hash == mapping_hash,
+        models.Import.customers_fingerprint == customers_fingerprint,
+        models.Import.content_hash.isnot(None),
+        models.Import.status == models.ImportStatus.completed,
+        models.Import.id != exclude_id
+    ).first() is not None
+
+def get_customers_fingerprint(db: Session) -> str:
+    """顧客テーブルの状態（件数・最大ID・最終更新日時）。変更があれば値が変わる"""
+    count, max_id, max_updated = db.query(
+        func.count(models.Customer.id),
+        func.max(models.Customer.id),
+        func.max(models.Customer.updated_at)
+    ).one()
+    return f"{count}:{max_id or 0}:{max_updated or ''}"
+
+def get_inserted_row_hashes(db: Session, row_hashes: Iterable[str]) -> set:
+    """過去のインポートで取り込み済み（inserted）の行ハッシュを取得"""
+    row_hashes = [h for h in set(row_hashes) if h]
+    if not row_hashes:
+        return set()
+    rows = db.query(models.ImportRow.row_hash).filter(
+        models.ImportRow.row_hash.in_(row_hashes),
+        models.ImportRow.status == models.RowStatus.inserted
+    ).distinct().all()
+    return {row.row_hash for row in rows}
+
+def create_import_shards(db: Session, import_id: int, shard_count: int) -> List[models.ImportShard]:
+    """シャードレコードをまとめて作成（既存のものは作り直す）"""
+    db.query(models.ImportShard).filter(models.ImportShard.import_id == import_id).delete()
+    shards = [
+        models.ImportShard(import_id=import_id, shard_no=shard_no, shard_count=shard_count)
+        for shard_no in range(shard_count)
+    ]
+    db.add_all(shards)
+    db.commit()
+    return shards
+
+def get_or_create_import_shard(db: Session, import_id: int, shard_no: int, shard_count: int) -> models.ImportShard:
+    """シャードレコードを取得（なければ作成）"""
+    shard = db.query(models.ImportShard).filter(
+        models.ImportShard.import_id == import_id,
+        models.ImportShard.shard_no == shard_no
+    ).first()
+    if not shard:
+        shard = models.ImportShard(import_id=import_id, shard_no=shard_no, shard_count=shard_count)
+        db.add(shard)
+        db.commit()
+    return shard
+
+def get_import_shards(db: Session, import_id: int) -> List[models.ImportShard]:
+    """インポートのシャード一覧"""
+    return db.query(models.ImportShard).filter(
+        models.ImportShard.import_id == import_id
+    ).order_by(models.ImportShard.shard_no).all()
+
 def get_import_rows(db: Session, import_id: int) -> List[models.ImportRow]:
     """インポート行のリストを取得"""
     return db.query(models.ImportRow).filter(models.ImportRow.import_id == import_id).all()
 
+def iter_import_rows(
+    db: Session,
+    import_id: int,
+    status: Optional[str] = None,
+    batch_size: int = 1000
+) -> Iterable[models.ImportRow]:
+    """インポート行をサーバーサイドカーソルで逐次取得（row_index順）"""
+    stmt = select(models.ImportRow).where(models.ImportRow.import_id == import_id)
+    if status:
+        stmt = stmt.where(models.ImportRow.status == status)
+    stmt = stmt.order_by(models.ImportRow.row_index).execution_options(yield_per=batch_size)
+    return db.execute(stmt).scalars()
+
+def get_import_rows_page(db: Session, import_id: int, offset: int, limit: int) -> List[models.ImportRow]:
+    """インポート行をrow_index順にページングして取得"""
+    return db.query(models.ImportRow).filter(
+        models.ImportRow.import_id == import_id
+    ).order_by(models.ImportRow.row_index).offset(offset).limit(limit).all()
+
+def get_candidates_by_row_ids(db: Session, import_row_ids: List[int]) -> List[models.DuplicateCandidate]:
+    """インポート行IDのリストに紐づく重複候補を取得"""
+    if not import_row_ids:
+        return []
+    return db.query(models.DuplicateCandidate).filter(
+        models.DuplicateCandidate.import_row_id.in_(import_row_ids)
+    ).order_by(models.DuplicateCandidate.id).all()
+
 def create_candidate(
     db: Session,
     import_id: int,
@@ -102,9 +228,10 @@ def create_customer(
     full_name: str,
     email: Optional[str],
     phone: Optional[str],
-    address: Optional[str]
+    address: Optional[str],
+    commit: bool = True
 ) -> models.Customer:
-    """顧客を作成"""
+    """顧客を作成（commit=False ならフラッシュだけ）"""
     db_customer = models.Customer(
         full_name=full_name,
         email=email,
@@ -112,8 +239,7 @@ def create_customer(
         address=address
     )
     db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
+    _commit_or_flush(db, db_customer, commit)
     return db_customer
 
 def get_customer(db: Session, customer_id: int) -> models.Customer:
@@ -146,6 +272,68 @@ def update_customer(
 def get_all_customers(db: Session) -> List[models.Customer]:
     """全顧客を取得"""
     return db.query(models.Customer).all()
+
+def get_customers_by_match_keys(db: Session, keys: Dict[str, Iterable[str]]) -> List[models.Customer]:
+    """
+    マッチキー（列名 → 値の集合）のいずれかに一致する顧客を取得
+    "address_band" は住所LSHのバンドハッシュとして customer_address_bands を引く
+    """
+    conditions = _match_key_conditions(keys)
+    if not conditions:
+        return []
+
+    return db.query(models.Customer).filter(or_(*conditions)).all()
+
+def get_customer_values_by_match_keys(db: Session, keys: Dict[str, Iterable[str]], columns: Iterable[str]) -> List[tuple]:
+    """get_customers_by_match_keys と同じ条件で、指定列の値のタプルだけを取得（ORMオブジェクトを作らない）"""
+    conditions = _match_key_conditions(keys)
+    if not conditions:
+        return []
+
+    selected = [getattr(models.Customer, column) for column in columns]
+    return [tuple(row) for row in db.execute(select(*selected).where(or_(*conditions)))]
+
+def _match_key_conditions(keys: Dict[str, Iterable[str]]) -> list:
+    conditions = []
+    for column, values in keys.items():
+        values = [v for v in set(values) if v]
+        if not values:
+            continue
+        if column == "address_band":
+            conditions.append(models.Customer.id.in_(
+                select(models.CustomerAddressBand.customer_id).where(
+                    models.CustomerAddressBand.band_hash.in_(values)
+                )
+            ))
+        else:
+            conditions.append(getattr(models.Customer, column).in_(values))
+    return conditions
+
+def row_match_keys(row: Dict) -> Dict[str, set]:
+    """
+    行（正規化済み）のマッチキー（列名 → 値の集合）
+    MATCH_KEY_COLUMNS に加えて "email"（正規化済み）と "address_band"（住所LSHのバンドハッシュ）
+    """
+    keys = {column: set() for column in ("email", "address_band") + models.MATCH_KEY_COLUMNS}
+    if row.get("email"):
+        keys["email"].add(canonical_email(str(row["email"])))
+    address = row.get("address_line1") or row.get("address")
+    for column, value in customer_match_keys(row.get("full_name"), row.get("phone"), address).items():
+        if value:
+            keys[column].add(value)
+    keys["address_band"].update(address_band_hashes(address))
+    return keys
+
+def create_row_match_keys(db: Session, import_row_id: int, row: Dict):
+    """候補行のマッチキーを保存（コミットは呼び出し側）"""
+    values = [
+        {"import_row_id": import_row_id, "key_type": key_type, "key_value": str(value)}
+        for key_type, key_values in row_match_keys(row).items()
+        for value in key_values
+    ]
+    if values:
+        db.execute(insert(models.ImportRowMatchKey), values)
+
 def get_duplicate_candidates(db: Session, import_id: int) -> List[models.DuplicateCandidate]:
     """重複候補を取得（import_id経由）"""
     return db.query(models.DuplicateCandidate).join(
@@ -160,9 +348,10 @@ def create_duplicate_candidate(
     import_row_id: int,
     existing_customer_id: int,
     match_reason: str,
-    similarity_score: float
+    similarity_score: float,
+    commit: bool = True
 ) -> models.DuplicateCandidate:
-    """重複候補を作成"""
+    """重複候補を作成（commit=False ならフラッシュだけ）"""
     db_candidate = models.DuplicateCandidate(
         import_row_id=import_row_id,
         existing_customer_id=existing_customer_id,
@@ -170,8 +359,7 @@ def create_duplicate_candidate(
         similarity_score=similarity_score
     )
     db.add(db_candidate)
-    db.commit()
-    db.refresh(db_candidate)
+    _commit_or_flush(db, db_candidate, commit)
     return db_candidate
 
 def resolve_duplicate(
@@ -199,3 +387,85 @@ def get_customer_by_email(db: Session, email: str) -> Optional[models.Customer]:
 def get_customer_by_phone(db: Session, phone: str) -> Optional[models.Customer]:
     """電話番号で顧客を検索"""
     return db.query(models.Customer).filter(models.Customer.phone == phone).first()
+
+def get_customer_by_phone_key(db: Session, phone_key: str) -> Optional[models.Customer]:
+    """E.164に正規化した電話番号で顧客を検索"""
+    return db.query(models.Customer).filter(models.Customer.phone_key == phone_key).first()
+
+def upsert_customers(db: Session, customers: List[Dict], commit: bool = True) -> List[str]:
+    """
+    email をキーに顧客をまとめて upsert し、行ごとの結果（"inserted" / "updated"）を返す
+    更新は空でない値だけを反映する（COALESCE(NULLIF(new, ''), old)）
+    MySQL は INSERT ... ON DUPLICATE KEY UPDATE、SQLite は ON CONFLICT DO UPDATE
+    """
+    emails = [c["email"] for c in customers]
+    existing = set()
+    for offset in range(0, len(emails), UPSERT_BATCH_SIZE):
+        existing.update(
+            email for (email,) in db.query(models.Customer.email).filter(
+                models.Customer.email.in_(emails[offset:offset + UPSERT_BATCH_SIZE])
+            )
+        )
+
+    outcomes = []
+    for email in emails:
+        outcomes.append("updated" if email in existing else "inserted")
+        existing.add(email)
+
+    # マッチキーは列ごとに独立しているので、元の値と同じく COALESCE で合成できる
+    columns = [column for column in UPSERT_COLUMNS if any(c.get(column) for c in customers)]
+    values = []
+    for c in customers:
+        value = {column: c.get(column) or None for column in columns}
+        value["email"] = c["email"]
+        value.update(customer_match_keys(c.get("full_name"), c.get("phone"), c.get("address")))
+        values.append(value)
+    merged_columns = columns + list(models.MATCH_KEY_COLUMNS)
+
+    table = models.Customer.__table__
+    dialect = db.get_bind().dialect.name
+    for offset in range(0, len(values), UPSERT_BATCH_SIZE):
+        batch = values[offset:offset + UPSERT_BATCH_SIZE]
+        if dialect == "mysql":
+            stmt = mysql.insert(table).values(batch)
+            new = stmt.inserted
+            stmt = stmt.on_duplicate_key_update({
+                column: func.coalesce(func.nullif(new[column], ""), table.c[column])
+                for column in merged_columns
+            } | {"updated_at": func.now()})
+        else:
+            stmt = sqlite.insert(table).values(batch)
+            new = stmt.excluded
+            stmt = stmt.on_conflict_do_update(index_elements=["email"], set_={
+                column: func.coalesce(func.nullif(new[column], ""), table.c[column])
+                for column in merged_columns
+            } | {"updated_at": func.now()})
+        db.execute(stmt)
+
+    # 住所が入った顧客の住所LSHバンドを入れ替え（ORM のイベントは発火しないため）
+    with_address = {c["email"]: c["address"] for c in customers if c.get("address")}
+    if with_address:
+        ids = dict(db.query(models.Customer.email, models.Customer.id).filter(
+            models.Customer.email.in_(list(with_address))
+        ).all())
+        replace_customer_address_bands(db, {
+            ids[email]: address for email, address in with_address.items() if email in ids
+        })
+
+    if commit:
+        db.commit()
+    return outcomes
+
+def replace_customer_address_bands(db: Session, addresses: Dict[int, str]):
+    """顧客ID → 住所 の住所LSHバンドをまとめて入れ替え（コミットは呼び出し側）"""
+    if not addresses:
+        return
+    bands = models.CustomerAddressBand.__table__
+    db.execute(bands.delete().where(bands.c.customer_id.in_(list(addresses))))
+    band_rows = [
+        {"customer_id": customer_id, "band_hash": band}
+        for customer_id, address in addresses.items()
+        for band in address_band_hashes(address)
+    ]
+    if band_rows:
+        db.execute(bands.insert(), band_rows)
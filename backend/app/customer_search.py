@@ -0,0 +1,399 @@
+"""
+顧客検索（文字 bigram の転置インデックス、プロセス内）
+
+氏名・email・電話番号・住所を検索用に正規化（NFKC・小文字・かな統一・空白/記号除去）し、
+文字 bigram → 顧客ID の転置インデックスを持つ。クエリの bigram のうち SEARCH_MIN_MATCH 以上を含む顧客を
+完全一致・前方一致の見込み（先頭/末尾の文字のアンカー）> ヒット数の順に SEARCH_CANDIDATES 件まで取り出し、
+DB の現在値で 完全一致 > 前方一致 > 部分一致 > あいまい一致（bigram の一致率）の順にスコアを付けて返す。
+ページはこのスコア付けした範囲内で送る（total はページ送りできる件数、total_matches は条件を満たす総数）。
+
+- 本体: 全件から一括で作る CSR 形式（bigram ごとの顧客ID配列を1本の int32 配列に詰める）
+- 差分: updated_at のウォーターマーク以降に更新された顧客（SEARCH_REFRESH_SECONDS ごとに取り込む）。
+  本体の同じ顧客は無効にし、差分が SEARCH_DELTA_MAX 件を超えたらバックグラウンドで本体を作り直す
+- 削除された顧客は DB から値を読めないので結果から落ちる
+- 候補は bigram の出現数が少ない方から (bigram 数 - 必要ヒット数 + 1) 個のリストだけで作り、
+  残りの頻出 bigram は二分探索で数える（取りこぼしはない）。それでも SEARCH_SCAN_MAX 件を超える
+  頻出語だけのクエリは ID 順の先頭だけを見て、総数は概算になる（完全一致・前方一致の見込みは打ち切らずに全件から取る）
+
+インデックスはプロセスごとに持つ（1,000,000件で数百MB）。作成中の検索は DB の前方一致（インデックスが効く範囲）で返す。
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import array
+import os
+import re
+import threading
+import time
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session, sessionmaker
+from . import models
+from .canonicalize import canonical_name, fold_kana, nfkc
+
+# DB の現在値でスコアを付け直す候補数（ページはこの範囲内で送る）
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "200"))
+# クエリの bigram のうちこの割合以上を含む顧客を候補にする（1.0 なら部分一致のみ）
+SEARCH_MIN_MATCH = float(os.getenv("SEARCH_MIN_MATCH", "0.6"))
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", "5"))
+SEARCH_DELTA_MAX = int(os.getenv("SEARCH_DELTA_MAX", "50000"))
+SEARCH_BUILD_BATCH_SIZE = int(os.getenv("SEARCH_BUILD_BATCH_SIZE", "10000"))
+# 候補を作るときに読む顧客IDの上限（頻出語だけのクエリはここで打ち切り、総数は概算）
+SEARCH_SCAN_MAX = int(os.getenv("SEARCH_SCAN_MAX", "50000"))
+
+SEARCH_FIELDS = ("full_name", "email", "phone", "address")
+
+_STRIP_RE = re.compile(r"[\s\-‐‑‒–—―−ｰ()（）・･.]+")
+
+
+def search_key(value) -> str:
+    """検索用の正規化（フィールド・クエリ共通）"""
+    if not value:
+        return ""
+    return _STRIP_RE.sub("", fold_kana(nfkc(str(value))).lower())
+
+
+def field_keys(full_name=None, email=None, phone=None, address=None) -> Tuple[str, ...]:
+    """顧客の検索キー（SEARCH_FIELDS の順）"""
+    return (search_key(full_name), search_key(email), search_key(phone), search_key(address))
+
+
+def bigrams(key: str) -> Set[str]:
+    """文字 bigram（1文字ならその文字）"""
+    if len(key) < 2:
+        return {key} if key else set()
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+def anchors(key: str) -> Tuple[str, str]:
+    """先頭・末尾の文字のアンカー（前方一致・完全一致の候補を絞る）"""
+    return "\x02" + key[0], key[-1] + "\x03"
+
+
+def index_grams(keys: Sequence[str]) -> Set[str]:
+    """インデックスに入れるトークン（各フィールドの bigram とアンカー）"""
+    grams: Set[str] = set()
+    for key in keys:
+        if key:
+            grams |= bigrams(key)
+            grams.update(anchors(key))
+    return grams
+
+
+def score_fields(query: str, keys: Sequence[str], query_grams: Set[str]) -> Tuple[float, Optional[str]]:
+    """検索キーに対するスコアと一致したフィールド"""
+    best, best_field = 0.0, None
+    for field, key in zip(SEARCH_FIELDS, keys):
+        if not key:
+            continue
+        if key == query:
+            score = 1.0
+        elif key.startswith(query):
+            score = 0.95
+        elif query in key:
+            score = 0.9
+        else:
+            grams = bigrams(key)
+            score = 0.8 * len(query_grams & grams) / len(query_grams) if query_grams else 0.0
+        if score > best:
+            best, best_field = score, field
+    return best, best_field
+
+
+class CustomerSearchIndex:
+    """bigram 転置インデックス（本体 + 差分）"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._vocab: Dict[str, int] = {}
+        self._offsets = None      # bigram ID → postings の開始位置（numpy int64）
+        self._postings = None     # 顧客ID（numpy int32、bigram ごとに昇順）
+        # 差分（本体作成後に更新された顧客）: 顧客ID → bigram 集合
+        self._delta: Dict[int, Set[str]] = {}
+        self._delta_postings: Dict[str, Set[int]] = {}
+        self.watermark: Optional[datetime] = None
+        self.ready = False
+        self.building = False
+        self._last_refresh = 0.0
+        self.stats = {"queries": 0, "built_at": None, "build_seconds": 0.0, "customers": 0}
+
+    # --- 作成・更新 ---
+
+    def build(self, db: Session):
+        """全顧客から本体を作り直す（ID順に SEARCH_BUILD_BATCH_SIZE 件ずつ読む）"""
+        import numpy as np  # 起動時間短縮のため初回利用時に import
+
+        start = time.perf_counter()
+        customer = models.Customer
+        vocab: Dict[str, int] = {}
+        gram_ids = array.array("i")
+        customer_ids = array.array("i")
+        watermark = None
+        count = 0
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(customer.id, customer.full_name, customer.email, customer.phone,
+                       customer.address, customer.updated_at)
+                .where(customer.id > last_id).order_by(customer.id).limit(SEARCH_BUILD_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            for row in rows:
+                for gram in index_grams(field_keys(*row[1:5])):
+                    gram_ids.append(vocab.setdefault(gram, len(vocab)))
+                    customer_ids.append(row[0])
+                if row[5] is not None and (watermark is None or row[5] > watermark):
+                    watermark = row[5]
+            count += len(rows)
+            last_id = rows[-1][0]
+        db.rollback()
+
+        grams = np.frombuffer(gram_ids, dtype=np.int32) if gram_ids else np.zeros(0, dtype=np.int32)
+        ids = np.frombuffer(customer_ids, dtype=np.int32) if customer_ids else np.zeros(0, dtype=np.int32)
+        order = np.argsort(grams, kind="stable")  # 顧客IDの昇順を保つ
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(grams, minlength=len(vocab)), out=offsets[1:])
+
+        with self._lock:
+            self._vocab = vocab
+            self._postings = ids[order]
+            self._offsets = offsets
+            self._delta = {}
+            self._delta_postings = {}
+            # 作成中に更新された顧客は次の refresh で差分に入る
+            self.watermark = watermark
+            self.ready = True
+            self._last_refresh = time.monotonic()
+            self.stats.update(built_at=datetime.now().isoformat(timespec="seconds"),
+                              build_seconds=round(time.perf_counter() - start, 3), customers=count)
+
+    def start_build(self, session_factory, background: bool = True, rebuild: bool = False) -> bool:
+        """本体の作成を始める（background=True ならスレッドで作成し、すぐ戻る）。作成中・作成済みなら何もしない"""
+        def run():
+            db = session_factory()
+            try:
+                self.build(db)
+            except Exception as e:
+                print(f"ERROR: 顧客検索インデックスの作成に失敗: {str(e)}")
+            finally:
+                self.building = False
+                db.close()
+
+        with self._lock:
+            if self.building or (self.ready and not rebuild):
+                return False
+            self.building = True
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+        return True
+
+    def refresh(self, db: Session, force: bool = False) -> int:
+        """ウォーターマーク以降に更新された顧客を差分に取り込む。取り込んだ件数を返す"""
+        if not self.ready:
+            return 0
+        if not force and time.monotonic() - self._last_refresh < SEARCH_REFRESH_SECONDS:
+            return 0
+        customer = models.Customer
+        query = select(customer.id, customer.full_name, customer.email, customer.phone,
+                       customer.address, customer.updated_at)
+        if self.watermark is not None:
+            # 同じ時刻（秒精度）の更新を取りこぼさないよう1秒前から読む（同じ顧客は上書き）
+            query = query.where(customer.updated_at >= self.watermark - timedelta(seconds=1))
+        rows = db.execute(query.order_by(customer.updated_at)).all()
+        db.rollback()
+
+        with self._lock:
+            for row in rows:
+                self._put_delta(row[0], index_grams(field_keys(*row[1:5])))
+                if row[5] is not None and (self.watermark is None or row[5] > self.watermark):
+                    self.watermark = row[5]
+            self._last_refresh = time.monotonic()
+        if len(self._delta) > SEARCH_DELTA_MAX:
+            # 作り直しは全件を読むので検索リクエストでは待たない（作成中は本体 + 差分で返す）
+            self.start_build(sessionmaker(bind=db.get_bind()), rebuild=True)
+        return len(rows)
+
+    def _put_delta(self, customer_id: int, grams: Set[str]):
+        for gram in self._delta.get(customer_id, ()):
+            postings = self._delta_postings.get(gram)
+            if postings is not None:
+                postings.discard(customer_id)
+        self._delta[customer_id] = grams
+        for gram in grams:
+            self._delta_postings.setdefault(gram, set()).add(customer_id)
+
+    # --- 検索 ---
+
+    def candidates(self, query: str, limit: int = SEARCH_CANDIDATES,
+                   min_match: float = SEARCH_MIN_MATCH) -> Tuple[List[int], int]:
+        """完全一致・前方一致の見込み > bigram のヒット数 の順の顧客ID（最大 limit 件）と条件を満たす総数"""
+        import numpy as np
+
+        grams = bigrams(query)
+        if not grams:
+            return [], 0
+        need = max(1, int(np.ceil(len(grams) * min_match - 1e-9)))
+        start_anchor, end_anchor = anchors(query)
+
+        with self._lock:
+            vocab, offsets, postings = self._vocab, self._offsets, self._postings
+            delta, delta_postings = self._delta, self._delta_postings
+
+            lists = []
+            for gram in grams:
+                gram_id = vocab.get(gram)
+                if gram_id is not None:
+                    lists.append(postings[offsets[gram_id]:offsets[gram_id + 1]])
+            lists.sort(key=len)
+            # need 個以上の bigram を含む顧客は、短い方から (len(lists) - need + 1) 個のどれかに必ず含まれる。
+            # 候補はその短いリストだけから作り、残りの長いリスト（example など頻出語）は二分探索で数える
+            seeds, rest = lists[:max(0, len(lists) - need + 1)], lists[max(0, len(lists) - need + 1):]
+            approximate = sum(len(ids) for ids in seeds) > SEARCH_SCAN_MAX
+            if approximate:
+                # 頻出語だけのクエリ: 各リストの先頭（ID順）だけを見る
+                seeds = [ids[:SEARCH_SCAN_MAX // len(seeds)] for ids in seeds]
+            if seeds:
+                matched, matched_counts = np.unique(np.concatenate(seeds), return_counts=True)
+            else:
+                matched = np.zeros(0, dtype=np.int32)
+                matched_counts = np.zeros(0, dtype=np.int64)
+            for ids in rest:
+                # 顧客IDは bigram ごとに昇順なので二分探索で含まれるかを判定
+                positions = np.minimum(np.searchsorted(ids, matched), len(ids) - 1)
+                matched_counts = matched_counts + (ids[positions] == matched)
+
+            # 前方一致の見込み: 先頭アンカーとクエリの全 bigram を含む顧客。短いリストから順に絞るので
+            # 頻出語のクエリでも打ち切らない（ヒット数は同じなので、ここで拾わないと ID の大きい顧客が候補に残らない）
+            prefix = exact = np.zeros(0, dtype=np.int32)
+            start_id, end_id = vocab.get(start_anchor), vocab.get(end_anchor)
+            if start_id is not None and len(lists) == len(grams):
+                required = sorted(lists + [postings[offsets[start_id]:offsets[start_id + 1]]], key=len)
+                prefix = required[0]
+                for ids in required[1:]:
+                    positions = np.minimum(np.searchsorted(ids, prefix), len(ids) - 1)
+                    prefix = prefix[ids[positions] == prefix]
+                if end_id is not None and len(prefix):
+                    ends = postings[offsets[end_id]:offsets[end_id + 1]]
+                    positions = np.minimum(np.searchsorted(ends, prefix), len(ends) - 1)
+                    exact = prefix[ends[positions] == prefix]
+                missing = prefix[~np.isin(prefix, matched)]
+                if len(missing):
+                    matched = np.concatenate([matched, missing])
+                    matched_counts = np.concatenate([matched_counts, np.full(len(missing), len(grams))])
+
+            if delta and len(matched):
+                # 差分にある顧客は本体の古い値を使わない
+                keep = ~np.isin(matched, np.fromiter(delta, dtype=np.int64, count=len(delta)))
+                matched, matched_counts = matched[keep], matched_counts[keep]
+
+            delta_counts: Dict[int, int] = {}
+            for gram in grams:
+                for customer_id in delta_postings.get(gram, ()):
+                    delta_counts[customer_id] = delta_counts.get(customer_id, 0) + 1
+            extra = []
+            for customer_id, count in delta_counts.items():
+                if count >= need:
+                    customer_grams = delta[customer_id]
+                    tier = 0
+                    if count == len(grams) and start_anchor in customer_grams:
+                        tier = 2 if end_anchor in customer_grams else 1
+                    extra.append((tier, count, customer_id))
+
+        keep = matched_counts >= need
+        matched, matched_counts = matched[keep], matched_counts[keep]
+        tiers = np.isin(matched, prefix).astype(np.int64) + np.isin(matched, exact)
+        total = len(matched) + len(extra)
+        if approximate:
+            total = max(total, len(lists[0]) if lists else 0)
+
+        if len(matched) > limit:
+            # 完全一致・前方一致の見込み > ヒット数 の順（同じなら ID 順）に limit 件
+            order = np.lexsort((matched, -matched_counts, -tiers))[:limit]
+            matched, matched_counts, tiers = matched[order], matched_counts[order], tiers[order]
+        ranked = sorted(
+            [(int(tier), int(count), int(i)) for tier, count, i in zip(tiers, matched_counts, matched)] + extra,
+            key=lambda item: (-item[0], -item[1], item[2])
+        )
+        self.stats["queries"] += 1
+        return [customer_id for _, _, customer_id in ranked[:limit]], total
+
+
+# プロセスで共有するインデックス
+customer_index = CustomerSearchIndex()
+
+
+def ensure_index(session_factory, background: bool = True):
+    """未作成なら作成する（background=True ならスレッドで作成し、すぐ戻る）"""
+    if customer_index.ready or customer_index.building:
+        return
+    customer_index.start_build(session_factory, background=background)
+
+
+def _like_prefix(value: str) -> str:
+    """LIKE の前方一致パターン（入力の % _ \\ はワイルドカードにしない。escape="\\" と組で使う）"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _fallback_candidates(db: Session, query: str, limit: int) -> List[int]:
+    """インデックス作成中: インデックスが効く前方一致だけで探す"""
+    customer = models.Customer
+    return list(db.execute(
+        select(customer.id).where(or_(
+            customer.email.like(_like_prefix(query), escape="\\"),
+            customer.name_key.like(_like_prefix(canonical_name(query)), escape="\\"),
+            customer.phone.like(_like_prefix(query), escape="\\"),
+        )).order_by(customer.id).limit(limit)
+    ).scalars())
+
+
+def search_customers(db: Session, q: str, offset: int = 0, limit: int = 20) -> Dict[str, object]:
+    """
+    顧客を検索し、スコア順の1ページ分を返す
+    スコアを付けるのは上位 SEARCH_CANDIDATES 件までなので、total はその中の件数（offset はこの範囲で送る）。
+    条件を満たす総数は total_matches、それより少ない件数しか送れないときは truncated=True
+    """
+    query = search_key(q)
+    if not query:
+        return {"query": q, "total": 0, "total_matches": 0, "truncated": False,
+                "results": [], "index_ready": customer_index.ready}
+
+    if customer_index.ready:
+        customer_index.refresh(db)
+        ids, total = customer_index.candidates(query, limit=SEARCH_CANDIDATES)
+    else:
+        ids = _fallback_candidates(db, q.strip(), SEARCH_CANDIDATES)
+        total = len(ids)
+
+    customer = models.Customer
+    rows = db.execute(
+        select(customer.id, customer.full_name, customer.email, customer.phone, customer.address)
+        .where(customer.id.in_(ids))
+    ).all() if ids else []
+    query_grams = bigrams(query)
+    scored = []
+    for row in rows:
+        score, field = score_fields(query, field_keys(*row[1:]), query_grams)
+        if score > 0:
+            scored.append((score, row, field))
+    scored.sort(key=lambda item: (-item[0], item[1].id))
+
+    return {
+        "query": q,
+        "total": len(scored),
+        "total_matches": max(total, len(scored)),
+        "truncated": total > len(scored),
+        "index_ready": customer_index.ready,
+        "results": [
+            {
+                "id": row.id,
+                "full_name": row.full_name,
+                "email": row.email,
+                "phone": row.phone,
+                "address": row.address,
+                "score": round(score, 3),
+                "matched_field": field,
+            }
+            for score, row, field in scored[offset:offset + limit]
+        ],
+    }
@@ -0,0 +1,329 @@
+"""
+既存顧客どうしの重複スイープ
+
+fuzzy マッチ導入前のインポートで customers 自体に残った重複を探す。
+顧客を ID 範囲でシャードに分け、各シャードは顧客を yield_per で逐次読みながら DEDUPE_BATCH_SIZE 件ごとに
+- バッチの顧客とマッチキーが重なる顧客だけを取得（インポートと同じブロッキング）
+- find_duplicate_candidates と同じルール・スコアで照合（自分自身は除く）
+- 一致した組を (小さい ID, 大きい ID) にそろえて dedupe_pairs に書き（両側から見つかった組・既にある組は一意インデックスで1件に）、
+  シャードの last_customer_id（チェックポイント）と同じトランザクションでコミット
+する。全シャードが終わったら組を union-find でまとめ、2件以上の連結成分を dedupe_clusters（レビュー用）に書く。
+
+メモリはバッチ1つ分と、組に出てくる顧客の union-find だけ（顧客全体は持たない）。
+途中で止まっても、resume で未完了のシャードをチェックポイントから再開できる。
+シャードは queued/failed → processing の条件付き UPDATE で取るので、同じシャードを2つのワーカーが処理することはない。
+processing のまま残ったシャード（プロセスごと落ちた場合）は --force で取り直す。
+
+使い方:
+    python -m app.manage dedupe-sweep [--shards 8] [--workers 4]
+    python -m app.manage dedupe-sweep --resume 1 [--force]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+import multiprocessing
+import os
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+from . import models
+from .address_lsh import AddressLSH
+from .database import SessionLocal
+from .import_engine import build_match_index, find_duplicate_candidates
+from .import_processor import load_candidate_customers
+from .matchers import MatchConfig, MatchStats, job_stats
+from .records import CustomerRecord
+
+DEDUPE_SHARDS = int(os.getenv("DEDUPE_SHARDS", "4"))
+DEDUPE_WORKERS = int(os.getenv("DEDUPE_WORKERS", str(os.cpu_count() or 2)))
+# チェックポイントの間隔（この件数の顧客ごとに組を書いてコミット）
+DEDUPE_BATCH_SIZE = int(os.getenv("DEDUPE_BATCH_SIZE", "1000"))
+# クラスタを書き込む単位
+DEDUPE_CLUSTER_BATCH_SIZE = int(os.getenv("DEDUPE_CLUSTER_BATCH_SIZE", "5000"))
+
+
+def create_sweep(db: Session, shard_count: int = DEDUPE_SHARDS, match_config: Optional[dict] = None) -> models.DedupeSweep:
+    """スイープと、顧客ID範囲を shard_count 等分したシャードを作成"""
+    min_id, max_id, total = db.query(
+        func.min(models.Customer.id), func.max(models.Customer.id), func.count(models.Customer.id)
+    ).one()
+    sweep = models.DedupeSweep(
+        shard_count=shard_count,
+        match_config=MatchConfig.from_dict(match_config).to_dict(),
+        total_customers=total or 0
+    )
+    db.add(sweep)
+    db.flush()
+
+    start = (min_id or 1) - 1
+    span = max(1, -(-((max_id or 0) - start) // shard_count))
+    for shard_no in range(shard_count):
+        low = start + span * shard_no
+        db.add(models.DedupeSweepShard(
+            sweep_id=sweep.id,
+            shard_no=shard_no,
+            min_customer_id=low,
+            max_customer_id=low + span,
+            last_customer_id=low
+        ))
+    db.commit()
+    return sweep
+
+
+def _sweep_batch(db: Session, batch: List[CustomerRecord], config: MatchConfig, stats: MatchStats) -> List[Dict]:
+    """バッチの顧客を、マッチキーが重なる顧客と照合して組を返す"""
+    existing = load_candidate_customers(db, batch)
+    index = build_match_index(existing)
+    address_index = AddressLSH()
+    address_index.add_many(existing)
+
+    pairs: Dict[tuple, Dict] = {}
+    for customer in batch:
+        for match in find_duplicate_candidates(
+            customer, existing, index=index, address_index=address_index,
+            config=config, stats=stats, exclude_ids={customer.id}
+        ):
+            # 閾値未満（名前だけ一致して住所が違うなど）の組はつなぐと無関係な顧客までまとまるので使わない
+            if match["similarity_score"] < config.threshold:
+                continue
+            # ルールは決定的な一致で打ち切り・top_k で切るので、片側からしか見えない組がある。
+            # どちらの側から見つけても (小さい ID, 大きい ID) にそろえて残す（同じ組はスコアの高い方）
+            key = (min(customer.id, match["customer_id"]), max(customer.id, match["customer_id"]))
+            score = round(match["similarity_score"], 2)
+            if key in pairs and pairs[key]["similarity_score"] >= score:
+                continue
+            pairs[key] = {
+                "customer_id": key[0],
+                "other_customer_id": key[1],
+                "match_reason": match["match_reason"][:255],
+                "similarity_score": score,
+            }
+    return list(pairs.values())
+
+
+def _insert_pairs(db: Session, pairs: List[Dict]) -> int:
+    """組を書き、新しく入った件数を返す（他のバッチ・シャードで書いた組は一意インデックスで無視）"""
+    table = models.DedupePair.__table__
+    if db.get_bind().dialect.name == "mysql":
+        stmt = mysql.insert(table).prefix_with("IGNORE")
+    else:
+        stmt = sqlite.insert(table).on_conflict_do_nothing()
+    return db.execute(stmt, pairs).rowcount
+
+
+def process_sweep_shard(sweep_id: int, shard_no: int, batch_size: int = DEDUPE_BATCH_SIZE):
+    """1シャードをチェックポイントから処理する（別プロセス・別ノードからも実行できる）"""
+    db = SessionLocal()
+    # 顧客の読み出し用（書き込みのコミットでカーソルを閉じないよう別セッション）
+    read_db = SessionLocal()
+    try:
+        sweep = db.get(models.DedupeSweep, sweep_id)
+        # 取れるのは queued/failed のシャードだけ（処理中・完了のシャードは他のワーカーに任せる）
+        claimed = db.execute(
+            update(models.DedupeSweepShard).where(
+                models.DedupeSweepShard.sweep_id == sweep_id,
+                models.DedupeSweepShard.shard_no == shard_no,
+                models.DedupeSweepShard.status.in_([models.ImportStatus.queued, models.ImportStatus.failed])
+            ).values(status=models.ImportStatus.processing, error_message=None)
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return
+        shard = db.query(models.DedupeSweepShard).filter_by(sweep_id=sweep_id, shard_no=shard_no).one()
+
+        config = MatchConfig.from_dict(sweep.match_config)
+        stats = job_stats()
+        try:
+            customer = models.Customer
+            result = read_db.execute(
+                select(*(getattr(customer, field) for field in CustomerRecord.FIELDS)).where(
+                    customer.id > shard.last_customer_id,
+                    customer.id <= shard.max_customer_id
+                ).order_by(customer.id).execution_options(yield_per=batch_size)
+            )
+            for rows in result.partitions(batch_size):
+                batch = [CustomerRecord(*row) for row in rows]
+                pairs = [dict(pair, sweep_id=sweep_id) for pair in _sweep_batch(db, batch, config, stats)]
+                added = _insert_pairs(db, pairs) if pairs else 0
+                shard.last_customer_id = batch[-1].id
+                shard.scanned_count = (shard.scanned_count or 0) + len(batch)
+                shard.pair_count = (shard.pair_count or 0) + added
+                db.commit()
+            shard.status = models.ImportStatus.completed
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            shard.status = models.ImportStatus.failed
+            shard.error_message = str(e)
+            db.commit()
+            print(f"ERROR: dedupe sweep {sweep_id} shard {shard_no}: {str(e)}")
+    finally:
+        read_db.close()
+        db.close()
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # 小さい ID を根にする（クラスタの代表を安定させる）
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            self.parent[root_b] = root_a
+
+
+def build_clusters(db: Session, sweep_id: int, batch_size: int = DEDUPE_CLUSTER_BATCH_SIZE) -> int:
+    """組を union-find でまとめて dedupe_clusters を作り直し、クラスタ数を返す"""
+    cluster_ids = select(models.DedupeCluster.id).where(models.DedupeCluster.sweep_id == sweep_id)
+    db.query(models.DedupeClusterMember).filter(
+        models.DedupeClusterMember.cluster_id.in_(cluster_ids)
+    ).delete(synchronize_session=False)
+    db.query(models.DedupeCluster).filter_by(sweep_id=sweep_id).delete(synchronize_session=False)
+
+    components = _UnionFind()
+    best_score: Dict[int, float] = {}
+    pair = models.DedupePair
+    for customer_id, other_id, score in db.execute(
+        select(pair.customer_id, pair.other_customer_id, pair.similarity_score)
+        .where(pair.sweep_id == sweep_id).execution_options(yield_per=batch_size)
+    ):
+        components.union(customer_id, other_id)
+        score = float(score or 0)
+        for member in (customer_id, other_id):
+            if score > best_score.get(member, 0.0):
+                best_score[member] = score
+
+    members: Dict[int, List[int]] = {}
+    for customer_id in components.parent:
+        members.setdefault(components.find(customer_id), []).append(customer_id)
+
+    count = 0
+    pending: List[List[int]] = []
+
+    def flush():
+        clusters = [
+            models.DedupeCluster(
+                sweep_id=sweep_id, size=len(ids), max_score=max(best_score.get(i, 0.0) for i in ids)
+            )
+            for ids in pending
+        ]
+        db.add_all(clusters)
+        db.flush()
+        db.execute(insert(models.DedupeClusterMember), [
+            {"cluster_id": cluster.id, "customer_id": customer_id}
+            for cluster, ids in zip(clusters, pending)
+            for customer_id in sorted(ids)
+        ])
+        db.commit()
+        pending.clear()
+
+    for root in sorted(members):
+        pending.append(members[root])
+        count += 1
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return count
+
+
+def finalize_sweep(db: Session, sweep_id: int) -> models.DedupeSweep:
+    """全シャードが終わっていればクラスタを作って完了にする（失敗したシャードがあれば failed）"""
+    sweep = db.get(models.DedupeSweep, sweep_id)
+    shards = db.query(models.DedupeSweepShard).filter_by(sweep_id=sweep_id).all()
+    if any(shard.status in (models.ImportStatus.queued, models.ImportStatus.processing) for shard in shards):
+        return sweep
+
+    sweep.pair_count = db.query(func.count(models.DedupePair.id)).filter_by(sweep_id=sweep_id).scalar()
+    failed = [shard for shard in shards if shard.status == models.ImportStatus.failed]
+    if failed:
+        sweep.status = models.ImportStatus.failed
+        sweep.error_message = "; ".join(f"shard {shard.shard_no}: {shard.error_message}" for shard in failed)
+        db.commit()
+        return sweep
+
+    sweep.cluster_count = build_clusters(db, sweep_id)
+    sweep.status = models.ImportStatus.completed
+    sweep.error_message = None
+    sweep.finished_at = datetime.now()
+    db.commit()
+    print(f"✅ dedupe sweep {sweep_id}: 組 {sweep.pair_count} 件 → クラスタ {sweep.cluster_count} 件")
+    return sweep
+
+
+def sweep_in_progress(db: Session, sweep_id: int) -> bool:
+    """処理中のシャードがあるか"""
+    return db.query(models.DedupeSweepShard.id).filter_by(
+        sweep_id=sweep_id, status=models.ImportStatus.processing
+    ).first() is not None
+
+
+def run_sweep(sweep_id: int, max_workers: Optional[int] = None, force: bool = False):
+    """
+    未完了のシャードを処理してクラスタを作る（BackgroundTasks・管理コマンド用。再実行で再開）
+    max_workers=0 ならこのプロセスで順に処理する。
+    処理中（processing）のシャードは他のワーカーが処理しているものとして触らない。
+    force=True なら processing のまま残ったシャードもチェックポイントから取り直す（落ちたプロセスの後始末用）
+    """
+    db = SessionLocal()
+    try:
+        sweep = db.get(models.DedupeSweep, sweep_id)
+        if not sweep:
+            return
+        sweep.status = models.ImportStatus.processing
+        retry = [models.ImportStatus.failed, models.ImportStatus.processing] if force else [models.ImportStatus.failed]
+        # 失敗・中断したシャードはチェックポイントからやり直す
+        db.execute(
+            update(models.DedupeSweepShard).where(
+                models.DedupeSweepShard.sweep_id == sweep_id,
+                models.DedupeSweepShard.status.in_(retry)
+            ).values(status=models.ImportStatus.queued, error_message=None)
+        )
+        db.commit()
+        shard_nos = list(db.execute(
+            select(models.DedupeSweepShard.shard_no).where(
+                models.DedupeSweepShard.sweep_id == sweep_id,
+                models.DedupeSweepShard.status == models.ImportStatus.queued
+            ).order_by(models.DedupeSweepShard.shard_no)
+        ).scalars())
+    finally:
+        db.close()
+
+    workers = min(len(shard_nos), DEDUPE_WORKERS if max_workers is None else max_workers)
+    if workers <= 0:
+        for shard_no in shard_nos:
+            process_sweep_shard(sweep_id, shard_no)
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {shard_no: pool.submit(process_sweep_shard, sweep_id, shard_no) for shard_no in shard_nos}
+            for shard_no, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が落ちた場合
+                    db = SessionLocal()
+                    try:
+                        shard = db.query(models.DedupeSweepShard).filter_by(sweep_id=sweep_id, shard_no=shard_no).one()
+                        shard.status = models.ImportStatus.failed
+                        shard.error_message = f"worker error: {e}"
+                        db.commit()
+                    finally:
+                        db.close()
+
+    db = SessionLocal()
+    try:
+        finalize_sweep(db, sweep_id)
+    finally:
+        db.close()
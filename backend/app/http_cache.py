@@ -0,0 +1,106 @@
+"""
+HTTP キャッシュ（ETag / Last-Modified / 304）と短TTLのレスポンスキャッシュ
+
+ポーリングされるインポートのステータス・履歴用。
+完了・失敗したインポートは変化しないので Cache-Control で再利用させ、
+それ以外は ETag で再検証させる（一致すれば 304 でボディを返さない）。
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Hashable, Optional, Tuple
+import hashlib
+import os
+import threading
+import time
+from fastapi import Request, Response
+
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "2"))
+# 完了・失敗したインポートのブラウザキャッシュ秒数
+TERMINAL_MAX_AGE_SECONDS = int(os.getenv("TERMINAL_MAX_AGE_SECONDS", "60"))
+
+
+def make_etag(*parts) -> str:
+    """値の並びから弱い ETag を作る"""
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def http_date(value: Optional[datetime]) -> Optional[str]:
+    """Last-Modified 用の日時文字列（タイムゾーンなしは UTC とみなす）"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """If-None-Match（優先）または If-Modified-Since が一致するか"""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime] = None, max_age: Optional[int] = None) -> Dict[str, str]:
+    """ETag / Last-Modified / Cache-Control ヘッダー"""
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    headers["Cache-Control"] = f"private, max-age={max_age}" if max_age else "no-cache"
+    return headers
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+class TTLCache:
+    """有効期限付きの小さなインメモリキャッシュ"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[float, object]] = {}
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # 期限切れを掃除しても溢れるなら一番古いものを捨てる
+                now = time.monotonic()
+                for stale in [k for k, (expires_at, _) in self._entries.items() if expires_at < now]:
+                    del self._entries[stale]
+                if len(self._entries) >= self.max_entries:
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 履歴ページ（skip, limit）→ (etag, JSON ボディ)
+history_cache = TTLCache(HISTORY_CACHE_TTL_SECONDS)
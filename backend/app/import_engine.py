@@ -1,5 +1,11 @@
-from typing import Dict, Any, List
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Sequence
+import os
 import re
+from .address_lsh import AddressLSH
+from .canonicalize import (
+    nfkc, canonical_email, canonical_phone, canonical_name, canonical_address, match_keys
+)
 
 def normalize_value(value: Any, rule: str) -> str:
     """値を正規化"""
@@ -11,10 +17,16 @@ def normalize_value(value: Any, rule: str) -> str:
     if rule == "trim":
         return s
     elif rule == "email":
-        return s.lower()
+        return canonical_email(s)
     elif rule == "phone":
-        # ハイフン、スペース、括弧を除去
-        return re.sub(r"[\s\-()（）]", "", s)
+        # 全角数字を半角にし、ハイフン、スペース、括弧を除去
+        return re.sub(r"[\s\-()（）]", "", nfkc(s))
+    elif rule == "phone_e164":
+        return canonical_phone(s)
+    elif rule == "name_key":
+        return canonical_name(s)
+    elif rule == "address_key":
+        return canonical_address(s)
     
     return s
 
@@ -50,6 +62,51 @@ def levenshtein_distance(s1: str, s2: str) -> int:
     
     return previous_row[-1]
 
+def bounded_levenshtein_distance(s1: str, s2: str, max_distance: int) -> int:
+    """
+    Levenshtein距離（max_distance を超える場合は max_distance + 1）
+    対角線から max_distance 以内の帯だけを計算し、行の最小値が超えた時点で打ち切る
+    """
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    if len(s1) - len(s2) > max_distance:
+        return max_distance + 1
+    if not s2:
+        return len(s1)
+
+    over = max_distance + 1
+    previous = [j if j <= max_distance else over for j in range(len(s2) + 1)]
+    for i, c1 in enumerate(s1, start=1):
+        low = max(1, i - max_distance)
+        high = min(len(s2), i + max_distance)
+        current = [over] * (len(s2) + 1)
+        current[0] = i if i <= max_distance else over
+        for j in range(low, high + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (c1 != s2[j - 1]),
+                over
+            )
+        if min(current[low - 1:high + 1]) > max_distance:
+            return over
+        previous = current
+    return previous[-1]
+
+
+def similarity_at_least(s1: str, s2: str, threshold: float) -> float:
+    """
+    similarity_score と同じ値。ただし threshold 未満になる組は threshold 未満の適当な値を返す
+    （閾値を超えるかどうかだけが必要な住所の照合用。距離の計算を閾値の範囲で打ち切る）
+    """
+    if not s1 or not s2:
+        return 0.0
+    max_len = max(len(s1), len(s2))
+    max_distance = int((1.0 - threshold) * max_len + 1e-9)
+    distance = bounded_levenshtein_distance(s1, s2, max_distance)
+    return 1.0 - (distance / max_len)
+
+
 def similarity_score(s1: str, s2: str) -> float:
     """文字列の類似度を計算（0.0 ~ 1.0）"""
     if not s1 or not s2:
@@ -62,76 +119,223 @@ def similarity_score(s1: str, s2: str) -> float:
     distance = levenshtein_distance(s1, s2)
     return 1.0 - (distance / max_len)
 
+# 候補がこの件数以上なら NumPy でまとめて類似度を計算する
+BATCH_SIMILARITY_CUTOFF = int(os.getenv("BATCH_SIMILARITY_CUTOFF", "16"))
+# 1回の計算で扱う候補数（メモリは 候補数 × 最大文字数 の int32 配列数個分）
+BATCH_SIMILARITY_BLOCK = 4096
+
+
+def _encode_padded(strings: Sequence[str]) -> "np.ndarray":
+    """文字列をコードポイントの2次元配列に（足りない部分は -1 で埋める）"""
+    import numpy as np
+
+    width = max(len(s) for s in strings)
+    codes = np.full((len(strings), width), -1, dtype=np.int32)
+    for i, s in enumerate(strings):
+        if s:
+            codes[i, :len(s)] = np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32)
+    return codes
+
+
+def batch_similarity_scores(query: str, candidates: Sequence[str]) -> "np.ndarray":
+    """
+    1つの文字列と候補群の類似度をまとめて計算（similarity_score と同じ値）
+    編集距離の DP を候補方向にベクトル化し、クエリの文字ごとに1行ずつ進める。
+    行内の挿入（左隣 + 1）は cur[j] - j の累積最小値で求める。
+    """
+    import numpy as np  # 起動時間短縮のため初回利用時に import
+
+    result = np.zeros(len(candidates), dtype=np.float64)
+    if not query or not candidates:
+        return result
+
+    query_codes = np.frombuffer(query.encode("utf-32-le"), dtype=np.uint32).astype(np.int32)
+    for start in range(0, len(candidates), BATCH_SIMILARITY_BLOCK):
+        block = candidates[start:start + BATCH_SIMILARITY_BLOCK]
+        lengths = np.fromiter((len(s) for s in block), dtype=np.int64, count=len(block))
+        if not lengths.any():
+            continue
+        codes = _encode_padded(block)
+        width = codes.shape[1]
+        offsets = np.arange(width + 1, dtype=np.int32)
+
+        previous = np.broadcast_to(offsets, (len(block), width + 1)).copy()
+        for i, code in enumerate(query_codes, start=1):
+            substitution = previous[:, :-1] + (codes != code)
+            deletion = previous[:, 1:] + 1
+            current = np.empty_like(previous)
+            current[:, 0] = i
+            current[:, 1:] = np.minimum(substitution, deletion)
+            previous = np.minimum.accumulate(current - offsets, axis=1) + offsets
+
+        distances = previous[np.arange(len(block)), lengths]
+        max_lengths = np.maximum(lengths, len(query))
+        scores = 1.0 - distances / max_lengths
+        scores[lengths == 0] = 0.0
+        result[start:start + len(block)] = scores
+    return result
+
+
+def similarity_scores(query: str, candidates: Sequence[str]) -> List[float]:
+    """候補ごとの類似度（件数が BATCH_SIMILARITY_CUTOFF 以上なら NumPy でまとめて計算）"""
+    if len(candidates) >= BATCH_SIMILARITY_CUTOFF:
+        return batch_similarity_scores(query, candidates).tolist()
+    return [similarity_score(query, candidate) for candidate in candidates]
+
+
+# ジョブ内で同じ文字列の組の類似度を再利用する件数の上限（0 で無効）
+SIMILARITY_MEMO_SIZE = int(os.getenv("SIMILARITY_MEMO_SIZE", "200000"))
+
+
+class SimilarityMemo:
+    """
+    類似度の LRU メモ（1ジョブ内で使う）
+    同じ氏名・住所の行が続くと、チャンク内の同じ既存顧客との組を何度も計算するため
+    """
+
+    def __init__(self, max_entries: int = SIMILARITY_MEMO_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, float]" = OrderedDict()
+
+    def scores(self, query: str, candidates: Sequence[str]) -> List[float]:
+        """similarity_scores と同じ値（メモにない組だけ計算）"""
+        result: List[Optional[float]] = [None] * len(candidates)
+        missing = []
+        for i, candidate in enumerate(candidates):
+            # 類似度は対称なので組の順序をそろえる
+            key = (query, candidate) if query <= candidate else (candidate, query)
+            score = self._entries.get(key)
+            if score is None:
+                missing.append((i, key))
+            else:
+                self._entries.move_to_end(key)
+                result[i] = score
+        self.hits += len(candidates) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = similarity_scores(query, [candidates[i] for i, _ in missing])
+            for (i, key), score in zip(missing, computed):
+                result[i] = score
+                self._entries[key] = score
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def at_least(self, s1: str, s2: str, threshold: float) -> float:
+        """similarity_at_least と同じ（正確な値を計算できた組だけメモする）"""
+        key = (s1, s2) if s1 <= s2 else (s2, s1)
+        score = self._entries.get(key)
+        if score is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return score
+        self.misses += 1
+        score = similarity_at_least(s1, s2, threshold)
+        if score >= threshold:
+            self._entries[key] = score
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return score
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def build_match_index(existing_customers: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """既存顧客のマッチキー索引を作成（キー → 顧客リスト）"""
+    index = {"email": {}, "phone": {}, "name": {}, "id": {}}
+    for customer in existing_customers:
+        add_to_match_index(index, customer)
+    return index
+
+def add_to_match_index(index: Dict[str, Dict[str, Any]], customer: Dict[str, Any]):
+    """索引に顧客を1件追加（同じバッチで作成した顧客を後の行の照合に使う）"""
+    keys = match_keys(customer)
+    for field in ("email", "phone", "name"):
+        if keys[field]:
+            index[field].setdefault(keys[field], []).append(customer)
+    index["id"][customer["id"]] = customer
+
+def _score_name_match(
+    customer: Dict[str, Any],
+    name_sim: float,
+    new_address_key: str,
+    threshold: float,
+    address_penalty: float = 0.7,
+    memo: Optional[SimilarityMemo] = None
+) -> Dict[str, Any]:
+    """名前一致/類似の顧客について住所を加味したスコアを計算"""
+    cust_name = customer.get("full_name", "")
+    cust_address = customer.get("address_line1", "") or customer.get("address", "")
+    cust_address_key = canonical_address(cust_address) if cust_address else ""
+
+    reason = f"名前類似: {cust_name} (類似度: {name_sim:.2f})"
+
+    # 住所もチェック
+    if new_address_key and cust_address_key:
+        if new_address_key == cust_address_key:
+            addr_sim = 1.0
+        elif memo is not None:
+            addr_sim = memo.at_least(new_address_key, cust_address_key, threshold)
+        else:
+            # 閾値未満なら値は使わない（氏名の類似度 × address_penalty）ので打ち切ってよい
+            addr_sim = similarity_at_least(new_address_key, cust_address_key, threshold)
+        if addr_sim >= threshold:
+            reason += f" / 住所類似: {cust_address} (類似度: {addr_sim:.2f})"
+            combined_score = (name_sim + addr_sim) / 2
+        else:
+            combined_score = name_sim * address_penalty  # 住所が一致しない場合はスコア減
+    else:
+        combined_score = name_sim
+
+    return {
+        "customer_id": customer["id"],
+        "match_reason": reason,
+        "similarity_score": combined_score
+    }
+
 def find_duplicate_candidates(
     new_row: Dict[str, Any],
     existing_customers: List[Dict[str, Any]],
-    threshold: float = 0.85
+    threshold: float = 0.85,
+    index: Optional[Dict[str, Dict[str, List[Dict[str, Any]]]]] = None,
+    address_index: Optional[AddressLSH] = None,
+    config=None,
+    stats=None,
+    exclude_ids=None
 ) -> List[Dict[str, Any]]:
-    """重複候補を検出"""
-    candidates = []
-    
-    new_email = new_row.get("email", "")
-    new_phone = new_row.get("phone", "")
-    new_name = new_row.get("full_name", "")
-    new_address = new_row.get("address_line1", "") or new_row.get("address", "")
-    
-    # 🔥 email完全一致チェック
-    if new_email:
-        for customer in existing_customers:
-            if customer.get("email") == new_email:
-                candidates.append({
-                    "customer_id": customer["id"],
-                    "match_reason": f"Email完全一致: {new_email}",
-                    "similarity_score": 1.0
-                })
-                return candidates  # email完全一致があれば他は見ない
-    
-    # 🔥 phone完全一致チェック
-    if new_phone:
-        for customer in existing_customers:
-            if customer.get("phone") == new_phone:
-                candidates.append({
-                    "customer_id": customer["id"],
-                    "match_reason": f"電話番号完全一致: {new_phone}",
-                    "similarity_score": 1.0
-                })
-                return candidates  # phone完全一致があれば他は見ない
-    
-    # 名前・住所の類似度チェック
-    if not new_name:
-        return candidates
-    
-    for customer in existing_customers:
-        cust_name = customer.get("full_name", "")
-        cust_address = customer.get("address_line1", "") or customer.get("address", "")
-        
-        if not cust_name:
-            continue
-        
-        name_sim = similarity_score(new_name, cust_name)
-        
-        # 名前の類似度が閾値以上
-        if name_sim >= threshold:
-            reason = f"名前類似: {cust_name} (類似度: {name_sim:.2f})"
-            
-            # 住所もチェック
-            if new_address and cust_address:
-                addr_sim = similarity_score(new_address, cust_address)
-                if addr_sim >= threshold:
-                    reason += f" / 住所類似: {cust_address} (類似度: {addr_sim:.2f})"
-                    combined_score = (name_sim + addr_sim) / 2
-                else:
-                    combined_score = name_sim * 0.7  # 住所が一致しない場合はスコア減
-            else:
-                combined_score = name_sim
-            
-            candidates.append({
-                "customer_id": customer["id"],
-                "match_reason": reason,
-                "similarity_score": combined_score
-            })
-    
-    # スコアでソート
-    candidates.sort(key=lambda x: x["similarity_score"], reverse=True)
-    
-    return candidates[:5]  # 上位5件まで
+    """
+    重複候補を検出
+    index（build_match_index の結果）を渡すと、正規化キーの完全一致はO(1)で解決する
+    address_index（AddressLSH）を渡すと、名前が似ていない顧客も住所の類似で候補にする
+    🆕 ルールは matchers のレジストリからコスト順に実行する
+    config（MatchConfig）で閾値・上位件数を、stats（MatchStats）でルールごとの集計を受け取る
+    exclude_ids の顧客は候補にしない（既存顧客どうしの照合で自分自身を除く）
+    """
+    from .matchers import MatchConfig, MatchContext, run_matchers
+
+    if config is None:
+        config = MatchConfig(threshold=threshold)
+    if index is None:
+        index = build_match_index(existing_customers)
+
+    ctx = MatchContext(
+        new_row=new_row,
+        keys=match_keys(new_row),
+        existing_customers=existing_customers,
+        index=index,
+        address_index=address_index,
+        config=config,
+        memo=stats.memo if stats is not None else None,
+        exclude=frozenset(exclude_ids or ())
+    )
+    return run_matchers(ctx, stats)
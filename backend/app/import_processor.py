@@ -1,10 +1,36 @@
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.orm import Session
-from . import crud, models
-from .import_engine import normalize_value, validate_value, find_duplicate_candidates
+from . import crud, models, upload_cache
+from .import_engine import (
+    normalize_value, validate_value, find_duplicate_candidates, build_match_index, add_to_match_index
+)
+from .canonicalize import canonical_phone
+from .address_lsh import AddressLSH
 from .s3_service import s3_service
-import pandas as pd
+from .records import CustomerRecord, SourceRow, SourceRows
+from .matchers import MatchConfig, job_stats
+from .value_dictionary import ValueDictionary
 from io import BytesIO
+import hashlib
 import json
+from itertools import islice
+from typing import Optional
+
+# 既存顧客を取得する単位（この行数ごとにマッチキーで候補を検索）
+MATCH_CHUNK_SIZE = 500
+
+# 行単位で error 行にして処理を続けるDBエラー（一意制約違反・列に収まらない値など）
+ROW_ERRORS = (IntegrityError, DataError)
+
+# フィールドごとの正規化ルール（未指定は trim）
+FIELD_RULES = {
+    "email": "email",
+}
+
+# フィールドごとのバリデーション（正規化後の空でない値に適用）
+FIELD_VALIDATIONS = {
+    "email": "email",
+}
 
 
 def empty_to_none(value):
@@ -14,6 +40,482 @@ def empty_to_none(value):
     return value
 
 
+def customer_to_match_dict(c: models.Customer) -> CustomerRecord:
+    """重複検知用に顧客をレコードへ変換"""
+    return CustomerRecord(*(getattr(c, field) for field in CustomerRecord.FIELDS))
+
+
+def load_candidate_customers(db: Session, rows: list) -> list:
+    """行のマッチキーと一致する既存顧客だけをインデックス経由で取得（必要な列だけ）"""
+    keys = {column: set() for column in ("email", "address_band") + models.MATCH_KEY_COLUMNS}
+    for row in rows:
+        for column, values in crud.row_match_keys(row).items():
+            keys[column].update(values)
+
+    return [
+        CustomerRecord(*values)
+        for values in crud.get_customer_values_by_match_keys(db, keys, CustomerRecord.FIELDS)
+    ]
+
+
+# json.dumps(..., ensure_ascii=False) と同じ出力（行ごとにエンコーダを作らない）
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def row_raw_data(row) -> str:
+    """行の全列の JSON（ImportRow.raw_data と行ハッシュの元。キャッシュの行は保存済みの値を使う）"""
+    if isinstance(row, SourceRow):
+        if row.raw_data is not None:
+            return row.raw_data
+        return _encode_json(dict(zip(row.layout.columns, row.values)))
+    return _encode_json(dict(row))
+
+
+def prepare_row(row: dict, mapping: dict):
+    """マッピング・正規化・バリデーション（raw_data, mapped_data, normalized_data, validation_errors を返す）"""
+    raw_data = row_raw_data(row)
+    normalized_data = {}
+    validation_errors = []
+
+    # マッピング（ファイルの行は列位置を解決済み）
+    if isinstance(row, SourceRow):
+        mapped_data = row.project(mapping)
+    else:
+        mapped_data = {
+            db_field: row[excel_col]
+            for db_field, excel_col in mapping.items()
+            if excel_col and excel_col in row
+        }
+
+    # 正規化
+    for field, value in mapped_data.items():
+        normalized_data[field] = normalize_value(value, FIELD_RULES.get(field, "trim"))
+
+    # バリデーション
+    for field, rule in FIELD_VALIDATIONS.items():
+        if normalized_data.get(field):
+            error = validate_value(normalized_data[field], rule)
+            if error:
+                validation_errors.append(f"{field}: {error}")
+
+    return raw_data, mapped_data, normalized_data, validation_errors
+
+
+def new_value_dictionary() -> ValueDictionary:
+    """ジョブ1件分の列ごとの正規化・バリデーション結果の表"""
+    return ValueDictionary(FIELD_RULES, FIELD_VALIDATIONS)
+
+
+def prepare_rows(rows: list, mapping: dict, dictionary: ValueDictionary = None) -> list:
+    """
+    prepare_row の一括版（結果は同じ）
+    🆕 dictionary を渡すと列ごとに異なる値だけを正規化・バリデーションし、結果を各行に戻す
+    """
+    if dictionary is None:
+        return [prepare_row(row, mapping) for row in rows]
+
+    raw_rows = [row_raw_data(row) for row in rows]
+    mapped_rows = [
+        row.project(mapping) if isinstance(row, SourceRow) else {
+            db_field: row[excel_col]
+            for db_field, excel_col in mapping.items()
+            if excel_col and excel_col in row
+        }
+        for row in rows
+    ]
+    return [
+        (raw_data, mapped_data, normalized_data, validation_errors)
+        for raw_data, mapped_data, (normalized_data, validation_errors)
+        in zip(raw_rows, mapped_rows, dictionary.encode_rows(mapped_rows))
+    ]
+
+
+def _process_row(
+    db: Session,
+    import_id: int,
+    idx: int,
+    raw_data: str,
+    mapped_data: dict,
+    normalized_data: dict,
+    validation_errors: list,
+    existing_customers_dict: list,
+    existing_index: dict,
+    address_index: AddressLSH = None,
+    row_hash: str = None,
+    check_exact: bool = True,
+    match_config=None,
+    match_stats=None,
+    candidates: list = None
+):
+    """
+    1行を処理し (inserted, errors, candidates) の件数を返す（完全一致を解決済みなら check_exact=False）
+    match_config / match_stats は find_duplicate_candidates の config / stats
+    candidates を渡すと重複候補の検出はせずにその結果を使う
+    🆕 コミットはしない（フラッシュだけ）。チャンク単位で run_chunk_transaction がコミットする
+    """
+    mapped_json = json.dumps(mapped_data, ensure_ascii=False)
+    normalized_json = json.dumps(normalized_data, ensure_ascii=False)
+
+    # エラーがあればエラー行として保存
+    if validation_errors:
+        crud.create_import_row(
+            db, import_id, idx, raw_data, mapped_json, normalized_json, validation_errors, "error", row_hash,
+            commit=False
+        )
+        return 0, 1, 0
+
+    # email/phoneで完全一致チェック
+    existing_customer = None
+    if not check_exact:
+        pass
+    elif normalized_data.get("email"):
+        existing_customer = crud.get_customer_by_email(
+            db, normalized_data["email"])
+    elif normalized_data.get("phone"):
+        existing_customer = crud.get_customer_by_phone_key(
+            db, canonical_phone(normalized_data["phone"]))
+
+    if existing_customer:
+        # 既存顧客更新
+        for key, value in normalized_data.items():
+            if value:
+                setattr(existing_customer, key, value)
+        db.flush()
+
+        crud.create_import_row(
+            db, import_id, idx, raw_data, mapped_json, normalized_json, [], "inserted", row_hash, commit=False
+        )
+        return 1, 0, 0
+    else:
+        # 重複候補検出
+        if candidates is None:
+            candidates = find_duplicate_candidates(
+                normalized_data, existing_customers_dict,
+                index=existing_index, address_index=address_index,
+                config=match_config, stats=match_stats)
+
+        if candidates:
+            # 候補あり
+            db_row = crud.create_import_row(
+                db, import_id, idx, raw_data, mapped_json, normalized_json, [], "candidate", row_hash,
+                commit=False
+            )
+            # 顧客の変更時に再判定する行を引けるようにキーを残す
+            crud.create_row_match_keys(db, db_row.id, normalized_data)
+
+            for candidate in candidates:
+                crud.create_duplicate_candidate(
+                    db,
+                    import_row_id=db_row.id,
+                    existing_customer_id=candidate["customer_id"],
+                    match_reason=candidate["match_reason"],
+                    similarity_score=candidate["similarity_score"],
+                    commit=False
+                )
+
+            return 0, 0, 1
+        else:
+            # 新規作成（同じ email の顧客が先に作成されていれば一意制約違反になり、
+            # _process_row_isolated が既存顧客の更新としてやり直す）
+            crud.create_customer(
+                db=db,
+                full_name=normalized_data.get("full_name"),
+                email=empty_to_none(normalized_data.get("email")),
+                phone=empty_to_none(normalized_data.get("phone")),
+                address=normalized_data.get("address"),
+                commit=False
+            )
+            crud.create_import_row(
+                db, import_id, idx, raw_data, mapped_json, normalized_json, [], "inserted", row_hash, commit=False
+            )
+            return 1, 0, 0
+
+
+def _process_row_isolated(db: Session, import_id: int, idx: int, prepared_row: tuple, row_hash: str,
+                          process) -> tuple:
+    """
+    process(force_exact) を行の SAVEPOINT の中で実行して (inserted, errors, candidates) を返す
+    失敗したら SAVEPOINT まで戻し、email の一意制約違反（同じ email の顧客が先に作成されていた）なら
+    その顧客の更新としてやり直す。それ以外はDBのエラーメッセージを error 行に残して続ける
+    """
+    raw_data, mapped_data, normalized_data, _ = prepared_row
+    error = None
+    for force_exact in (False, True):
+        try:
+            with db.begin_nested():
+                return process(force_exact)
+        except ROW_ERRORS as e:
+            error = e
+        email = normalized_data.get("email")
+        if not (isinstance(error, IntegrityError) and email and crud.get_customer_by_email(db, email)):
+            break
+
+    message = str(getattr(error, "orig", None) or error)[:500]
+    print(f"WARN: 行 {idx} の保存に失敗: {message}")
+    crud.create_import_row(
+        db, import_id, idx, raw_data, json.dumps(mapped_data, ensure_ascii=False),
+        json.dumps(normalized_data, ensure_ascii=False), [f"database: {message}"], "error", row_hash,
+        commit=False
+    )
+    return 0, 1, 0
+
+
+def run_chunk_transaction(db: Session, persist) -> tuple:
+    """
+    persist(isolate) でチャンクを1トランザクションで保存してコミットし、その戻り値を返す
+    行のDBエラー（ROW_ERRORS）で失敗したらチャンクをロールバックし、isolate=True
+    （行ごとに SAVEPOINT を置き、失敗した行だけ error 行にする）でやり直す
+    """
+    try:
+        result = persist(False)
+        db.commit()
+        return result
+    except ROW_ERRORS as e:
+        db.rollback()
+        print(f"WARN: チャンクの保存に失敗したため行ごとの SAVEPOINT でやり直し: {getattr(e, 'orig', e)}")
+    result = persist(True)
+    db.commit()
+    return result
+
+
+def hash_mapping(mapping: dict) -> str:
+    """マッピングのハッシュ（キー順に依存しない）"""
+    return hashlib.sha256(json.dumps(mapping, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def hash_row(mapping_hash: str, raw_data: str) -> str:
+    """マッピング + 生データの行ハッシュ"""
+    return hashlib.sha256(f"{mapping_hash}:{raw_data}".encode("utf-8")).hexdigest()
+
+
+def replay_previous_import(db: Session, db_import: models.Import, content_hash: str, mapping_hash: str) -> bool:
+    """
+    同じ内容・同じマッピングの完了済みインポートがあり、その後顧客に変更がなければ
+    再処理せずに結果を引き継ぐ（replayed_from_id で元のインポートにリンク）
+    """
+    db_import.content_hash = content_hash
+    db_import.mapping_hash = mapping_hash
+    db.commit()
+
+    previous = crud.get_reusable_import(db, content_hash, mapping_hash, exclude_id=db_import.id)
+    if not previous or previous.customers_fingerprint != crud.get_customers_fingerprint(db):
+        return False
+
+    db_import.replayed_from_id = previous.replayed_from_id or previous.id
+    db_import.total_rows = previous.total_rows
+    db_import.inserted_count = previous.inserted_count
+    db_import.error_count = previous.error_count
+    db_import.candidate_count = previous.candidate_count
+    db_import.customers_fingerprint = previous.customers_fingerprint
+    db_import.status = models.ImportStatus.completed
+    db.commit()
+    return True
+
+
+def open_import_stream(db: Session, db_import: models.Import, trusted_etag: Optional[str], mapping_hash: str):
+    """
+    大きな CSV なら S3 から読みながら取り込む CsvStream を返す（対象外なら None。import_stream を参照）
+    内容のハッシュは読み終えるまで分からないので、信頼できる ETag がなく前回の結果を引き継げる可能性があればダウンロードする
+    """
+    from .import_stream import IMPORT_STREAM_MIN_BYTES, CsvStream
+
+    if not IMPORT_STREAM_MIN_BYTES or not db_import.filename.endswith('.csv'):
+        return None
+    size = s3_service.get_object_size(db_import.s3_key)
+    if not size or size < IMPORT_STREAM_MIN_BYTES:
+        return None
+    if not trusted_etag and crud.has_reusable_import(
+        db, mapping_hash, crud.get_customers_fingerprint(db), exclude_id=db_import.id
+    ):
+        return None
+    body = s3_service.open_object(db_import.s3_key)
+    if body is None:
+        raise Exception(f"Failed to download file from S3: {db_import.s3_key}")
+    db_import.mapping_hash = mapping_hash
+    db.commit()
+    return CsvStream(body, size_bytes=size)
+
+
+def read_dataframe(filename: str, file_bytes: bytes):
+    """ファイル拡張子で判定して DataFrame に読み込む"""
+    import pandas as pd  # 起動時間短縮のため初回利用時に import
+
+    if filename.endswith('.csv'):
+        return pd.read_csv(BytesIO(file_bytes), dtype=str)
+    elif filename.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(BytesIO(file_bytes))
+    else:
+        raise Exception(f"Unsupported file type: {filename}")
+
+
+def read_rows(filename: str, file_bytes: bytes) -> SourceRows:
+    """ファイル拡張子で判定して読み込み、行のシーケンス（dict 互換の SourceRow）に変換"""
+    # 行ごとの dict は作らず、値のタプル + 共有の列位置で持つ（空セルの NaN は None）
+    return SourceRows.from_dataframe(read_dataframe(filename, file_bytes))
+
+
+def read_upload_preview(s3_key: str, filename: str, columns: list = None, limit: int = 20) -> tuple:
+    """
+    アップロード済みファイルの先頭 limit 行 (rows, total_rows, cached) を返す
+    解析済みキャッシュがあれば columns の列だけ読み、なければダウンロード・解析してキャッシュに保存する
+    """
+    object_etag = s3_service.get_object_etag(s3_key)
+    entry = upload_cache.lookup(s3_key, object_etag)
+    cached = entry is not None
+    if entry is None:
+        file_bytes, sha256 = s3_service.download_file_with_hash(s3_key)
+        if not file_bytes:
+            return None, 0, False
+        df = read_dataframe(filename, file_bytes)
+        entry = upload_cache.store(s3_key, object_etag, sha256, df)
+        if entry is None:
+            rows = SourceRows.from_dataframe(df)
+            return rows[:limit], len(rows), False
+    return list(upload_cache.read_rows(entry, columns, limit)), entry.num_rows, cached
+
+
+def iter_chunks(indexed_rows, size: int = None):
+    """(row_index, row) の列を size 行（既定 MATCH_CHUNK_SIZE）ずつのリストにする"""
+    indexed_rows = iter(indexed_rows)
+    while True:
+        chunk = list(islice(indexed_rows, size or MATCH_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prepare_chunk(chunk: list, mapping: dict, mapping_hash: str, value_dictionary: ValueDictionary = None) -> tuple:
+    """チャンクの正規化と行ハッシュ (row_indexes, prepared, row_hashes)"""
+    prepared = prepare_rows([row for _, row in chunk], mapping, value_dictionary)
+    row_hashes = [hash_row(mapping_hash, raw_data) for raw_data, _, _, _ in prepared]
+    return [idx for idx, _ in chunk], prepared, row_hashes
+
+
+def new_upsert_stats() -> dict:
+    """email をキーにした一括 upsert の行ごとの結果の集計（Import.metrics["upsert"]）"""
+    return {"inserted": 0, "updated": 0}
+
+
+def process_rows(db: Session, import_id: int, mapping: dict, indexed_rows, mapping_hash: str = None,
+                 match_config=None, match_stats=None, value_dictionary: ValueDictionary = None):
+    """
+    (row_index, row) の列を MATCH_CHUNK_SIZE 行ずつ処理し (inserted, errors, candidates) の件数を返す
+    シャード処理でも使うため、row_index はファイル全体での行番号
+    """
+    mapping_hash = mapping_hash or hash_mapping(mapping)
+    value_dictionary = value_dictionary or new_value_dictionary()
+    return process_prepared_chunks(
+        db, import_id,
+        (prepare_chunk(chunk, mapping, mapping_hash, value_dictionary) for chunk in iter_chunks(indexed_rows)),
+        match_config=match_config, match_stats=match_stats
+    )
+
+
+def process_prepared_chunks(db: Session, import_id: int, prepared_chunks, match_config=None, match_stats=None,
+                            upsert_stats: dict = None):
+    """
+    prepare_chunk 済みのチャンクを順に照合・保存し (inserted, errors, candidates) の件数を返す
+    🆕 チャンクごとに1トランザクション（行ごとのコミットはしない）。失敗した行だけ error 行にして続ける
+    email が既存顧客と一致する行と、新しい email で候補のない行は1文の upsert にまとめ、
+    その行ごとの結果（新規 / 更新）を upsert_stats（new_upsert_stats）に数える
+    """
+    inserted_count = 0
+    error_count = 0
+    candidate_count = 0
+
+    for row_indexes, prepared, row_hashes in prepared_chunks:
+        # チャンク内の行とマッチキーを共有する既存顧客だけを取得（全件スキャンしない）
+        # 前のチャンクで作成・更新した顧客も見えるよう、照合と保存はチャンクごとに順に行う
+        existing_customers_dict = load_candidate_customers(
+            db, [normalized for _, _, normalized, errors in prepared if not errors]
+        )
+        # 正規化キーの索引（完全一致はハッシュ参照で解決）
+        existing_index = build_match_index(existing_customers_dict)
+        address_index = AddressLSH()
+        address_index.add_many(existing_customers_dict)
+
+        # 過去に取り込み済みの同一行（同じマッピング・同じ生データ）は再処理しない
+        known_hashes = crud.get_inserted_row_hashes(db, row_hashes)
+        existing_emails = {c["email"] for c in existing_customers_dict if c.get("email")}
+
+        def process(offset: int, candidates: list = None) -> tuple:
+            raw_data, mapped_data, normalized_data, validation_errors = prepared[offset]
+            row_hash = row_hashes[offset]
+            if row_hash in known_hashes and not validation_errors:
+                crud.create_import_row(
+                    db, import_id, row_indexes[offset], raw_data, json.dumps(mapped_data, ensure_ascii=False),
+                    json.dumps(normalized_data, ensure_ascii=False), [], "inserted", row_hash, commit=False
+                )
+                return 1, 0, 0
+            return _process_row(
+                db, import_id, row_indexes[offset], raw_data, mapped_data, normalized_data, validation_errors,
+                existing_customers_dict, existing_index, address_index, row_hash,
+                match_config=match_config, match_stats=match_stats, candidates=candidates
+            )
+
+        def persist(isolate: bool) -> tuple:
+            counts = [0, 0, 0]
+            upsert_offsets = []
+            found = {}
+            if not isolate:
+                # email が既存顧客と一致する行と、新しい email で候補のない行は1文の upsert でまとめて保存
+                # （やり直しでは1行ずつ email で引いて更新・作成する）
+                for offset, (_, _, normalized_data, validation_errors) in enumerate(prepared):
+                    email = normalized_data.get("email")
+                    if validation_errors or not email or row_hashes[offset] in known_hashes:
+                        continue
+                    if email not in existing_emails:
+                        found[offset] = find_duplicate_candidates(
+                            normalized_data, existing_customers_dict,
+                            index=existing_index, address_index=address_index,
+                            config=match_config, stats=match_stats)
+                        if found[offset]:
+                            continue
+                    upsert_offsets.append(offset)
+            outcomes = []
+            if upsert_offsets:
+                outcomes = crud.upsert_customers(db, [prepared[offset][2] for offset in upsert_offsets], commit=False)
+                crud.create_import_rows(db, [
+                    {
+                        "import_id": import_id,
+                        "row_index": row_indexes[offset],
+                        "raw_data": prepared[offset][0],
+                        "mapped_data": json.dumps(prepared[offset][1], ensure_ascii=False),
+                        "normalized_data": json.dumps(prepared[offset][2], ensure_ascii=False),
+                        "validation_errors": [],
+                        "status": models.RowStatus.inserted,
+                        "row_hash": row_hashes[offset],
+                    }
+                    for offset in upsert_offsets
+                ], commit=False)
+                counts[0] += len(upsert_offsets)
+
+            upserted = set(upsert_offsets)
+            for offset in range(len(prepared)):
+                if offset in upserted:
+                    continue
+                if isolate:
+                    row_counts = _process_row_isolated(
+                        db, import_id, row_indexes[offset], prepared[offset], row_hashes[offset],
+                        # email の完全一致は常に確認するので、やり直しも同じ処理
+                        lambda force_exact, offset=offset: process(offset)
+                    )
+                else:
+                    row_counts = process(offset, found.get(offset))
+                counts = [total + count for total, count in zip(counts, row_counts)]
+            return counts, outcomes
+
+        (inserted, errors, candidates_found), outcomes = run_chunk_transaction(db, persist)
+        inserted_count += inserted
+        error_count += errors
+        candidate_count += candidates_found
+        if upsert_stats is not None:
+            for outcome in outcomes:
+                upsert_stats[outcome] += 1
+
+    return inserted_count, error_count, candidate_count
+
+
 def process_import_job(import_id: int, mapping: dict, rows: list, db: Session):
     """
     バックグラウンドでインポート処理を実行
@@ -26,29 +528,57 @@ def process_import_job(import_id: int, mapping: dict, rows: list, db: Session):
             return
         
         db_import.status = models.ImportStatus.processing
+        db_import.mapping = mapping
         db.commit()
+
+        mapping_hash = hash_mapping(mapping)
+        # 🆕 インポートごとのマッチング設定とルール別の集計
+        match_config = MatchConfig.from_dict(db_import.match_config)
+        match_stats = job_stats()
+        value_dictionary = new_value_dictionary()
+        upsert_stats = new_upsert_stats()
         
+        stream = None
         # 🆕 S3キーがあればS3から読み込む
         if db_import.s3_key:
             try:
-                print(f"DEBUG: S3からファイル読み込み開始: {db_import.s3_key}")
-                file_bytes = s3_service.download_file(db_import.s3_key)
-                if not file_bytes:
-                    raise Exception(f"Failed to download file from S3: {db_import.s3_key}")
-                
-                print(f"DEBUG: ファイルサイズ: {len(file_bytes)} bytes")
-                
-                # ファイル拡張子で判定
-                if db_import.filename.endswith('.csv'):
-                    df = pd.read_csv(BytesIO(file_bytes))
-                elif db_import.filename.endswith(('.xlsx', '.xls')):
-                    df = pd.read_excel(BytesIO(file_bytes))
-                else:
-                    raise Exception(f"Unsupported file type: {db_import.filename}")
-                
-                # DataFrameを辞書のリストに変換
-                rows = df.to_dict('records')
-                print(f"DEBUG: S3から読み込んだ行数: {len(rows)}")
+                # 🆕 内容ハッシュで再アップロードを検知（信頼できる ETag があればダウンロード前に判定）
+                etag = s3_service.get_trusted_etag(db_import.s3_key)
+                if etag and replay_previous_import(db, db_import, f"md5:{etag}", mapping_hash):
+                    return
+
+                # 🆕 同じファイルの解析済みキャッシュ（マッピングを直してのやり直しなど）があれば
+                # ダウンロード・解析せず、マッピングで使う列だけを読む
+                object_etag = etag or s3_service.get_object_etag(db_import.s3_key)
+                cached = upload_cache.lookup(db_import.s3_key, object_etag)
+                rows = None
+                if cached and cached.sha256:
+                    if not etag and replay_previous_import(db, db_import, f"sha256:{cached.sha256}", mapping_hash):
+                        return
+                    try:
+                        rows = upload_cache.read_rows(
+                            cached, columns=[column for column in mapping.values() if column], raw_data=True
+                        )
+                    except Exception as e:
+                        print(f"WARN: アップロードキャッシュを読めないため S3 から読み込み: {e}")
+                if rows is None:
+                    stream = open_import_stream(db, db_import, etag, mapping_hash)
+                if rows is None and stream is None:
+                    print(f"DEBUG: S3からファイル読み込み開始: {db_import.s3_key}")
+                    file_bytes, sha256 = s3_service.download_file_with_hash(db_import.s3_key)
+                    if not file_bytes:
+                        raise Exception(f"Failed to download file from S3: {db_import.s3_key}")
+
+                    print(f"DEBUG: ファイルサイズ: {len(file_bytes)} bytes")
+
+                    if not etag and replay_previous_import(db, db_import, f"sha256:{sha256}", mapping_hash):
+                        return
+
+                    df = read_dataframe(db_import.filename, file_bytes)
+                    rows = SourceRows.from_dataframe(df)
+                    upload_cache.store(db_import.s3_key, object_etag, sha256, df, rows)
+                    del df
+                    print(f"DEBUG: S3から読み込んだ行数: {len(rows)}")
                 if rows:
                     print(f"DEBUG: 最初の行: {rows[0]}")
             except Exception as e:
@@ -58,123 +588,54 @@ def process_import_job(import_id: int, mapping: dict, rows: list, db: Session):
                 db.commit()
                 return
         
-        inserted_count = 0
-        error_count = 0
-        candidate_count = 0
-
-        # 既存顧客を取得
-        existing_customers = crud.get_all_customers(db)
-        existing_customers_dict = [
-            {
-                "id": c.id,
-                "full_name": c.full_name,
-                "email": c.email,
-                "phone": c.phone,
-                "address": c.address,
-                "city": c.city,
-                "state": c.state,
-                "zip_code": c.zip_code
-            }
-            for c in existing_customers
-        ]
-
-        for idx, row in enumerate(rows):
-            raw_data = json.dumps(row, ensure_ascii=False)
-            mapped_data = {}
-            normalized_data = {}
-            validation_errors = []
-
-            # マッピング
-            for db_field, excel_col in mapping.items():
-                if excel_col and excel_col in row:
-                    mapped_data[db_field] = row[excel_col]
-
-            # 正規化
-            for field, value in mapped_data.items():
-                normalized_data[field] = normalize_value(value, "trim")
-
-            # バリデーション
-            if "email" in normalized_data and normalized_data["email"]:
-                error = validate_value(normalized_data["email"], "email")
-                if error:
-                    validation_errors.append(f"email: {error}")
-
-            # エラーがあればエラー行として保存
-            if validation_errors:
-                crud.create_import_row(
-                    db, import_id, idx, raw_data, json.dumps(mapped_data, ensure_ascii=False),
-                    json.dumps(normalized_data, ensure_ascii=False), validation_errors, "error"
-                )
-                error_count += 1
-                continue
-
-            # email/phoneで完全一致チェック
-            existing_customer = None
-            if normalized_data.get("email"):
-                existing_customer = crud.get_customer_by_email(
-                    db, normalized_data["email"])
-            elif normalized_data.get("phone"):
-                existing_customer = crud.get_customer_by_phone(
-                    db, normalized_data["phone"])
-
-            if existing_customer:
-                # 既存顧客更新
-                for key, value in normalized_data.items():
-                    if value:
-                        setattr(existing_customer, key, value)
-                db.commit()
-
-                crud.create_import_row(
-                    db, import_id, idx, raw_data, json.dumps(mapped_data, ensure_ascii=False),
-                    json.dumps(normalized_data, ensure_ascii=False), [], "inserted"
-                )
-                inserted_count += 1
-            else:
-                # 重複候補検出
-                candidates = find_duplicate_candidates(
-                    normalized_data, existing_customers_dict)
-
-                if candidates:
-                    # 候補あり
-                    db_row = crud.create_import_row(
-                        db, import_id, idx, raw_data, json.dumps(mapped_data, ensure_ascii=False),
-                        json.dumps(normalized_data, ensure_ascii=False), [], "candidate"
-                    )
+        from .staging_import import STAGING_BATCH_SIZE, STAGING_IMPORT_MIN_ROWS, process_prepared_staged
 
-                    for candidate in candidates:
-                        crud.create_duplicate_candidate(
-                            db,
-                            import_row_id=db_row.id,
-                            existing_customer_id=candidate["customer_id"],
-                            match_reason=candidate["match_reason"],
-                            similarity_score=candidate["similarity_score"]
-                        )
+        def prepare(chunk):
+            return prepare_chunk(chunk, mapping, mapping_hash, value_dictionary)
 
-                    candidate_count += 1
-                else:
-                    # 新規作成
-                    crud.create_customer(
-                        db=db,
-                        full_name=normalized_data.get("full_name"),
-                        email=empty_to_none(normalized_data.get("email")),
-                        phone=empty_to_none(normalized_data.get("phone")),
-                        address=normalized_data.get("address")
-                    )
+        def run(indexed_rows, row_count: int) -> tuple:
+            # 大きなファイルはステージングテーブル経由（完全一致を SQL で解決）
+            if STAGING_IMPORT_MIN_ROWS and row_count >= STAGING_IMPORT_MIN_ROWS:
+                process, chunk_size = process_prepared_staged, STAGING_BATCH_SIZE
+            else:
+                process, chunk_size = process_prepared_chunks, MATCH_CHUNK_SIZE
+            return process(
+                db, import_id, map(prepare, iter_chunks(indexed_rows, chunk_size)),
+                match_config=match_config, match_stats=match_stats, upsert_stats=upsert_stats
+            )
 
-                    crud.create_import_row(
-                        db, import_id, idx, raw_data, json.dumps(mapped_data, ensure_ascii=False),
-                        json.dumps(normalized_data, ensure_ascii=False), [], "inserted"
-                    )
-                    inserted_count += 1
+        if stream is not None:
+            # 🆕 S3 から読みながら取り込む（読み込み・解析は別スレッド。行数は先頭から見積もる）
+            with stream:
+                inserted_count, error_count, candidate_count = run(stream, stream.estimated_rows())
+            total_rows = stream.row_count
+            if not etag:
+                db_import.content_hash = f"sha256:{stream.sha256}"
+        else:
+            inserted_count, error_count, candidate_count = run(enumerate(rows), len(rows))
+            total_rows = len(rows)
 
         # 成功: ステータスを completed に更新
         crud.update_import_status(
             db, import_id, "completed",
-            total_rows=len(rows),
+            total_rows=total_rows,
             inserted_count=inserted_count,
             error_count=error_count,
             candidate_count=candidate_count
         )
+        # 🆕 このインポートで変わった顧客について、他の未解決の候補を再判定
+        from .rematch import rematch_after_import
+        rematch = rematch_after_import(db, db_import)
+        db_import.customers_fingerprint = crud.get_customers_fingerprint(db)
+        db_import.metrics = {
+            "matchers": match_stats.to_dict(),
+            "similarity_memo": match_stats.memo.stats() if match_stats.memo else None,
+            "value_dictionary": value_dictionary.stats(),
+            "rematch": rematch,
+            "upsert": upsert_stats,
+            "stream": stream.stats() if stream is not None else None,
+        }
+        db.commit()
         
     except Exception as e:
         # 失敗: ステータスを failed に更新
@@ -182,4 +643,132 @@ def process_import_job(import_id: int, mapping: dict, rows: list, db: Session):
         if db_import:
             db_import.status = models.ImportStatus.failed
             db_import.error_message = str(e)
-            db.commit()
\ No newline at end of file
+            db.commit()
+
+
+def match_customer_batch(db: Session, customers: list, import_id: int = None, row_offset: int = 0) -> list:
+    """
+    /customers/import 用: 顧客データのバッチを重複検知し、候補がなければ新規作成する
+    import_id を渡すと結果を ImportRow / DuplicateCandidate に保存する（非同期ジョブ用）
+    🆕 作成した顧客はバッチ内の索引にも加え、後の行（同じ email など）はその顧客の候補にする
+    コミットはバッチ単位で1回。DBエラーならバッチをロールバックし、行ごとの SAVEPOINT でやり直して
+    失敗した行だけ error の結果（"error": "database: ..."）にする
+    """
+    def process(offset: int, customer_data: dict, existing_customers_dict: list, existing_index: dict,
+                address_index: AddressLSH) -> tuple:
+        """1行を処理して (結果, 作成した顧客 or None) を返す"""
+        # 重複候補検出
+        candidates = find_duplicate_candidates(
+            customer_data, existing_customers_dict,
+            index=existing_index, address_index=address_index)
+
+        customer = None
+        if not candidates:
+            # 新規作成（空文字列をNoneに変換）
+            customer = crud.create_customer(
+                db=db,
+                full_name=customer_data.get("full_name"),
+                email=empty_to_none(customer_data.get("email")),
+                phone=empty_to_none(customer_data.get("phone")),
+                address=customer_data.get("address_line1"),
+                commit=False
+            )
+
+        if import_id is not None:
+            db_row = crud.create_import_row(
+                db, import_id, row_offset + offset, customer_data, customer_data, customer_data, [],
+                models.RowStatus.candidate if candidates else models.RowStatus.inserted, commit=False
+            )
+            if candidates:
+                crud.create_row_match_keys(db, db_row.id, customer_data)
+                for candidate in candidates:
+                    db.add(models.DuplicateCandidate(
+                        import_row_id=db_row.id,
+                        existing_customer_id=candidate["customer_id"],
+                        match_reason=candidate["match_reason"],
+                        similarity_score=candidate["similarity_score"]
+                    ))
+
+        return {
+            "normalized": customer_data,
+            "candidates": [
+                {
+                    "candidateIndex": candidate["customer_id"],
+                    "score": candidate["similarity_score"],
+                    "reason": candidate["match_reason"]
+                }
+                for candidate in candidates
+            ]
+        }, customer
+
+    def persist(isolate: bool) -> list:
+        # やり直しでは作成した顧客もロールバックされるので、索引は毎回作り直す
+        existing_customers_dict = load_candidate_customers(db, customers)
+        existing_index = build_match_index(existing_customers_dict)
+        address_index = AddressLSH()
+        address_index.add_many(existing_customers_dict)
+
+        results = []
+        for offset, customer_data in enumerate(customers):
+            if not isolate:
+                result, customer = process(offset, customer_data, existing_customers_dict, existing_index, address_index)
+            else:
+                try:
+                    with db.begin_nested():
+                        result, customer = process(
+                            offset, customer_data, existing_customers_dict, existing_index, address_index
+                        )
+                except ROW_ERRORS as e:
+                    message = str(getattr(e, "orig", None) or e)[:500]
+                    print(f"WARN: 行 {row_offset + offset} の保存に失敗: {message}")
+                    result, customer = {"normalized": customer_data, "candidates": [], "error": f"database: {message}"}, None
+                    if import_id is not None:
+                        crud.create_import_row(
+                            db, import_id, row_offset + offset, customer_data, customer_data, customer_data,
+                            [result["error"]], models.RowStatus.error, commit=False
+                        )
+            if customer is not None:
+                record = customer_to_match_dict(customer)
+                existing_customers_dict.append(record)
+                add_to_match_index(existing_index, record)
+                address_index.add_many([record])
+            results.append(result)
+        return results
+
+    return run_chunk_transaction(db, persist)
+
+
+def process_customer_import_job(import_id: int, customers: list, db: Session):
+    """
+    /customers/import の非同期ジョブ
+    MATCH_CHUNK_SIZE 行ずつ処理し、バッチごとに件数を更新する（結果は途中から参照可能）
+    """
+    try:
+        db_import = crud.get_import(db, import_id)
+        if not db_import:
+            return
+
+        for start in range(0, len(customers), MATCH_CHUNK_SIZE):
+            results = match_customer_batch(
+                db, customers[start:start + MATCH_CHUNK_SIZE], import_id=import_id, row_offset=start
+            )
+            candidate_rows = sum(1 for result in results if result["candidates"])
+            error_rows = sum(1 for result in results if result.get("error"))
+            db_import.candidate_count += candidate_rows
+            db_import.error_count += error_rows
+            db_import.inserted_count += len(results) - candidate_rows - error_rows
+            db.commit()
+
+        db_import.status = models.ImportStatus.completed
+        db.commit()
+
+        from .rematch import rematch_after_import
+        rematch_after_import(db, db_import)
+
+    except Exception as e:
+        db.rollback()
+        db_import = crud.get_import(db, import_id)
+        if db_import:
+            db_import.status = models.ImportStatus.failed
+            db_import.error_message = str(e)
+            db.commit()
@@ -0,0 +1,200 @@
+"""
+S3 の CSV を読みながら取り込む（取得・解析と照合・保存を重ねる）
+
+ダウンロードしてからファイル全体を解析すると、その間 DB 側は何もしない。IMPORT_STREAM_MIN_BYTES 以上の CSV は
+別スレッドが S3 のレスポンスを少しずつ読んで pandas のチャンク読み込みで行にし、上限付きのキューでジョブのスレッドに渡す。
+ジョブのスレッドは届いたチャンクから照合・保存するので、全体の時間は「取得・解析」と「照合・保存」の遅い方に近づく。
+
+- キューが満杯なら読むスレッドは待つ（先読みは IMPORT_STREAM_QUEUE_SIZE チャンクまで。その先は S3 からも読まない）
+- 読み込み・解析の失敗はジョブのスレッドで StreamReadError（S3ファイル読み込みエラー: ...）として投げ直す
+- ジョブのスレッドが途中で抜けたら（照合・保存の失敗など）with を出たところで読むスレッドを止め、終わるまで待つ
+- 読みながら SHA-256 を計算する（読み終えるまで分からないので、再アップロードの引き継ぎは
+  信頼できる ETag で判定済みか、引き継げるインポートがないときだけこの経路を使う）
+- 型をチャンクごとに推論すると同じ列でも値が変わるため、CSV はファイル全体を解析する経路も含めて文字列で読む
+- 照合・保存は前のチャンクで作成した顧客を次のチャンクが使うので、ジョブのスレッドで順に行う
+"""
+import hashlib
+import os
+import queue
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+from .records import SourceRow, SourceRows
+
+IMPORT_STREAM_MIN_BYTES = int(os.getenv("IMPORT_STREAM_MIN_BYTES", str(8 * 1024 * 1024)))  # 0 で無効
+IMPORT_STREAM_QUEUE_SIZE = int(os.getenv("IMPORT_STREAM_QUEUE_SIZE", "4"))
+IMPORT_STREAM_CHUNK_ROWS = int(os.getenv("IMPORT_STREAM_CHUNK_ROWS", "1000"))
+
+# 行数の見積もりに使う先頭のバイト数
+SAMPLE_BYTES = 1024 * 1024
+# キューで待つときに止める指示を確認する間隔（秒）
+_POLL_SECONDS = 0.1
+_DONE = object()
+
+
+class StreamReadError(Exception):
+    """S3 の読み込み・CSV の解析の失敗（読むスレッドの例外を包む）"""
+
+
+class _Cancelled(Exception):
+    """読むスレッドを止める（ジョブのスレッドが抜けた）"""
+
+
+class _HashingReader:
+    """S3 のレスポンスを読みながら SHA-256・読んだバイト数・先頭の改行数を数える（止める指示があれば例外）"""
+
+    def __init__(self, body, cancel: threading.Event):
+        self._body = body
+        self._cancel = cancel
+        self.digest = hashlib.sha256()
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+        # (先頭 SAMPLE_BYTES までの改行数, そのバイト数)。別スレッドから読むので1つのタプルで差し替える
+        self.sample = (0, 0)
+
+    def read(self, size: int = -1) -> bytes:
+        if self._cancel.is_set():
+            raise _Cancelled()
+        started = time.perf_counter()
+        data = self._body.read(size if size is not None and size >= 0 else None)
+        self.read_seconds += time.perf_counter() - started
+        self.digest.update(data)
+        if self.bytes_read < SAMPLE_BYTES:
+            head = data[:SAMPLE_BYTES - self.bytes_read]
+            newlines, sampled = self.sample
+            self.sample = (newlines + head.count(b"\n"), sampled + len(head))
+        self.bytes_read += len(data)
+        return data
+
+
+class CsvStream:
+    """
+    CSV を別スレッドで (行番号, 行) のチャンクにしながら読む
+    with の中で iter して使う。with を出ると読むスレッドを止めて待ち、レスポンスを閉じる
+    """
+
+    def __init__(self, body, size_bytes: Optional[int] = None, chunk_rows: Optional[int] = None,
+                 queue_size: Optional[int] = None):
+        self.size_bytes = size_bytes
+        self.row_count = 0
+        self._body = body
+        self._chunk_rows = chunk_rows or IMPORT_STREAM_CHUNK_ROWS
+        self._cancel = threading.Event()
+        self._reader = _HashingReader(body, self._cancel)
+        self._queue = queue.Queue(maxsize=max(1, queue_size or IMPORT_STREAM_QUEUE_SIZE))
+        self._thread = threading.Thread(target=self._produce, name="import-stream", daemon=True)
+        self._error: Optional[BaseException] = None
+        self._pending = []
+        self._finished = False
+        self._producer_wait = 0.0
+        self._consumer_wait = 0.0
+
+    def __enter__(self) -> "CsvStream":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """読むスレッドを止めて終わるまで待ち、レスポンスを閉じる"""
+        self._cancel.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        close = getattr(self._body, "close", None)
+        if close:
+            close()
+
+    @property
+    def producer_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    @property
+    def bytes_read(self) -> int:
+        return self._reader.bytes_read
+
+    @property
+    def sha256(self) -> str:
+        """内容の SHA-256（最後まで読んでから使う）"""
+        return self._reader.digest.hexdigest()
+
+    def _produce(self) -> None:
+        """読むスレッド: チャンクごとに解析してキューに入れる（最後に _DONE）"""
+        import pandas as pd  # 起動時間短縮のため初回利用時に import
+
+        try:
+            row_index = 0
+            for df in pd.read_csv(self._reader, dtype=str, chunksize=self._chunk_rows):
+                rows = SourceRows.from_dataframe(df)
+                self._put(list(enumerate(rows, start=row_index)))
+                row_index += len(rows)
+        except _Cancelled:
+            return
+        except BaseException as e:
+            self._error = e
+        try:
+            self._put(_DONE)
+        except _Cancelled:
+            pass
+
+    def _put(self, item) -> None:
+        started = time.perf_counter()
+        while True:
+            if self._cancel.is_set():
+                raise _Cancelled()
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        self._producer_wait += time.perf_counter() - started
+
+    def _get(self):
+        """次のチャンク（読み終えたら _DONE。読むスレッドの失敗はここで投げ直す）"""
+        if self._finished:
+            return _DONE
+        started = time.perf_counter()
+        while True:
+            try:
+                item = self._queue.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                if not self._thread.is_alive() and self._queue.empty():
+                    item = _DONE
+                    break
+        self._consumer_wait += time.perf_counter() - started
+        if item is _DONE:
+            self._finished = True
+            if self._error is not None:
+                raise StreamReadError(f"S3ファイル読み込みエラー: {self._error}") from self._error
+        return item
+
+    def estimated_rows(self) -> int:
+        """先頭の改行の数から全体の行数を見積もる（最初のチャンクが届くまで待つ。ステージング経由にするかの判定用）"""
+        if not self._pending:
+            chunk = self._get()
+            if chunk is _DONE:
+                return 0
+            self._pending.append(chunk)
+        newlines, sampled = self._reader.sample
+        if not sampled or not self.size_bytes or sampled >= self.size_bytes:
+            return max(newlines - 1, 0)
+        return max(int(newlines * self.size_bytes / sampled) - 1, 0)
+
+    def __iter__(self) -> Iterator[Tuple[int, SourceRow]]:
+        while True:
+            chunk = self._pending.pop(0) if self._pending else self._get()
+            if chunk is _DONE:
+                return
+            self.row_count += len(chunk)
+            yield from chunk
+
+    def stats(self) -> dict:
+        """読み込みの集計（producer_wait: キューが満杯で待った秒数、consumer_wait: 行が届くのを待った秒数）"""
+        return {
+            "bytes": self._reader.bytes_read,
+            "rows": self.row_count,
+            "read_seconds": round(self._reader.read_seconds, 3),
+            "producer_wait_seconds": round(self._producer_wait, 3),
+            "consumer_wait_seconds": round(self._consumer_wait, 3),
+        }
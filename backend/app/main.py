@@ -1,6 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import imports, uploads, s3_upload, duplicates, import_history
+from .routers import imports, uploads, s3_upload, duplicates, import_history, customers, dedupe
 import os
 from dotenv import load_dotenv
 
@@ -24,6 +24,8 @@ app.include_router(uploads.router, prefix="/api/uploads", tags=["uploads"])
 app.include_router(s3_upload.router, prefix="/api/s3-upload", tags=["s3_upload"])
 app.include_router(duplicates.router, prefix="/api/duplicates", tags=["duplicates"])
 app.include_router(import_history.router, prefix="/api/import-history", tags=["import_history"])
+app.include_router(customers.router, prefix="/api/customers", tags=["customers"])
+app.include_router(dedupe.router, prefix="/api/dedupe", tags=["dedupe"])
 
 @app.get("/")
 def read_root():
@@ -33,8 +35,20 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+# 🆕 顧客検索インデックスを起動直後にバックグラウンドで作成する（既定は最初の検索時）
+CUSTOMER_SEARCH_WARMUP = os.getenv("CUSTOMER_SEARCH_WARMUP", "false").lower() == "true"
+
+# 🆕 スキーマ作成は起動時にしない（python -m app.manage ensure-schema をデプロイ時に1回実行）
+# ローカルで従来どおり起動時に作成したい場合だけ CREATE_TABLES_ON_STARTUP=true
+CREATE_TABLES_ON_STARTUP = os.getenv("CREATE_TABLES_ON_STARTUP", "false").lower() == "true"
+
 @app.on_event("startup")
 async def startup_event():
-    """起動時にテーブル作成"""
-    from .database import engine, Base
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    """起動時の処理（テーブル作成・検索インデックスのウォームアップ。どちらも設定した場合のみ）"""
+    if CREATE_TABLES_ON_STARTUP:
+        from .database import get_engine, Base
+        Base.metadata.create_all(bind=get_engine())
+    if CUSTOMER_SEARCH_WARMUP:
+        from .database import ReadSessionLocal
+        from .customer_search import ensure_index
+        ensure_index(ReadSessionLocal)
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+管理コマンド
+
+使い方:
+    python -m app.manage ensure-schema
+    python -m app.manage backfill-match-keys [--batch-size 1000]
+    python -m app.manage partition-shards --import-id 1 --shard-count 4
+    python -m app.manage run-shard --import-id 1 --shard-no 0 --shard-count 4
+    python -m app.manage purge-imports [--older-than-days 365] [--archive] [--dry-run]
+    python -m app.manage partition-import-rows [--every 10000] [--apply]
+    python -m app.manage rematch-candidates [--since "2024-01-01 00:00:00"] [--backfill-keys]
+    python -m app.manage dedupe-sweep [--shards 8] [--workers 4] [--resume 1 [--force]]
+"""
+import argparse
+from datetime import datetime
+from sqlalchemy import inspect, text, update
+from .database import get_engine, SessionLocal, Base
+from .canonicalize import customer_match_keys
+from .address_lsh import address_band_hashes
+from . import models
+
+
+def ensure_schema():
+    """
+    モデルに対して不足しているテーブル・列・インデックスを追加（create_all は既存テーブルを変更しないため）
+    追加する列はすべて NULL 許容で作成する
+    """
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    # MySQL の ENUM は値の追加に MODIFY COLUMN が必要
+                    existing_enums = getattr(existing_columns[column.name]["type"], "enums", None)
+                    model_enums = getattr(column.type, "enums", None)
+                    if engine.dialect.name == "mysql" and existing_enums and model_enums \
+                            and set(model_enums) - set(existing_enums):
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        conn.execute(text(f"ALTER TABLE {table.name} MODIFY COLUMN {column.name} {column_type} NULL"))
+                        print(f"✅ ENUM値を追加: {table.name}.{column.name}")
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+                print(f"✅ 列を追加: {table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    print(f"✅ インデックスを追加: {index.name}")
+
+
+def backfill_match_keys(batch_size: int = 1000) -> int:
+    """既存顧客のマッチキーと住所LSHバンドを主キー順にバッチで再計算"""
+    ensure_schema()
+
+    db = SessionLocal()
+    last_id = 0
+    updated = 0
+    try:
+        while True:
+            batch = db.query(
+                models.Customer.id,
+                models.Customer.full_name,
+                models.Customer.phone,
+                models.Customer.address
+            ).filter(
+                models.Customer.id > last_id
+            ).order_by(models.Customer.id).limit(batch_size).all()
+
+            if not batch:
+                break
+
+            db.execute(update(models.Customer), [
+                {"id": row.id, **customer_match_keys(row.full_name, row.phone, row.address)}
+                for row in batch
+            ])
+
+            bands = models.CustomerAddressBand.__table__
+            db.execute(bands.delete().where(bands.c.customer_id.in_([row.id for row in batch])))
+            band_rows = [
+                {"customer_id": row.id, "band_hash": band}
+                for row in batch
+                for band in address_band_hashes(row.address)
+            ]
+            if band_rows:
+                db.execute(bands.insert(), band_rows)
+            db.commit()
+
+            last_id = batch[-1].id
+            updated += len(batch)
+            print(f"  {updated} 件更新 (id <= {last_id})")
+    finally:
+        db.close()
+
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("ensure-schema", help="不足しているテーブル・列・インデックスを追加")
+
+    backfill = subparsers.add_parser("backfill-match-keys", help="顧客のマッチキーと住所LSHバンドを再計算")
+    backfill.add_argument("--batch-size", type=int, default=1000)
+
+    partition_shards = subparsers.add_parser(
+        "partition-shards", help="シャード並列インポートのファイルを1回だけ読み、シャードごとの入力に分ける"
+    )
+    partition_shards.add_argument("--import-id", type=int, required=True)
+    partition_shards.add_argument("--shard-count", type=int, required=True)
+
+    shard = subparsers.add_parser("run-shard", help="シャード並列インポートの1シャードを処理（複数ノードで分担する場合）")
+    shard.add_argument("--import-id", type=int, required=True)
+    shard.add_argument("--shard-no", type=int, required=True)
+    shard.add_argument("--shard-count", type=int, required=True)
+
+    purge = subparsers.add_parser("purge-imports", help="保持期間を過ぎたインポートの行・解決済み候補を削除")
+    purge.add_argument("--older-than-days", type=int, default=None)
+    purge.add_argument("--batch-size", type=int, default=None)
+    purge.add_argument("--sleep", type=float, default=None, help="バッチ間の待ち秒数")
+    purge.add_argument("--archive", action="store_true", help="削除前に S3 へ gzip NDJSON で退避")
+    purge.add_argument("--limit", type=int, default=None, help="処理するインポート数の上限")
+    purge.add_argument("--dry-run", action="store_true")
+
+    partition = subparsers.add_parser("partition-import-rows", help="import_rows を import_id の範囲で分割（MySQL）")
+    partition.add_argument("--every", type=int, default=10000)
+    partition.add_argument("--apply", action="store_true", help="指定しなければ DDL を表示するだけ")
+
+    rematch = subparsers.add_parser("rematch-candidates", help="変更された顧客について未解決の重複候補を再判定")
+    rematch.add_argument("--since", type=datetime.fromisoformat, default=None,
+                         help="この日時以降に作成・更新された顧客（省略時は全顧客）")
+    rematch.add_argument("--backfill-keys", action="store_true", help="キーを持たない候補行のマッチキーを先に作成")
+
+    sweep = subparsers.add_parser("dedupe-sweep", help="既存顧客どうしの重複をクラスタにまとめる")
+    sweep.add_argument("--shards", type=int, default=None)
+    sweep.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（0 ならこのプロセスで処理）")
+    sweep.add_argument("--resume", type=int, default=None, metavar="SWEEP_ID", help="中断したスイープを再開")
+    sweep.add_argument("--force", action="store_true",
+                       help="processing のまま残ったシャードも取り直す（ワーカーが落ちたとき用）")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "ensure-schema":
+        ensure_schema()
+        print("✅ スキーマ確認完了")
+
+    elif args.command == "backfill-match-keys":
+        count = backfill_match_keys(batch_size=args.batch_size)
+        print(f"✅ マッチキーのバックフィル完了: {count} 件")
+
+    elif args.command == "partition-shards":
+        from . import crud
+        from .sharded_import import partition_import
+        db = SessionLocal()
+        try:
+            db_import = crud.get_import(db, args.import_id)
+            db_import.status = models.ImportStatus.processing
+            db.commit()
+            crud.create_import_shards(db, args.import_id, args.shard_count)
+            counts = partition_import(db, args.import_id, args.shard_count)
+        finally:
+            db.close()
+        print(f"✅ シャードへの振り分け完了 (import {args.import_id}): {counts} 行")
+
+    elif args.command == "run-shard":
+        from .sharded_import import process_import_shard
+        process_import_shard(args.import_id, args.shard_no, args.shard_count)
+        print(f"✅ シャード {args.shard_no}/{args.shard_count} 完了 (import {args.import_id})")
+
+    elif args.command == "purge-imports":
+        from . import retention
+        db = SessionLocal()
+        try:
+            results = retention.run_retention(
+                db,
+                older_than_days=args.older_than_days if args.older_than_days is not None else retention.RETENTION_DAYS,
+                batch_size=args.batch_size or retention.RETENTION_BATCH_SIZE,
+                sleep_seconds=args.sleep if args.sleep is not None else retention.RETENTION_SLEEP_SECONDS,
+                archive=args.archive or retention.RETENTION_ARCHIVE_TO_S3,
+                limit=args.limit,
+                dry_run=args.dry_run
+            )
+        finally:
+            db.close()
+        if args.dry_run:
+            for result in results:
+                print(f"  import {result['import_id']}: {result['rows']} 行")
+        print(f"✅ 保持期間の処理完了: {len(results)} 件のインポート")
+
+    elif args.command == "partition-import-rows":
+        from .retention import partition_import_rows
+        statements = partition_import_rows(get_engine(), every=args.every, apply=args.apply)
+        if not args.apply:
+            for statement in statements:
+                print(f"{statement};")
+        print(f"✅ パーティション {'適用' if args.apply else 'DDL 出力'}完了: {len(statements)} 文")
+
+
+    elif args.command == "rematch-candidates":
+        from . import rematch
+        db = SessionLocal()
+        try:
+            if args.backfill_keys:
+                print(f"  マッチキーを作成: {rematch.backfill_row_match_keys(db)} 行")
+            result = rematch.rematch_changed_since(db, args.since)
+        finally:
+            db.close()
+        print(f"✅ 再判定完了: 顧客 {result['customers']} 件・候補行 {result['rows']} 件 "
+              f"(追加 {result['added']} / 更新 {result['updated']} / 削除 {result['removed']} / 候補なしで取り込み {result['inserted']} / エラー {result['errors']})")
+
+
+    elif args.command == "dedupe-sweep":
+        from . import dedupe_sweep
+        sweep_id = args.resume
+        if sweep_id is None:
+            db = SessionLocal()
+            try:
+                sweep_id = dedupe_sweep.create_sweep(db, args.shards or dedupe_sweep.DEDUPE_SHARDS).id
+            finally:
+                db.close()
+        dedupe_sweep.run_sweep(sweep_id, max_workers=args.workers, force=args.force)
+        db = SessionLocal()
+        try:
+            sweep = db.get(models.DedupeSweep, sweep_id)
+            print(f"{'✅' if sweep.status == models.ImportStatus.completed else '❌'} スイープ {sweep_id}: "
+                  f"{sweep.status.value}（組 {sweep.pair_count} 件・クラスタ {sweep.cluster_count} 件）")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+重複検知のマッチャー（ルール）レジストリ
+
+各ルールはコスト（1行あたりの相対的な重さ）と選択性（候補を絞り込む強さの目安）を宣言し、
+エンジンはコストの小さい順に実行する。決定的なルール（email / 電話の完全一致など）が
+候補を返した時点で残りのルールは実行しない。
+閾値・減点・上位件数はインポートごとに MatchConfig で変えられ、
+ルールごとの実行回数・ヒット数・時間は counters（プロセス全体）と MatchStats（インポート単位）に記録される。
+
+新しいルールは Matcher を継承して register() する。
+"""
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional
+import threading
+import time
+from .address_lsh import AddressLSH
+from .canonicalize import canonical_address, canonical_name
+from .import_engine import SIMILARITY_MEMO_SIZE, SimilarityMemo, similarity_scores, _score_name_match
+
+
+@dataclass
+class MatchConfig:
+    """インポートごとのマッチング設定"""
+    threshold: float = 0.85
+    # 名前は似ているが住所が違う / 住所だけ似ている場合の係数
+    address_penalty: float = 0.7
+    top_k: int = 5
+    # 実行しないルール名
+    disabled: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "MatchConfig":
+        """dict から作成（未知のキーは無視）"""
+        if not data:
+            return cls()
+        names = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class MatchContext:
+    """1行分のマッチングの入力"""
+    new_row: Dict[str, Any]
+    keys: Dict[str, str]
+    existing_customers: List[Any]
+    index: Dict[str, Any]
+    address_index: Optional[AddressLSH]
+    config: MatchConfig
+    memo: Optional[SimilarityMemo] = None
+    # 候補にしない顧客ID（既存顧客どうしを照合するときの自分自身）
+    exclude: frozenset = frozenset()
+
+    def scores(self, query: str, candidates: List[str]) -> List[float]:
+        """類似度（ジョブのメモがあれば再利用）"""
+        if self.memo is not None:
+            return self.memo.scores(query, candidates)
+        return similarity_scores(query, candidates)
+
+
+class MatchStats:
+    """
+    ルールごとの実行回数・ヒット数・決定回数・時間
+    インポート単位で作る場合は類似度の LRU メモ（memo）も持つ
+    """
+
+    def __init__(self, memo_size: int = 0):
+        self._lock = threading.Lock()
+        self.rules: Dict[str, Dict[str, float]] = {}
+        self.memo = SimilarityMemo(memo_size) if memo_size else None
+
+    def record(self, rule: str, hits: int, decisive: bool, seconds: float):
+        with self._lock:
+            counter = self.rules.setdefault(rule, {"calls": 0, "hits": 0, "decisive": 0, "seconds": 0.0})
+            counter["calls"] += 1
+            counter["hits"] += 1 if hits else 0
+            counter["decisive"] += 1 if decisive else 0
+            counter["seconds"] += seconds
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                rule: dict(counter, seconds=round(counter["seconds"], 6))
+                for rule, counter in self.rules.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.rules.clear()
+
+
+class Matcher:
+    """マッチングルールの基底クラス"""
+    name = ""
+    # 相対コスト（小さいものから実行）
+    cost = 1.0
+    # 候補を絞り込む強さの目安（0〜1。大きいほど返す候補が正確）
+    selectivity = 1.0
+
+    def applies(self, ctx: MatchContext) -> bool:
+        """この行に対して実行する意味があるか"""
+        return True
+
+    def match(self, ctx: MatchContext) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def is_decisive(self, ctx: MatchContext, candidates: List[Dict[str, Any]]) -> bool:
+        """候補が見つかったらここで打ち切るか"""
+        return False
+
+
+class EmailExactMatcher(Matcher):
+    name = "email_exact"
+    cost = 1.0
+    selectivity = 1.0
+
+    def applies(self, ctx):
+        return bool(ctx.keys["email"])
+
+    def match(self, ctx):
+        # 自分自身（exclude）が先頭に来ても同じキーの他の顧客を返す
+        hits = ctx.index["email"].get(ctx.keys["email"]) or ()
+        hit = next((hit for hit in hits if hit["id"] not in ctx.exclude), None)
+        if hit is None:
+            return []
+        return [{
+            "customer_id": hit["id"],
+            "match_reason": f"Email完全一致: {ctx.new_row.get('email', '')}",
+            "similarity_score": 1.0
+        }]
+
+    def is_decisive(self, ctx, candidates):
+        return bool(candidates)
+
+
+class PhoneExactMatcher(Matcher):
+    name = "phone_exact"
+    cost = 1.0
+    selectivity = 0.95
+
+    def applies(self, ctx):
+        return bool(ctx.keys["phone"])
+
+    def match(self, ctx):
+        # 自分自身（exclude）が先頭に来ても同じキーの他の顧客を返す
+        hits = ctx.index["phone"].get(ctx.keys["phone"]) or ()
+        hit = next((hit for hit in hits if hit["id"] not in ctx.exclude), None)
+        if hit is None:
+            return []
+        return [{
+            "customer_id": hit["id"],
+            "match_reason": f"電話番号完全一致: {ctx.new_row.get('phone', '')}",
+            "similarity_score": 1.0
+        }]
+
+    def is_decisive(self, ctx, candidates):
+        return bool(candidates)
+
+
+class CanonicalNameMatcher(Matcher):
+    """正規化した氏名の完全一致（ハッシュ参照のみ）"""
+    name = "canonical_name"
+    cost = 2.0
+    selectivity = 0.8
+
+    def applies(self, ctx):
+        return bool(ctx.keys["name"])
+
+    def match(self, ctx):
+        return [
+            _score_name_match(customer, 1.0, ctx.keys["address"], ctx.config.threshold,
+                              ctx.config.address_penalty, ctx.memo)
+            for customer in ctx.index["name"].get(ctx.keys["name"], [])
+        ]
+
+    def is_decisive(self, ctx, candidates):
+        return bool(candidates)
+
+
+class AddressLSHMatcher(Matcher):
+    """住所 MinHash/LSH のバケット候補を編集距離で検証"""
+    name = "address_lsh"
+    cost = 20.0
+    selectivity = 0.5
+
+    def applies(self, ctx):
+        return ctx.address_index is not None and bool(ctx.keys["address"])
+
+    def match(self, ctx):
+        hits = [
+            ctx.index["id"][customer_id] for customer_id in ctx.address_index.query(ctx.keys["address"])
+            if customer_id in ctx.index["id"]
+        ]
+        addresses = [customer.get("address_line1", "") or customer.get("address", "") for customer in hits]
+        addr_sims = ctx.scores(ctx.keys["address"], [canonical_address(a) for a in addresses])
+        return [
+            {
+                "customer_id": customer["id"],
+                "match_reason": f"住所類似: {cust_address} (類似度: {addr_sim:.2f})",
+                "similarity_score": addr_sim * ctx.config.address_penalty  # 住所のみ一致はスコア減
+            }
+            for customer, cust_address, addr_sim in zip(hits, addresses, addr_sims)
+            if addr_sim >= ctx.config.threshold
+        ]
+
+
+class BoundedEditNameMatcher(Matcher):
+    """
+    氏名の編集距離（読み込んだ全顧客が対象）
+    文字数の差だけで閾値に届かない顧客は距離を計算しない（距離 >= 文字数の差）
+    """
+    name = "name_edit_distance"
+    cost = 100.0
+    selectivity = 0.3
+
+    def applies(self, ctx):
+        return bool(ctx.keys["name"])
+
+    def match(self, ctx):
+        query = ctx.keys["name"]
+        threshold = ctx.config.threshold
+        named, names = [], []
+        for customer in ctx.existing_customers:
+            full_name = customer.get("full_name", "")
+            if not full_name:
+                continue
+            name = canonical_name(full_name)
+            longest = max(len(query), len(name))
+            if longest and 1.0 - abs(len(query) - len(name)) / longest < threshold:
+                continue
+            named.append(customer)
+            names.append(name)
+
+        return [
+            _score_name_match(customer, name_sim, ctx.keys["address"], threshold,
+                              ctx.config.address_penalty, ctx.memo)
+            for customer, name_sim in zip(named, ctx.scores(query, names))
+            if name_sim >= threshold
+        ]
+
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, Matcher] = {}
+# プロセス全体の累計（GET /api/matchers で確認できる）
+counters = MatchStats()
+
+
+def job_stats() -> MatchStats:
+    """インポート1件分の集計（類似度メモ付き）"""
+    return MatchStats(memo_size=SIMILARITY_MEMO_SIZE)
+
+
+def register(matcher: Matcher) -> Matcher:
+    """ルールを登録（同名は置き換え）"""
+    with _registry_lock:
+        _registry[matcher.name] = matcher
+    return matcher
+
+
+def registered_matchers() -> List[Matcher]:
+    """コストの小さい順（同コストは選択性の高い順）"""
+    with _registry_lock:
+        return sorted(_registry.values(), key=lambda m: (m.cost, -m.selectivity))
+
+
+for _matcher in (EmailExactMatcher(), PhoneExactMatcher(), CanonicalNameMatcher(),
+                 AddressLSHMatcher(), BoundedEditNameMatcher()):
+    register(_matcher)
+
+
+def run_matchers(ctx: MatchContext, stats: Optional[MatchStats] = None) -> List[Dict[str, Any]]:
+    """ルールをコスト順に実行し、顧客ごとに最高スコアの候補を上位 top_k 件返す"""
+    best: Dict[Any, Dict[str, Any]] = {}
+    for matcher in registered_matchers():
+        if matcher.name in ctx.config.disabled or not matcher.applies(ctx):
+            continue
+
+        start = time.perf_counter()
+        found = matcher.match(ctx)
+        if ctx.exclude:
+            found = [candidate for candidate in found if candidate["customer_id"] not in ctx.exclude]
+        decisive = matcher.is_decisive(ctx, found)
+        seconds = time.perf_counter() - start
+        counters.record(matcher.name, len(found), decisive, seconds)
+        if stats is not None:
+            stats.record(matcher.name, len(found), decisive, seconds)
+
+        for candidate in found:
+            current = best.get(candidate["customer_id"])
+            if current is None or candidate["similarity_score"] > current["similarity_score"]:
+                best[candidate["customer_id"]] = candidate
+        if decisive:
+            break
+
+    candidates = sorted(best.values(), key=lambda x: x["similarity_score"], reverse=True)
+    return candidates[:ctx.config.top_k]
+
+
+def describe_matchers() -> List[Dict[str, Any]]:
+    """登録ルールの一覧と累計カウンタ"""
+    totals = counters.to_dict()
+    return [
+        {
+            "name": matcher.name,
+            "cost": matcher.cost,
+            "selectivity": matcher.selectivity,
+            "counters": totals.get(matcher.name, {"calls": 0, "hits": 0, "decisive": 0, "seconds": 0.0}),
+        }
+        for matcher in registered_matchers()
+    ]
@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, JSON, Enum, DECIMAL, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, BigInteger, String, JSON, Enum, DECIMAL, DateTime, ForeignKey, Text, Index, UniqueConstraint, event, inspect
 from sqlalchemy.sql import func
 from .database import Base
+from .canonicalize import customer_match_keys
+from .address_lsh import address_band_hashes
 import enum
 
 
 class ImportStatus(str, enum.Enum):
+    queued = "queued"
     processing = "processing"
     completed = "completed"
     failed = "failed"
@@ -40,10 +43,49 @@ class Import(Base):
     resolved_at = Column(DateTime(timezone=True), nullable=True)  # 🆕 追加
     s3_key = Column(String(500), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # 🆕 ETag / Last-Modified 用（ステータス・件数が変わるたびに更新）
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    # 同一ファイルの再アップロード検知（"sha256:..." または S3 ETag の "md5:..."）
+    content_hash = Column(String(80), nullable=True, index=True)
+    mapping_hash = Column(String(64), nullable=True)
+    # 完了時点の顧客テーブルの状態（件数・最大ID・最終更新）。一致すれば結果を再利用できる
+    customers_fingerprint = Column(String(100), nullable=True)
+    replayed_from_id = Column(Integer, ForeignKey("imports.id"), nullable=True)
+    mapping = Column(JSON, nullable=True)
+    # 🆕 マッチング設定（閾値・上位件数など。matchers.MatchConfig）とルール別の集計
+    match_config = Column(JSON, nullable=True)
+    metrics = Column(JSON, nullable=True)
+    # 🆕 保持期間を過ぎて行・解決済み候補を削除した日時と退避先（件数の列はそのまま残る）
+    archived_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    archive_s3_key = Column(String(500), nullable=True)
+
+
+class ImportShard(Base):
+    """シャード並列インポートの各シャード（件数は完了後に親 Import へ集計）"""
+    __tablename__ = "import_shards"
+    __table_args__ = (
+        UniqueConstraint("import_id", "shard_no", name="uq_import_shards_import_id_shard_no"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    import_id = Column(Integer, ForeignKey("imports.id"), nullable=False, index=True)
+    shard_no = Column(Integer, nullable=False)
+    shard_count = Column(Integer, nullable=False)
+    status = Column(Enum(ImportStatus), default=ImportStatus.processing)
+    total_rows = Column(Integer, default=0)
+    inserted_count = Column(Integer, default=0)
+    error_count = Column(Integer, default=0)
+    candidate_count = Column(Integer, default=0)
+    error_message = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
 class ImportRow(Base):
     __tablename__ = "import_rows"
+    __table_args__ = (
+        Index("ix_import_rows_import_id_row_index", "import_id", "row_index"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     import_id = Column(Integer, ForeignKey("imports.id"), nullable=False)
@@ -53,6 +95,8 @@ class ImportRow(Base):
     normalized_data = Column(JSON)
     validation_errors = Column(JSON)
     status = Column(Enum(RowStatus), default=RowStatus.pending)
+    # マッピング + 生データのハッシュ（取り込み済みの同一行を再処理しない）
+    row_hash = Column(String(64), nullable=True, index=True)
 
 
 class Customer(Base):
@@ -67,6 +111,60 @@ class Customer(Base):
     state = Column(String(100), nullable=True)
     zip_code = Column(String(20), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+    # 重複検知用のマッチキー（insert/update時に自動更新）
+    name_key = Column(String(255), nullable=True, index=True)
+    name_token_key = Column(String(255), nullable=True, index=True)
+    name_kana_key = Column(String(255), nullable=True, index=True)
+    phone_key = Column(String(32), nullable=True, index=True)
+    address_key = Column(String(255), nullable=True, index=True)
+
+    def refresh_match_keys(self):
+        """氏名・電話・住所からマッチキーを再計算"""
+        for column, value in customer_match_keys(self.full_name, self.phone, self.address).items():
+            setattr(self, column, value)
+
+
+MATCH_KEY_COLUMNS = ("name_key", "name_token_key", "name_kana_key", "phone_key", "address_key")
+
+
+class CustomerAddressBand(Base):
+    """住所 MinHash/LSH のバンドハッシュ（類似住所の候補検索用）"""
+    __tablename__ = "customer_address_bands"
+
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
+    band_hash = Column(BigInteger, nullable=False, index=True)
+
+
+@event.listens_for(Customer, "before_insert")
+@event.listens_for(Customer, "before_update")
+def _refresh_customer_match_keys(mapper, connection, target):
+    target.refresh_match_keys()
+
+
+def replace_address_bands(connection, customer_id: int, address):
+    """顧客の住所バンドを入れ替える"""
+    table = CustomerAddressBand.__table__
+    connection.execute(table.delete().where(table.c.customer_id == customer_id))
+    bands = address_band_hashes(address)
+    if bands:
+        connection.execute(table.insert(), [
+            {"customer_id": customer_id, "band_hash": band} for band in bands
+        ])
+
+
+@event.listens_for(Customer, "after_insert")
+def _insert_customer_address_bands(mapper, connection, target):
+    if target.address:
+        replace_address_bands(connection, target.id, target.address)
+
+
+@event.listens_for(Customer, "after_update")
+def _update_customer_address_bands(mapper, connection, target):
+    if inspect(target).attrs.address.history.has_changes():
+        replace_address_bands(connection, target.id, target.address)
 
 
 class DuplicateCandidate(Base):
@@ -74,10 +172,99 @@ class DuplicateCandidate(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     import_row_id = Column(Integer, ForeignKey(
-        "import_rows.id"), nullable=False)
+        "import_rows.id"), nullable=False, index=True)
     existing_customer_id = Column(
         Integer, ForeignKey("customers.id"), nullable=False)
     match_reason = Column(String(255))
     similarity_score = Column(DECIMAL(3, 2))
     resolution = Column(Enum(Resolution), default=Resolution.pending)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ImportRowMatchKey(Base):
+    """
+    候補行のマッチキー（key_type は MATCH_KEY_COLUMNS・"email"・"address_band"）
+    顧客が作成・更新・マージされたとき、キーが重なる未解決の行だけを再判定するために引く
+    """
+    __tablename__ = "import_row_match_keys"
+    __table_args__ = (
+        Index("ix_import_row_match_keys_key", "key_type", "key_value"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    import_row_id = Column(Integer, ForeignKey("import_rows.id"), nullable=False, index=True)
+    key_type = Column(String(32), nullable=False)
+    key_value = Column(String(255), nullable=False)
+
+
+class DedupeSweep(Base):
+    """既存顧客どうしの重複スイープ（dedupe_sweep 参照）"""
+    __tablename__ = "dedupe_sweeps"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(Enum(ImportStatus), default=ImportStatus.queued)
+    shard_count = Column(Integer, nullable=False)
+    match_config = Column(JSON, nullable=True)
+    total_customers = Column(Integer, default=0)
+    pair_count = Column(Integer, default=0)
+    cluster_count = Column(Integer, default=0)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class DedupeSweepShard(Base):
+    """スイープの顧客ID範囲 (min_customer_id, max_customer_id] ごとの進捗（last_customer_id がチェックポイント）"""
+    __tablename__ = "dedupe_sweep_shards"
+    __table_args__ = (
+        UniqueConstraint("sweep_id", "shard_no", name="uq_dedupe_sweep_shards_sweep_id_shard_no"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    sweep_id = Column(Integer, ForeignKey("dedupe_sweeps.id"), nullable=False, index=True)
+    shard_no = Column(Integer, nullable=False)
+    min_customer_id = Column(Integer, nullable=False)
+    max_customer_id = Column(Integer, nullable=False)
+    last_customer_id = Column(Integer, nullable=False)
+    scanned_count = Column(Integer, default=0)
+    pair_count = Column(Integer, default=0)
+    status = Column(Enum(ImportStatus), default=ImportStatus.queued)
+    error_message = Column(Text, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class DedupePair(Base):
+    """スイープで一致した顧客の組（customer_id < other_customer_id）"""
+    __tablename__ = "dedupe_pairs"
+    __table_args__ = (
+        # 同じシャードを二重に処理しても組が重複しないように（ensure-schema で追加できるよう一意インデックス）
+        Index("ux_dedupe_pairs_sweep_id_customer_id_other", "sweep_id", "customer_id", "other_customer_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    sweep_id = Column(Integer, ForeignKey("dedupe_sweeps.id"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    other_customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    match_reason = Column(String(255))
+    similarity_score = Column(DECIMAL(3, 2))
+
+
+class DedupeCluster(Base):
+    """同一人物と思われる顧客のまとまり（組の連結成分）。レビュー用"""
+    __tablename__ = "dedupe_clusters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sweep_id = Column(Integer, ForeignKey("dedupe_sweeps.id"), nullable=False, index=True)
+    size = Column(Integer, nullable=False)
+    max_score = Column(DECIMAL(3, 2))
+    resolution = Column(Enum(Resolution), default=Resolution.pending)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DedupeClusterMember(Base):
+    __tablename__ = "dedupe_cluster_members"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cluster_id = Column(Integer, ForeignKey("dedupe_clusters.id"), nullable=False, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
@@ -0,0 +1,67 @@
+"""
+NDJSON（application/x-ndjson）の入出力ヘルパー
+
+リクエストストリームを1行ずつ逐次パースし、結果も1行ずつシリアライズする。
+"""
+from typing import Any, AsyncIterator, Tuple
+import json
+from starlette.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    リクエストボディを読みながら結果を返す StreamingResponse
+    Starlette の StreamingResponse は切断検知のために receive() を並行して呼び、
+    未読のリクエストボディを読み捨ててしまうため、切断検知は送信エラーに任せる
+    """
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def is_ndjson(content_type: str) -> bool:
+    """Content-Type が NDJSON か判定"""
+    return (content_type or "").split(";")[0].strip().lower() in (NDJSON_MEDIA_TYPE, "application/jsonl")
+
+
+def dumps_line(obj: Any) -> bytes:
+    """1レコードを NDJSON の1行にシリアライズ"""
+    return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Any, str]]:
+    """
+    バイトストリームを逐次パースし (行番号, オブジェクト, エラーメッセージ) を返す
+    空行は読み飛ばし、不正な行はオブジェクトを None、エラーメッセージ付きで返す
+    """
+    buffer = b""
+    index = 0
+
+    def parse(line: bytes):
+        nonlocal index
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            result = (index, json.loads(line), "")
+        except ValueError as e:
+            result = (index, None, f"JSONの形式が不正です: {e}")
+        index += 1
+        return result
+
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            parsed = parse(line)
+            if parsed:
+                yield parsed
+
+    parsed = parse(buffer)
+    if parsed:
+        yield parsed
@@ -0,0 +1,144 @@
+"""
+パイプライン用の省メモリな行・顧客レコード
+
+df.to_dict('records') は行ごとに列名をキーに持つ dict を作るため、大きなファイルでは
+RSS と GC 時間の大半を占める。ここでは
+- ファイルの行: 列名 → 位置 の RowLayout を全行で共有し、値はタプルだけを持つ SourceRow
+- 重複検知用の既存顧客: __slots__ の CustomerRecord
+を使う。どちらも dict と同じ読み取り（row[key] / row.get(key) / key in row）ができる。
+"""
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class RowLayout:
+    """列名と位置の対応（1ファイルに1つ）。マッピングの解決結果もここにキャッシュする"""
+
+    __slots__ = ("columns", "positions", "_resolved")
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = tuple(columns)
+        self.positions = {column: i for i, column in enumerate(self.columns)}
+        self._resolved = {}
+
+    def resolve(self, mapping: dict) -> Tuple[Tuple[str, int], ...]:
+        """マッピング（DB項目 → 列名）を (DB項目, 列位置) に一度だけ解決する"""
+        key = tuple(mapping.items())
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = tuple(
+                (field, self.positions[column])
+                for field, column in mapping.items()
+                if column and column in self.positions
+            )
+            self._resolved[key] = resolved
+        return resolved
+
+
+class SourceRow(Mapping):
+    """
+    ファイルの1行（dict 互換の読み取り専用ビュー）
+    raw_data は全列の JSON（列を絞って読んだキャッシュの行だけが持つ。なければ全列の値から作る）
+    """
+
+    __slots__ = ("layout", "values", "raw_data")
+
+    def __init__(self, layout: RowLayout, values: tuple, raw_data: Optional[str] = None):
+        self.layout = layout
+        self.values = values
+        self.raw_data = raw_data
+
+    def __getitem__(self, column):
+        return self.values[self.layout.positions[column]]
+
+    def __contains__(self, column) -> bool:
+        return column in self.layout.positions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.layout.columns)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def get(self, column, default=None):
+        position = self.layout.positions.get(column)
+        return default if position is None else self.values[position]
+
+    def project(self, mapping: dict) -> dict:
+        """マッピング済みの dict（位置は layout で解決済み）"""
+        values = self.values
+        return {field: values[position] for field, position in self.layout.resolve(mapping)}
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class SourceRows(Sequence):
+    """ファイル全体の行（値のタプルのリスト + 共有 layout。raw_data は行ごとの全列の JSON）"""
+
+    __slots__ = ("layout", "rows", "raw_data")
+
+    def __init__(self, columns: Sequence[str], rows: List[tuple], raw_data: Optional[List[str]] = None):
+        self.layout = RowLayout(columns)
+        self.rows = rows
+        self.raw_data = raw_data
+
+    @classmethod
+    def from_dataframe(cls, df, raw_data: Optional[List[str]] = None) -> "SourceRows":
+        """DataFrame から作成（空セルの NaN は None）"""
+        df = df.astype(object).where(df.notna(), None)
+        return cls([str(column) for column in df.columns], list(df.itertuples(index=False, name=None)), raw_data)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            raw_data = self.raw_data[index] if self.raw_data is not None else [None] * len(self.rows[index])
+            return [SourceRow(self.layout, values, raw) for values, raw in zip(self.rows[index], raw_data)]
+        return SourceRow(self.layout, self.rows[index], self.raw_data[index] if self.raw_data is not None else None)
+
+    def __iter__(self) -> Iterator[SourceRow]:
+        layout = self.layout
+        if self.raw_data is None:
+            for values in self.rows:
+                yield SourceRow(layout, values)
+        else:
+            for values, raw in zip(self.rows, self.raw_data):
+                yield SourceRow(layout, values, raw)
+
+
+class CustomerRecord:
+    """重複検知用の既存顧客（dict 互換の読み取り）"""
+
+    __slots__ = ("id", "full_name", "email", "phone", "address", "city", "state", "zip_code")
+
+    FIELDS = __slots__
+
+    def __init__(self, id, full_name=None, email=None, phone=None, address=None,
+                 city=None, state=None, zip_code=None):
+        self.id = id
+        self.full_name = full_name
+        self.email = email
+        self.phone = phone
+        self.address = address
+        self.city = city
+        self.state = state
+        self.zip_code = zip_code
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS
+
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self) -> str:
+        return f"CustomerRecord({self.to_dict()!r})"
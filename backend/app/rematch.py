@@ -0,0 +1,325 @@
+"""
+顧客の変更に合わせた重複候補の再判定（差分のみ）
+
+重複候補はインポート時に一度だけ作られるため、レビューでマージ・新規作成された顧客や
+別のインポートで更新された顧客に対して、他の未解決の候補が古くなる（マージで変わった顧客を指したまま、
+新しくできた顧客が候補に入らない）。ここでは変更された顧客について
+- 候補行のマッチキー（import_row_match_keys）が顧客のキーと重なる行
+- その顧客を未解決の候補として指している行
+だけを取り出し、インポート時と同じルール・設定（Import.match_config）で判定し直して候補を入れ替える。
+
+対象は完了したインポートの status=candidate で、まだどの候補も解決されていない行。判定し直して候補がなくなった行は
+インポート時に候補がなかった行と同じく新規顧客として取り込み（status=inserted）、Import の件数も移す。
+作成した顧客も他の行の候補になりうるので、同じ再判定を続けて行う。
+
+インポート完了時の再判定は、そのインポートの開始以降に変わった顧客のうち、未解決の候補が指しているか
+候補行とマッチキーが重なる顧客だけを SQL で絞ってから行う（取り込んだ顧客全件は照合し直さない）。
+
+使い方:
+    python -m app.manage rematch-candidates --since "2024-01-01 00:00:00" [--backfill-keys]
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+import json
+import os
+from sqlalchemy import BigInteger, and_, cast, or_, select
+from sqlalchemy.orm import Session
+from . import crud, models
+from .address_lsh import AddressLSH
+from .import_engine import build_match_index, find_duplicate_candidates
+from .import_processor import MATCH_CHUNK_SIZE, ROW_ERRORS, empty_to_none, load_candidate_customers
+from .matchers import MatchConfig
+
+# インポート完了時に、そのインポートで作成・更新された顧客について再判定する
+REMATCH_AFTER_IMPORT = os.getenv("REMATCH_AFTER_IMPORT", "true").lower() == "true"
+# 1回のクエリで扱う顧客数
+REMATCH_CUSTOMER_BATCH_SIZE = int(os.getenv("REMATCH_CUSTOMER_BATCH_SIZE", "500"))
+
+
+def _normalized(import_row) -> dict:
+    data = import_row.normalized_data or {}
+    return json.loads(data) if isinstance(data, str) else data
+
+
+def customer_key_values(db: Session, customer_ids: Iterable[int]) -> Dict[str, set]:
+    """顧客のマッチキー（key_type → 値の集合。import_row_match_keys と同じ形式の文字列）"""
+    customer_ids = list(customer_ids)
+    keys = {column: set() for column in ("email", "address_band") + models.MATCH_KEY_COLUMNS}
+    if not customer_ids:
+        return keys
+
+    columns = ("email",) + models.MATCH_KEY_COLUMNS
+    for row in db.execute(
+        select(*(getattr(models.Customer, column) for column in columns)).where(models.Customer.id.in_(customer_ids))
+    ):
+        for column, value in zip(columns, row):
+            if value:
+                keys[column].add(str(value))
+    keys["address_band"].update(
+        str(band) for band in db.execute(
+            select(models.CustomerAddressBand.band_hash).where(
+                models.CustomerAddressBand.customer_id.in_(customer_ids)
+            )
+        ).scalars()
+    )
+    return keys
+
+
+def pending_row_ids(db: Session, customer_ids: Iterable[int]) -> List[int]:
+    """顧客の変更で判定が変わりうる未解決の候補行のID"""
+    customer_ids = list(customer_ids)
+    if not customer_ids:
+        return []
+
+    key = models.ImportRowMatchKey
+    conditions = [
+        and_(key.key_type == key_type, key.key_value.in_(values))
+        for key_type, values in customer_key_values(db, customer_ids).items()
+        if values
+    ]
+    row_ids = set()
+    if conditions:
+        row_ids.update(db.execute(select(key.import_row_id).where(or_(*conditions))).scalars())
+
+    candidate = models.DuplicateCandidate
+    row_ids.update(db.execute(
+        select(candidate.import_row_id).where(
+            candidate.existing_customer_id.in_(customer_ids),
+            candidate.resolution == models.Resolution.pending
+        )
+    ).scalars())
+    if not row_ids:
+        return []
+
+    # 候補のどれかが解決済みの行はレビュー済みなので対象外
+    resolved = select(candidate.import_row_id).where(
+        candidate.import_row_id.in_(row_ids),
+        candidate.resolution != models.Resolution.pending
+    )
+    return sorted(db.execute(
+        select(models.ImportRow.id).where(
+            models.ImportRow.id.in_(row_ids),
+            models.ImportRow.status.in_((models.RowStatus.candidate, models.RowStatus.pending)),
+            ~models.ImportRow.id.in_(resolved),
+            # 処理中のインポートの行は、完了時の件数の更新で上書きされないよう完了時の再判定に任せる
+            models.ImportRow.import_id.in_(
+                select(models.Import.id).where(models.Import.status == models.ImportStatus.completed)
+            )
+        )
+    ).scalars())
+
+
+def open_row_ids():
+    """未解決の候補行（candidate・旧仕様の pending）の ID を返すサブクエリ"""
+    return select(models.ImportRow.id).where(
+        models.ImportRow.status.in_((models.RowStatus.candidate, models.RowStatus.pending))
+    )
+
+
+def affected_customer_ids(db: Session, since: Optional[datetime], after_id: int, limit: int) -> List[int]:
+    """
+    since 以降に作成・更新された顧客のうち、未解決の候補が指しているか、未解決の候補行とマッチキーが
+    重なる顧客の ID（after_id より大きいものを ID 順に limit 件）。判定が変わりえない顧客は読まない
+    """
+    customer = models.Customer
+    key = models.ImportRowMatchKey
+    candidate = models.DuplicateCandidate
+
+    def row_keys(key_type: str):
+        return select(key.key_value).where(key.key_type == key_type, key.import_row_id.in_(open_row_ids()))
+
+    conditions = [
+        customer.id.in_(select(candidate.existing_customer_id).where(
+            candidate.resolution == models.Resolution.pending
+        )),
+        customer.id.in_(select(models.CustomerAddressBand.customer_id).where(
+            models.CustomerAddressBand.band_hash.in_(
+                select(cast(key.key_value, BigInteger)).where(
+                    key.key_type == "address_band", key.import_row_id.in_(open_row_ids())
+                )
+            )
+        )),
+    ] + [getattr(customer, column).in_(row_keys(column)) for column in ("email",) + models.MATCH_KEY_COLUMNS]
+
+    query = select(customer.id).where(customer.id > after_id, or_(*conditions))
+    if since is not None:
+        # updated_at は秒精度の DB があるため1秒前から読む
+        query = query.where(customer.updated_at >= since - timedelta(seconds=1))
+    return db.execute(query.order_by(customer.id).limit(limit)).scalars().all()
+
+
+def _insert_cleared_row(db: Session, import_row: models.ImportRow, row: dict) -> Optional[int]:
+    """
+    候補がなくなった行を、インポート時に候補がなかった行と同じく新規顧客として取り込む（顧客IDを返す）
+    同じ email の顧客が先にできていた場合などDBエラーになった行は error 行にする（None を返す）
+    """
+    try:
+        with db.begin_nested():
+            customer = crud.create_customer(
+                db=db,
+                full_name=row.get("full_name"),
+                email=empty_to_none(row.get("email")),
+                phone=empty_to_none(row.get("phone")),
+                address=row.get("address") or row.get("address_line1"),
+                commit=False
+            )
+    except ROW_ERRORS as e:
+        message = str(getattr(e, "orig", None) or e)[:500]
+        print(f"WARN: 候補がなくなった行 {import_row.id} の取り込みに失敗: {message}")
+        import_row.validation_errors = [f"database: {message}"]
+        import_row.status = models.RowStatus.error
+        return None
+    import_row.status = models.RowStatus.inserted
+    return customer.id
+
+
+def rematch_rows(db: Session, row_ids: List[int], created_customer_ids: List[int] = None) -> Dict[str, int]:
+    """
+    候補行を判定し直し、未解決の候補を入れ替える（MATCH_CHUNK_SIZE 行ごとにコミット）
+    スコア・理由が変わった候補は更新し、外れた候補は削除、新しい候補は追加する
+    候補がなくなった行は新規顧客として取り込み、作成した顧客IDを created_customer_ids に追加する
+    """
+    result = {"rows": 0, "added": 0, "updated": 0, "removed": 0, "inserted": 0, "errors": 0}
+    created_customer_ids = created_customer_ids if created_customer_ids is not None else []
+    configs: Dict[int, MatchConfig] = {}
+    for start in range(0, len(row_ids), MATCH_CHUNK_SIZE):
+        import_rows = db.query(models.ImportRow).filter(
+            models.ImportRow.id.in_(row_ids[start:start + MATCH_CHUNK_SIZE])
+        ).all()
+        rows = [_normalized(import_row) for import_row in import_rows]
+
+        existing_customers = load_candidate_customers(db, rows)
+        existing_index = build_match_index(existing_customers)
+        address_index = AddressLSH()
+        address_index.add_many(existing_customers)
+
+        current: Dict[int, Dict[int, models.DuplicateCandidate]] = {}
+        for candidate in crud.get_candidates_by_row_ids(db, [import_row.id for import_row in import_rows]):
+            if candidate.resolution == models.Resolution.pending:
+                current.setdefault(candidate.import_row_id, {})[candidate.existing_customer_id] = candidate
+
+        imports: Dict[int, models.Import] = {}
+        for import_row, row in zip(import_rows, rows):
+            if import_row.import_id not in imports:
+                imports[import_row.import_id] = crud.get_import(db, import_row.import_id)
+            if import_row.import_id not in configs:
+                db_import = crud.get_import(db, import_row.import_id)
+                configs[import_row.import_id] = MatchConfig.from_dict(db_import.match_config if db_import else None)
+            found = find_duplicate_candidates(
+                row, existing_customers, index=existing_index, address_index=address_index,
+                config=configs[import_row.import_id]
+            )
+            previous = current.get(import_row.id, {})
+            for match in found:
+                score = round(match["similarity_score"], 2)
+                candidate = previous.pop(match["customer_id"], None)
+                if candidate is None:
+                    db.add(models.DuplicateCandidate(
+                        import_row_id=import_row.id,
+                        existing_customer_id=match["customer_id"],
+                        match_reason=match["match_reason"],
+                        similarity_score=score
+                    ))
+                    result["added"] += 1
+                elif float(candidate.similarity_score or 0) != score or candidate.match_reason != match["match_reason"]:
+                    candidate.similarity_score = score
+                    candidate.match_reason = match["match_reason"]
+                    result["updated"] += 1
+            for candidate in previous.values():
+                db.delete(candidate)
+                result["removed"] += 1
+            if not found:
+                was_candidate = import_row.status == models.RowStatus.candidate
+                customer_id = _insert_cleared_row(db, import_row, row)
+                db_import = imports[import_row.import_id]
+                if db_import is not None:
+                    if was_candidate:
+                        db_import.candidate_count = max((db_import.candidate_count or 0) - 1, 0)
+                    if customer_id is None:
+                        db_import.error_count = (db_import.error_count or 0) + 1
+                    else:
+                        db_import.inserted_count = (db_import.inserted_count or 0) + 1
+                if customer_id is None:
+                    result["errors"] += 1
+                else:
+                    created_customer_ids.append(customer_id)
+                    result["inserted"] += 1
+            elif import_row.status != models.RowStatus.candidate:
+                import_row.status = models.RowStatus.candidate
+            result["rows"] += 1
+        db.commit()
+    return result
+
+
+def rematch_customers(db: Session, customer_ids: Iterable[int]) -> Dict[str, int]:
+    """
+    作成・更新・マージされた顧客について、影響する未解決の候補行だけを判定し直す
+    候補がなくなった行から作成した顧客についても続けて判定し直す（行は1回しか取り込まれないので終わる）
+    """
+    total = {"rows": 0, "added": 0, "updated": 0, "removed": 0, "inserted": 0, "errors": 0}
+    customer_ids = list(customer_ids)
+    while customer_ids:
+        created: List[int] = []
+        for name, count in rematch_rows(db, pending_row_ids(db, customer_ids), created).items():
+            total[name] += count
+        customer_ids = created
+    return total
+
+
+def rematch_changed_since(db: Session, since: Optional[datetime],
+                          batch_size: int = REMATCH_CUSTOMER_BATCH_SIZE) -> Dict[str, int]:
+    """
+    since 以降に作成・更新された顧客について再判定する（since が None なら全顧客）
+    未解決の候補行と関係する顧客（affected_customer_ids）だけを対象にする
+    """
+    total = {"customers": 0, "rows": 0, "added": 0, "updated": 0, "removed": 0, "inserted": 0, "errors": 0}
+    last_id = 0
+    while True:
+        customer_ids = affected_customer_ids(db, since, last_id, batch_size)
+        if not customer_ids:
+            break
+        last_id = customer_ids[-1]
+        total["customers"] += len(customer_ids)
+        for name, count in rematch_customers(db, customer_ids).items():
+            total[name] += count
+    return total
+
+
+def rematch_after_import(db: Session, db_import: models.Import) -> Optional[Dict[str, int]]:
+    """
+    インポートの開始以降に作成・更新された顧客のうち、未解決の候補行と関係するものについて再判定する
+    （失敗してもインポートは失敗にしない）
+    """
+    if not REMATCH_AFTER_IMPORT:
+        return None
+    try:
+        result = rematch_changed_since(db, db_import.created_at)
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: 重複候補の再判定エラー (import {db_import.id}): {str(e)}")
+        return None
+    if result["rows"]:
+        print(f"🔁 import {db_import.id}: 候補行 {result['rows']} 件を再判定 "
+              f"(追加 {result['added']} / 更新 {result['updated']} / 削除 {result['removed']})")
+    return result
+
+
+def backfill_row_match_keys(db: Session, batch_size: int = 1000) -> int:
+    """キーを持たない候補行（この機能より前に作られた行）のマッチキーを作成"""
+    row = models.ImportRow
+    key = models.ImportRowMatchKey
+    last_id = 0
+    created = 0
+    while True:
+        import_rows = db.query(row).filter(
+            row.id > last_id,
+            row.status == models.RowStatus.candidate,
+            ~row.id.in_(select(key.import_row_id))
+        ).order_by(row.id).limit(batch_size).all()
+        if not import_rows:
+            return created
+        for import_row in import_rows:
+            crud.create_row_match_keys(db, import_row.id, _normalized(import_row))
+        db.commit()
+        last_id = import_rows[-1].id
+        created += len(import_rows)
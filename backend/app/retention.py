@@ -0,0 +1,273 @@
+"""
+import_rows / duplicate_candidates の保持期間と退避
+
+完了（または失敗）から IMPORT_RETENTION_DAYS 日を過ぎたインポートについて、
+行と解決済みの重複候補を小さなトランザクションで少しずつ削除する（バッチごとにコミットして待つ）。
+Import の件数（total_rows / inserted_count など）は残し、archived_at に削除日時を記録する。
+未解決（pending）の候補がある行は削除しない（解決後の次回実行で削除される）。
+
+RETENTION_ARCHIVE_TO_S3=true（または archive=True）なら、削除前に行と候補を gzip の NDJSON にして
+S3 の RETENTION_ARCHIVE_PREFIX/{import_id}/import_rows.ndjson.gz へ退避する。
+
+MySQL では import_rows を import_id の範囲でパーティション分割できる（任意。partition_statements 参照）。
+
+使い方:
+    python -m app.manage purge-imports --older-than-days 365 [--archive] [--dry-run]
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set
+import gzip
+import json
+import os
+import tempfile
+import time
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.orm import Session
+from . import models
+from .s3_service import s3_service
+
+RETENTION_DAYS = int(os.getenv("IMPORT_RETENTION_DAYS", "365"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+# バッチ間の待ち時間（本番の負荷に応じて調整）
+RETENTION_SLEEP_SECONDS = float(os.getenv("RETENTION_SLEEP_SECONDS", "0.2"))
+RETENTION_ARCHIVE_TO_S3 = os.getenv("RETENTION_ARCHIVE_TO_S3", "false").lower() == "true"
+RETENTION_ARCHIVE_PREFIX = os.getenv("RETENTION_ARCHIVE_PREFIX", "archive/imports")
+
+# 削除対象にするインポートの状態（処理中・待ち行列のものは対象外）
+RETENTION_STATUSES = (models.ImportStatus.completed, models.ImportStatus.failed)
+
+
+def expired_imports(db: Session, older_than_days: int = RETENTION_DAYS, limit: Optional[int] = None) -> List[models.Import]:
+    """保持期間を過ぎ、まだ退避していないインポート（古い順）"""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    query = db.query(models.Import).filter(
+        models.Import.status.in_(RETENTION_STATUSES),
+        models.Import.archived_at.is_(None),
+        models.Import.created_at < cutoff
+    ).order_by(models.Import.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _removable_row_batches(db: Session, import_id: int, batch_size: int) -> Iterator[List[int]]:
+    """未解決の候補を持たない行の ID を、ID順に batch_size 件ずつ返す（削除しながら読める keyset 方式）"""
+    row = models.ImportRow
+    candidate = models.DuplicateCandidate
+    last_id = 0
+    while True:
+        ids = db.execute(
+            select(row.id).where(row.import_id == import_id, row.id > last_id).order_by(row.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return
+        last_id = ids[-1]
+        pending = set(db.execute(
+            select(candidate.import_row_id).where(
+                candidate.import_row_id.in_(ids),
+                candidate.resolution == models.Resolution.pending
+            )
+        ).scalars())
+        removable = [row_id for row_id in ids if row_id not in pending]
+        if removable:
+            yield removable
+
+
+def _archive_key(import_id: int) -> str:
+    return f"{RETENTION_ARCHIVE_PREFIX.rstrip('/')}/{import_id}/import_rows.ndjson.gz"
+
+
+def archive_import_rows(db: Session, import_id: int, batch_size: int = RETENTION_BATCH_SIZE):
+    """
+    削除対象の行と候補を gzip の NDJSON にして S3 に退避する
+    (S3キー, 退避した行IDの集合) を返す。アップロードに失敗したら例外（何も削除しない）
+    """
+    exported: Set[int] = set()
+    with tempfile.TemporaryFile() as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode="wb") as archive:
+            for ids in _removable_row_batches(db, import_id, batch_size):
+                candidates: Dict[int, list] = {}
+                for candidate in db.query(models.DuplicateCandidate).filter(
+                    models.DuplicateCandidate.import_row_id.in_(ids)
+                ):
+                    candidates.setdefault(candidate.import_row_id, []).append({
+                        "id": candidate.id,
+                        "existing_customer_id": candidate.existing_customer_id,
+                        "match_reason": candidate.match_reason,
+                        "similarity_score": float(candidate.similarity_score or 0),
+                        "resolution": candidate.resolution.value if candidate.resolution else None,
+                    })
+                for import_row in db.query(models.ImportRow).filter(
+                    models.ImportRow.id.in_(ids)
+                ).order_by(models.ImportRow.id):
+                    line = {
+                        "id": import_row.id,
+                        "import_id": import_row.import_id,
+                        "row_index": import_row.row_index,
+                        "raw_data": import_row.raw_data,
+                        "mapped_data": import_row.mapped_data,
+                        "normalized_data": import_row.normalized_data,
+                        "validation_errors": import_row.validation_errors,
+                        "status": import_row.status.value if import_row.status else None,
+                        "row_hash": import_row.row_hash,
+                        "candidates": candidates.get(import_row.id, []),
+                    }
+                    archive.write((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+                    exported.add(import_row.id)
+                # 読み取りのスナップショットを長く保持しない
+                db.rollback()
+
+        if not exported:
+            return None, exported
+        tmp.seek(0)
+        s3_key = _archive_key(import_id)
+        if not s3_service.upload_fileobj(tmp, s3_key, "application/gzip"):
+            raise Exception(f"退避ファイルのアップロードに失敗しました: {s3_key}")
+    return s3_key, exported
+
+
+def purge_import(
+    db: Session,
+    db_import: models.Import,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    sleep_seconds: float = RETENTION_SLEEP_SECONDS,
+    archive: bool = RETENTION_ARCHIVE_TO_S3
+) -> Dict[str, object]:
+    """1インポート分の行・解決済み候補を削除（バッチごとにコミット）。件数を返す"""
+    import_id = db_import.id
+    s3_key = None
+    exported = None
+    if archive:
+        s3_key, exported = archive_import_rows(db, import_id, batch_size)
+
+    candidate_table = models.DuplicateCandidate.__table__
+    row_table = models.ImportRow.__table__
+    key_table = models.ImportRowMatchKey.__table__
+    deleted_rows = 0
+    deleted_candidates = 0
+    for ids in _removable_row_batches(db, import_id, batch_size):
+        if exported is not None:
+            # 退避した行だけ削除する（退避後に解決された行は次回）
+            ids = [row_id for row_id in ids if row_id in exported]
+            if not ids:
+                continue
+        deleted_candidates += db.execute(candidate_table.delete().where(
+            candidate_table.c.import_row_id.in_(ids),
+            candidate_table.c.resolution != models.Resolution.pending
+        )).rowcount
+        remaining = select(candidate_table.c.import_row_id).where(candidate_table.c.import_row_id.in_(ids))
+        db.execute(key_table.delete().where(
+            key_table.c.import_row_id.in_(ids),
+            ~key_table.c.import_row_id.in_(remaining)
+        ))
+        deleted_rows += db.execute(row_table.delete().where(
+            row_table.c.id.in_(ids),
+            ~row_table.c.id.in_(remaining)
+        )).rowcount
+        db.commit()
+        if sleep_seconds:
+            time.sleep(sleep_seconds)
+
+    kept = db.query(func.count(models.ImportRow.id)).filter(models.ImportRow.import_id == import_id).scalar()
+    db_import = db.get(models.Import, import_id)
+    if s3_key:
+        db_import.archive_s3_key = s3_key
+    if not kept:
+        db_import.archived_at = datetime.now()
+    db.commit()
+
+    return {
+        "import_id": import_id,
+        "deleted_rows": deleted_rows,
+        "deleted_candidates": deleted_candidates,
+        "kept_rows": kept,
+        "archive_s3_key": s3_key,
+    }
+
+
+def run_retention(
+    db: Session,
+    older_than_days: int = RETENTION_DAYS,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    sleep_seconds: float = RETENTION_SLEEP_SECONDS,
+    archive: bool = RETENTION_ARCHIVE_TO_S3,
+    limit: Optional[int] = None,
+    dry_run: bool = False
+) -> List[Dict[str, object]]:
+    """保持期間を過ぎたインポートを古い順に処理する（dry_run は対象と行数だけ返す）"""
+    results = []
+    for db_import in expired_imports(db, older_than_days, limit):
+        if dry_run:
+            rows = db.query(func.count(models.ImportRow.id)).filter(
+                models.ImportRow.import_id == db_import.id
+            ).scalar()
+            results.append({"import_id": db_import.id, "rows": rows})
+            continue
+        result = purge_import(db, db_import, batch_size, sleep_seconds, archive)
+        print(f"🗑️ import {result['import_id']}: 行 {result['deleted_rows']} 件・候補 {result['deleted_candidates']} 件を削除"
+              f"（未解決で残した行 {result['kept_rows']} 件）")
+        results.append(result)
+    return results
+
+
+def partition_statements(max_import_id: int, every: int, existing_bounds: Optional[List[int]] = None,
+                         foreign_keys: Optional[List[tuple]] = None) -> List[str]:
+    """
+    import_rows を import_id の範囲（every 件ごと）でパーティション分割する MySQL の DDL
+    - 未分割: 外部キーの削除（InnoDB のパーティションテーブルは外部キー不可）・主キーへの import_id 追加・分割
+    - 分割済み（existing_bounds あり）: pmax を分割して max_import_id の先まで範囲を追加
+    foreign_keys は (テーブル名, 制約名) のリスト
+    """
+    top = (max_import_id // every + 2) * every
+    if existing_bounds:
+        start = max(existing_bounds) + every
+        bounds = list(range(start, top + 1, every))
+        if not bounds:
+            return []
+        partitions = ", ".join(f"PARTITION p{bound} VALUES LESS THAN ({bound})" for bound in bounds)
+        return [
+            f"ALTER TABLE import_rows REORGANIZE PARTITION pmax INTO "
+            f"({partitions}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+        ]
+
+    statements = [f"ALTER TABLE {table} DROP FOREIGN KEY {name}" for table, name in foreign_keys or []]
+    statements.append("ALTER TABLE import_rows DROP PRIMARY KEY, ADD PRIMARY KEY (id, import_id)")
+    partitions = ", ".join(
+        f"PARTITION p{bound} VALUES LESS THAN ({bound})" for bound in range(every, top + 1, every)
+    )
+    statements.append(
+        f"ALTER TABLE import_rows PARTITION BY RANGE (import_id) "
+        f"({partitions}, PARTITION pmax VALUES LESS THAN MAXVALUE)"
+    )
+    return statements
+
+
+def partition_import_rows(engine, every: int = 10000, apply: bool = False) -> List[str]:
+    """現在の状態から partition_statements を作り、apply=True なら実行する（MySQL のみ）"""
+    if engine.dialect.name != "mysql":
+        raise Exception("パーティション分割は MySQL のみ対応しています")
+
+    with engine.connect() as conn:
+        max_import_id = conn.execute(select(func.max(models.Import.id))).scalar() or 0
+        bounds = [
+            int(value) for value in conn.execute(text(
+                "SELECT PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'import_rows' AND PARTITION_NAME IS NOT NULL"
+            )).scalars()
+            if value and value.isdigit()
+        ]
+
+    inspector = inspect(engine)
+    foreign_keys = [
+        (table, fk["name"])
+        for table in ("import_rows", "duplicate_candidates", "import_row_match_keys")
+        for fk in inspector.get_foreign_keys(table)
+        if fk["name"] and (table == "import_rows" or fk["referred_table"] == "import_rows")
+    ]
+    statements = partition_statements(max_import_id, every, bounds or None, foreign_keys)
+    if apply:
+        with engine.begin() as conn:
+            for statement in statements:
+                print(f"▶ {statement}")
+                conn.execute(text(statement))
+    return statements
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from .. import database
+from ..database import get_read_db
+from ..customer_search import customer_index, ensure_index, search_customers
+
+router = APIRouter(tags=["Customers"])
+
+
+@router.get("/search")
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """顧客を氏名・email・電話番号・住所で検索（前方一致・あいまい一致、スコア順）"""
+    # 初回はバックグラウンドでインデックスを作成（作成中は DB の前方一致で返す）
+    ensure_index(database.ReadSessionLocal)
+    return search_customers(db, q, offset=offset, limit=limit)
+
+
+@router.get("/search/stats")
+def search_stats():
+    """検索インデックスの状態"""
+    return {"ready": customer_index.ready, "building": customer_index.building, **customer_index.stats}
@@ -0,0 +1,132 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session
+from .. import models, schemas
+from ..database import get_db, get_read_db, mark_recent_write
+from ..dedupe_sweep import DEDUPE_SHARDS, create_sweep, run_sweep, sweep_in_progress
+
+router = APIRouter(tags=["Dedupe"])
+
+
+def _sweep_response(db: Session, sweep: models.DedupeSweep) -> dict:
+    shards = db.query(models.DedupeSweepShard).filter_by(sweep_id=sweep.id).order_by(
+        models.DedupeSweepShard.shard_no
+    ).all()
+    return {
+        "id": sweep.id,
+        "status": sweep.status.value if sweep.status else None,
+        "total_customers": sweep.total_customers,
+        "scanned_customers": sum(shard.scanned_count or 0 for shard in shards),
+        "pair_count": sweep.pair_count or sum(shard.pair_count or 0 for shard in shards),
+        "cluster_count": sweep.cluster_count,
+        "error_message": sweep.error_message,
+        "created_at": sweep.created_at,
+        "finished_at": sweep.finished_at,
+        "shards": [
+            {
+                "shard_no": shard.shard_no,
+                "status": shard.status.value if shard.status else None,
+                "last_customer_id": shard.last_customer_id,
+                "max_customer_id": shard.max_customer_id,
+                "scanned_count": shard.scanned_count,
+                "pair_count": shard.pair_count,
+                "error_message": shard.error_message,
+            }
+            for shard in shards
+        ],
+    }
+
+
+@router.post("/sweeps", status_code=202)
+def start_sweep(
+    request: schemas.DedupeSweepRequest,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """既存顧客どうしの重複スイープを開始（バックグラウンドでシャードをプロセス並列に処理）"""
+    shards = request.shards or DEDUPE_SHARDS
+    if not 1 <= shards <= 64:
+        raise HTTPException(status_code=400, detail="shards must be between 1 and 64")
+    mark_recent_write(response)
+    sweep = create_sweep(
+        db, shards, request.match_config.model_dump() if request.match_config else None
+    )
+    background_tasks.add_task(run_sweep, sweep.id)
+    return _sweep_response(db, sweep)
+
+
+@router.post("/sweeps/{sweep_id}/resume", status_code=202)
+def resume_sweep(
+    sweep_id: int,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """失敗・中断したスイープを各シャードのチェックポイントから再開"""
+    sweep = db.get(models.DedupeSweep, sweep_id)
+    if not sweep:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    if sweep.status == models.ImportStatus.completed:
+        raise HTTPException(status_code=409, detail="Sweep already completed")
+    if sweep_in_progress(db, sweep_id):
+        # 処理中のシャードを取り直すと同じ範囲を2つのワーカーが処理してしまう
+        raise HTTPException(
+            status_code=409,
+            detail="Sweep is still processing (use `manage dedupe-sweep --resume ID --force` if the worker died)"
+        )
+    mark_recent_write(response)
+    background_tasks.add_task(run_sweep, sweep.id)
+    return _sweep_response(db, sweep)
+
+
+@router.get("/sweeps/{sweep_id}")
+def get_sweep(sweep_id: int, db: Session = Depends(get_read_db)):
+    """スイープの状態（シャードごとの進捗）"""
+    sweep = db.get(models.DedupeSweep, sweep_id)
+    if not sweep:
+        raise HTTPException(status_code=404, detail="Sweep not found")
+    return _sweep_response(db, sweep)
+
+
+@router.get("/sweeps/{sweep_id}/clusters")
+def get_sweep_clusters(
+    sweep_id: int,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_read_db)
+):
+    """重複クラスタ（スコアの高い順）と各クラスタの顧客"""
+    cluster = models.DedupeCluster
+    query = db.query(cluster).filter(cluster.sweep_id == sweep_id)
+    total = query.count()
+    clusters = query.order_by(cluster.max_score.desc(), cluster.id).offset(offset).limit(limit).all()
+
+    members = {}
+    if clusters:
+        for cluster_id, customer in db.query(models.DedupeClusterMember.cluster_id, models.Customer).join(
+            models.Customer, models.Customer.id == models.DedupeClusterMember.customer_id
+        ).filter(
+            models.DedupeClusterMember.cluster_id.in_([c.id for c in clusters])
+        ).order_by(models.DedupeClusterMember.customer_id):
+            members.setdefault(cluster_id, []).append({
+                "id": customer.id,
+                "full_name": customer.full_name,
+                "email": customer.email,
+                "phone": customer.phone,
+                "address": customer.address,
+            })
+
+    return {
+        "total": total,
+        "next_offset": offset + limit if offset + limit < total else None,
+        "clusters": [
+            {
+                "id": c.id,
+                "size": c.size,
+                "max_score": float(c.max_score or 0),
+                "resolution": c.resolution.value if c.resolution else None,
+                "customers": members.get(c.id, []),
+            }
+            for c in clusters
+        ],
+    }
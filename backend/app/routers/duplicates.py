@@ -1,14 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from typing import List
 from .. import crud, schemas, models
-from ..database import get_db
+from ..rematch import rematch_customers
+from ..database import get_db, get_read_db, mark_recent_write
 import json
 
 router = APIRouter(tags=["Duplicates"])
 
 @router.get("/{import_id}", response_model=List[schemas.DuplicateCandidateResponse])
-def get_duplicate_candidates(import_id: int, db: Session = Depends(get_db)):
+def get_duplicate_candidates(import_id: int, db: Session = Depends(get_read_db)):
     """重複候補一覧を取得"""
     candidates = crud.get_duplicate_candidates(db, import_id)
     
@@ -50,9 +51,11 @@ def get_duplicate_candidates(import_id: int, db: Session = Depends(get_db)):
 def resolve_duplicate(
     candidate_id: int,
     request: schemas.CandidateResolveRequest,
+    response: Response,
     db: Session = Depends(get_db)
 ):
     """重複を解決"""
+    mark_recent_write(response)
     candidate = db.query(models.DuplicateCandidate).filter(
         models.DuplicateCandidate.id == candidate_id
     ).first()
@@ -81,8 +84,11 @@ def resolve_duplicate(
         
         # 解決済みにマーク
         crud.resolve_duplicate(db, candidate_id, "merged", existing_customer.id)
-        
-        return {"status": "merged", "customer_id": existing_customer.id}
+
+        # 🆕 更新された顧客とキーが重なる他の未解決の候補を再判定
+        rematch = rematch_customers(db, [existing_customer.id])
+
+        return {"status": "merged", "customer_id": existing_customer.id, "rematched_rows": rematch["rows"]}
     
     elif request.action == "created_new":
         # 新規顧客として作成
@@ -104,8 +110,11 @@ def resolve_duplicate(
         
         # 解決済みにマーク
         crud.resolve_duplicate(db, candidate_id, "created_new", new_customer.id)
-        
-        return {"status": "created_new", "customer_id": new_customer.id}
+
+        # 🆕 新しい顧客を他の未解決の行の候補に加える
+        rematch = rematch_customers(db, [new_customer.id])
+
+        return {"status": "created_new", "customer_id": new_customer.id, "rematched_rows": rematch["rows"]}
     
     elif request.action == "ignored":
         # 無視
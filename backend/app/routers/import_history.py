@@ -1,37 +1,57 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 from typing import List
 from .. import models, schemas
-from ..database import get_db
+from ..database import get_read_db, reads_from_primary
+from ..http_cache import history_cache, make_etag, is_not_modified, cache_headers, not_modified_response
+from ..scheduler import import_scheduler
 
 router = APIRouter(tags=["Import History"])
 
+history_adapter = TypeAdapter(List[schemas.ImportStatusResponse])
+
 @router.get("/", response_model=List[schemas.ImportStatusResponse])
 def get_import_history(
+    request: Request,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """インポート履歴一覧を取得"""
-    imports = db.query(models.Import).order_by(
-        models.Import.created_at.desc()
-    ).offset(skip).limit(limit).all()
-    
-    return [
-        schemas.ImportStatusResponse(
-            id=imp.id,
-            filename=imp.filename,
-            status=imp.status.value,
-            total_rows=imp.total_rows or 0,
-            inserted_count=imp.inserted_count or 0,
-            error_count=imp.error_count or 0,
-            candidate_count=imp.candidate_count or 0,
-            error_message=imp.error_message,
-            created_by=None,
-            resolved_by=None,
-            resolved_at=None,
-            s3_key=imp.s3_key,
-            created_at=imp.created_at
-        )
-        for imp in imports
-    ]
+    """インポート履歴一覧を取得（短時間キャッシュ + ETag）"""
+    # 🆕 ポーリング対策: TTL 内は DB を引かない（書き込み直後のクライアントは除く）
+    cached = None if reads_from_primary(request) else history_cache.get((skip, limit))
+    if cached is None:
+        imports = db.query(models.Import).order_by(
+            models.Import.created_at.desc()
+        ).offset(skip).limit(limit).all()
+
+        body = history_adapter.dump_json([
+            schemas.ImportStatusResponse(
+                id=imp.id,
+                filename=imp.filename,
+                status=imp.status.value,
+                total_rows=imp.total_rows or 0,
+                inserted_count=imp.inserted_count or 0,
+                error_count=imp.error_count or 0,
+                candidate_count=imp.candidate_count or 0,
+                error_message=imp.error_message,
+                created_by=None,
+                resolved_by=None,
+                resolved_at=None,
+                s3_key=imp.s3_key,
+                content_hash=imp.content_hash,
+                replayed_from_id=imp.replayed_from_id,
+                queue_position=import_scheduler.queue_position(imp.id),
+                created_at=imp.created_at
+            )
+            for imp in imports
+        ])
+        cached = (make_etag(body), body)
+        history_cache.set((skip, limit), cached)
+
+    etag, body = cached
+    headers = cache_headers(etag)
+    if is_not_modified(request, etag):
+        return not_modified_response(headers)
+    return Response(content=body, media_type="application/json", headers=headers)
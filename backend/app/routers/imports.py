@@ -1,14 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime  # 🆕 追加
+import os
 from .. import crud, schemas, models
-from ..database import get_db
+from ..database import get_db, get_read_db, mark_recent_write, SessionLocal
 from ..import_engine import normalize_value, validate_value, find_duplicate_candidates
-from ..import_processor import process_import_job
+from ..row_export import EXPORT_FORMATS, export_import_rows as export_rows
+from ..ndjson import NDJSONStreamingResponse, is_ndjson, iter_ndjson, dumps_line
+from ..scheduler import import_scheduler
+from ..matchers import describe_matchers
+from ..http_cache import (
+    TERMINAL_MAX_AGE_SECONDS, make_etag, is_not_modified, cache_headers, not_modified_response
+)
+from ..import_processor import (
+    process_import_job, process_customer_import_job, match_customer_batch, MATCH_CHUNK_SIZE
+)
 
 router = APIRouter()
 
+# /customers/import を同期処理する最大件数（超える場合はジョブとして非同期処理）
+CUSTOMERS_IMPORT_SYNC_LIMIT = int(os.getenv("CUSTOMERS_IMPORT_SYNC_LIMIT", "1000"))
+
+# NDJSON ストリーミング時に1回で処理する行数（小さいほど最初の結果が早く返る）
+NDJSON_BATCH_SIZE = int(os.getenv("NDJSON_BATCH_SIZE", "100"))
+
 
 def empty_to_none(value):
     """空文字列をNoneに変換（UNIQUE制約対策）"""
@@ -19,75 +37,177 @@ def empty_to_none(value):
 # 🔥 Lv3用の新しいエンドポイント
 
 
-@router.post("/customers/import")
-def import_customers(request: dict, db: Session = Depends(get_db)):
-    """顧客データをインポート（Lv3フロントエンド用）"""
-    customers = request.get("customers", [])
+def run_customer_import_job(import_id: int, customers: list):
+    """バックグラウンドタスク用のラッパー（専用セッションで実行）"""
+    db = SessionLocal()
+    try:
+        process_customer_import_job(import_id, customers, db)
+    finally:
+        db.close()
+
+
+async def stream_customer_import(request: Request):
+    """NDJSON の入力を逐次読み込み、NDJSON_BATCH_SIZE 行ごとに処理して結果を1行ずつ返す"""
+    db = SessionLocal()
+    try:
+        batch = []
+        batch_start = 0
+
+        async def flush():
+            try:
+                results = await run_in_threadpool(match_customer_batch, db, batch)
+            except Exception as e:
+                # バッチごとロールバックし、そのバッチの行はエラーとして返して続ける（途中で応答を切らない）
+                print(f"ERROR: NDJSON インポートのバッチ処理エラー (行 {batch_start}〜): {str(e)}")
+                await run_in_threadpool(db.rollback)
+                return [
+                    dumps_line({"rowIndex": batch_start + offset, "error": f"処理エラー: {str(e)[:500]}"})
+                    for offset in range(len(batch))
+                ]
+            return [
+                dumps_line({"rowIndex": batch_start + offset, **result})
+                for offset, result in enumerate(results)
+            ]
+
+        async for row_index, customer_data, error in iter_ndjson(request.stream()):
+            if error or not isinstance(customer_data, dict):
+                # 不正な行はその行だけエラーとして返す
+                if batch:
+                    for line in await flush():
+                        yield line
+                    batch = []
+                yield dumps_line({"rowIndex": row_index, "error": error or "オブジェクトではありません"})
+                batch_start = row_index + 1
+                continue
+
+            if not batch:
+                batch_start = row_index
+            batch.append(customer_data)
+            if len(batch) >= NDJSON_BATCH_SIZE:
+                for line in await flush():
+                    yield line
+                batch = []
+
+        if batch:
+            for line in await flush():
+                yield line
+    finally:
+        db.close()
+
+
+def import_customers_json(
+    payload: dict,
+    background_tasks: BackgroundTasks,
+    db: Session,
+    user_name: str
+):
+    """JSON ボディ {"customers": [...]} のインポート"""
+    customers = payload.get("customers", []) if isinstance(payload, dict) else []
 
     if not customers:
         raise HTTPException(
             status_code=400, detail="No customers data provided")
 
-    # 既存顧客を取得
-    existing_customers = crud.get_all_customers(db)
-    existing_customers_dict = [
-        {
-            "id": c.id,
-            "full_name": c.full_name,
-            "email": c.email,
-            "phone": c.phone,
-            "address_line1": c.address or "",
-            "address_line2": "",
-            "city": c.city,
-            "state": c.state,
-            "zip_code": c.zip_code
-        }
-        for c in existing_customers
-    ]
+    if len(customers) > CUSTOMERS_IMPORT_SYNC_LIMIT:
+        # 🆕 大量データは非同期ジョブで処理
+        db_import = crud.create_import(db, filename="customers-import.json")
+        db_import.total_rows = len(customers)
+        db_import.created_by = user_name
+        db.commit()
 
+        background_tasks.add_task(run_customer_import_job, db_import.id, customers)
+
+        return JSONResponse(status_code=202, content={
+            "status": "accepted",
+            "job_id": db_import.id,
+            "total_rows": len(customers)
+        })
+
+    # 同期処理（チャンクごとに候補検索・コミット）
     results = []
+    for start in range(0, len(customers), MATCH_CHUNK_SIZE):
+        results.extend(match_customer_batch(db, customers[start:start + MATCH_CHUNK_SIZE]))
+
+    return {
+        "status": "success",
+        "candidates": results
+    }
+
+
+@router.post("/customers/import")
+async def import_customers(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    user_name: str = Header(None, alias="X-User-Name")
+):
+    """
+    顧客データをインポート（Lv3フロントエンド用）
+    - application/json: {"customers": [...]}。CUSTOMERS_IMPORT_SYNC_LIMIT 件を超える場合はジョブとして受け付け job_id を返す（202）
+    - application/x-ndjson: 1行1顧客。行を逐次読み込み、1行1結果の NDJSON をストリーミングで返す
+    """
+    if is_ndjson(request.headers.get("content-type")):
+        return NDJSONStreamingResponse(stream_customer_import(request))
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+
+    return await run_in_threadpool(import_customers_json, payload, background_tasks, db, user_name)
+
+
+@router.get("/customers/import/jobs/{job_id}")
+def get_customer_import_job(
+    job_id: int,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """非同期インポートジョブの進捗と結果（row_index順にページング、処理済みの分から取得可能）"""
+    db_import = crud.get_import(db, job_id)
+    if not db_import:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    rows = crud.get_import_rows_page(db, job_id, offset, limit)
+    candidates_by_row = {}
+    for candidate in crud.get_candidates_by_row_ids(db, [row.id for row in rows]):
+        candidates_by_row.setdefault(candidate.import_row_id, []).append(candidate)
 
-    for idx, customer_data in enumerate(customers):
-        # 重複候補検出
-        candidates = find_duplicate_candidates(
-            customer_data, existing_customers_dict)
+    processed_rows = (db_import.inserted_count or 0) + (db_import.error_count or 0) + (db_import.candidate_count or 0)
+    next_offset = offset + len(rows)
 
-        if candidates:
-            # 候補あり
-            results.append({
-                "normalized": customer_data,
+    return {
+        "job_id": db_import.id,
+        "status": db_import.status.value,
+        "total_rows": db_import.total_rows or 0,
+        "processed_rows": processed_rows,
+        "error_message": db_import.error_message,
+        "offset": offset,
+        "next_offset": next_offset if next_offset < (db_import.total_rows or 0) else None,
+        "candidates": [
+            {
+                "rowIndex": row.row_index,
+                "normalized": row.normalized_data,
+                **({"error": "; ".join(row.validation_errors or [])} if row.status == models.RowStatus.error else {}),
                 "candidates": [
                     {
-                        "candidateIndex": candidate["customer_id"],
-                        "score": candidate["similarity_score"],
-                        "reason": candidate["match_reason"]
+                        "candidateIndex": candidate.existing_customer_id,
+                        "score": float(candidate.similarity_score),
+                        "reason": candidate.match_reason
                     }
-                    for candidate in candidates
+                    for candidate in candidates_by_row.get(row.id, [])
                 ]
-            })
-        else:
-            # 新規作成（空文字列をNoneに変換）
-            customer_create = {
-                "full_name": customer_data.get("full_name"),
-                "email": empty_to_none(customer_data.get("email")),
-                "phone": empty_to_none(customer_data.get("phone")),
-                "address": customer_data.get("address_line1")
             }
-            crud.create_customer(db, **customer_create)
-            results.append({
-                "normalized": customer_data,
-                "candidates": []
-            })
-
-    return {
-        "status": "success",
-        "candidates": results
+            for row in rows
+        ]
     }
 
 
 @router.post("/customers/resolve/{row_index}")
-def resolve_customer(row_index: int, request: dict, db: Session = Depends(get_db)):
+def resolve_customer(row_index: int, request: dict, response: Response, db: Session = Depends(get_db)):
     """候補解決（Lv3フロントエンド用）"""
+    mark_recent_write(response)
     action = request.get("action")
     customer_data = request.get("customer_data")
 
@@ -210,13 +330,63 @@ def run_import(
 
 
 @router.get("/imports/{import_id}", response_model=schemas.ImportStatusResponse)
-def get_import_status(import_id: int, db: Session = Depends(get_db)):
-    """インポートステータスを取得"""
+def get_import_status(
+    import_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db)
+):
+    """インポートステータスを取得（ETag / Last-Modified で 304 を返す）"""
     db_import = crud.get_import(db, import_id)
     if not db_import:
         raise HTTPException(status_code=404, detail="Import not found")
 
-    return db_import
+    queue_position = import_scheduler.queue_position(import_id)
+    last_modified = db_import.updated_at or db_import.created_at
+    etag = make_etag(
+        db_import.id, db_import.status.value, db_import.total_rows, db_import.inserted_count,
+        db_import.error_count, db_import.candidate_count, db_import.resolved_at, last_modified, queue_position
+    )
+    # 完了・失敗したインポートは変化しないのでキャッシュさせる
+    terminal = db_import.status in (models.ImportStatus.completed, models.ImportStatus.failed)
+    headers = cache_headers(etag, last_modified, TERMINAL_MAX_AGE_SECONDS if terminal else None)
+    if is_not_modified(request, etag, last_modified if terminal else None):
+        return not_modified_response(headers)
+    response.headers.update(headers)
+
+    status_response = schemas.ImportStatusResponse.model_validate(db_import, from_attributes=True)
+    status_response.queue_position = queue_position
+    return status_response
+
+
+@router.get("/imports/{import_id}/rows/export")
+def export_import_rows(
+    import_id: int,
+    status: Optional[str] = None,
+    format: str = "csv",
+    db: Session = Depends(get_db)
+):
+    """インポート行（生データ + バリデーションエラー）をストリーミングでエクスポート"""
+    db_import = crud.get_import(db, import_id)
+    if not db_import:
+        raise HTTPException(status_code=404, detail="Import not found")
+    if db_import.archived_at:
+        # 保持期間を過ぎて行を削除済み（退避していれば S3 の場所を返す）
+        raise HTTPException(status_code=410, detail={
+            "message": "Import rows have been archived",
+            "archive_s3_key": db_import.archive_s3_key
+        })
+    if status and status not in {s.value for s in models.RowStatus}:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+
+    filename = f"import_{import_id}_{status or 'all'}.{format}"
+    return StreamingResponse(
+        export_rows(SessionLocal, import_id, status, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @router.post("/imports/{import_id}/candidates/{candidate_id}/resolve")
@@ -224,10 +394,12 @@ def resolve_candidate(
     import_id: int,
     candidate_id: int,
     request: schemas.CandidateResolveRequest,
+    response: Response,
     db: Session = Depends(get_db),
     user_name: str = Header(None, alias="X-User-Name")  # 🆕 追加
 ):
     """重複候補を解決"""
+    mark_recent_write(response)
     # 候補を取得
     candidate = db.query(models.DuplicateCandidate).filter(
         models.DuplicateCandidate.id == candidate_id
@@ -259,8 +431,27 @@ def resolve_candidate(
     return {"status": "resolved", "action": request.action}
 
 
+@router.get("/matchers")
+def get_matchers():
+    """重複検知ルールの一覧（実行順）とプロセス全体の集計"""
+    return {"matchers": describe_matchers()}
+
+
+@router.get("/imports/{import_id}/metrics")
+def get_import_metrics(import_id: int, db: Session = Depends(get_read_db)):
+    """インポートのマッチング設定とルール別の集計"""
+    db_import = crud.get_import(db, import_id)
+    if not db_import:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return {
+        "import_id": db_import.id,
+        "match_config": db_import.match_config,
+        "metrics": db_import.metrics or {}
+    }
+
+
 @router.get("/imports/{import_id}/candidates")
-def get_import_candidates(import_id: int, db: Session = Depends(get_db)):
+def get_import_candidates(import_id: int, db: Session = Depends(get_read_db)):
     """インポートの重複候補を取得"""
     candidates = crud.get_duplicate_candidates(db, import_id)
 
@@ -1,31 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from pydantic import BaseModel
-import boto3
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from typing import Dict, Optional
+from pydantic import BaseModel, Field
 from botocore.exceptions import ClientError
 import os
 from datetime import datetime
 import uuid
 from sqlalchemy.orm import Session
 from .. import crud, models
-from ..database import get_db, SessionLocal
-from ..import_processor import process_import_job
+from ..schemas import MatchConfigRequest
+from ..database import get_db, mark_recent_write, SessionLocal
+from ..import_processor import prepare_row, process_import_job, read_upload_preview
+from ..sharded_import import run_sharded_import
+from ..s3_service import s3_service
+from ..scheduler import import_scheduler
+from ..matchers import MatchConfig
 
 router = APIRouter(tags=["S3 Upload"])
 
-# S3クライアント初期化
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION', 'ap-northeast-1')
-)
-
 BUCKET_NAME = os.getenv('AWS_S3_BUCKET', 'customer-import-bucket')
 
 class PresignedUrlRequest(BaseModel):
     filename: str
     content_type: str = "text/csv"
 
+class UploadPreviewRequest(BaseModel):
+    s3_key: str
+    mapping: Optional[Dict[str, str]] = None  # DB項目 → 列名（指定するとその列だけ読む）
+    limit: int = Field(20, ge=1, le=200)
+
 class PresignedUrlResponse(BaseModel):
     upload_url: str
     s3_key: str
@@ -40,7 +42,7 @@ async def get_presigned_url(request: PresignedUrlRequest):
         
         expires_in = 900
         
-        upload_url = s3_client.generate_presigned_url(
+        upload_url = s3_service.s3_client.generate_presigned_url(
             'put_object',
             Params={
                 'Bucket': BUCKET_NAME,
@@ -68,11 +70,16 @@ class ImportFromS3Request(BaseModel):
         "email": "Mail",
         "phone": "TEL"
     }
+    # 🆕 2以上でシャード並列処理（email/電話番号のハッシュで分割）
+    shards: int = Field(default=1, ge=1, le=64)
+    # 🆕 マッチング設定（例: {"threshold": 0.9, "address_penalty": 0.7, "top_k": 3}）
+    match_config: Optional[MatchConfigRequest] = None
 
 class ImportFromS3Response(BaseModel):
     import_id: int
     status: str
     message: str
+    queue_position: Optional[int] = None
 
 def run_import_job(import_id: int, mapping: dict):
     """バックグラウンドタスク用のラッパー"""
@@ -87,11 +94,18 @@ def run_import_job(import_id: int, mapping: dict):
         db.close()
 
 @router.post("/import-from-s3", response_model=ImportFromS3Response)
-async def import_from_s3(
+def import_from_s3(
     request: ImportFromS3Request,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    response: Response,
+    db: Session = Depends(get_db),
+    user_name: str = Header(None, alias="X-User-Name")
 ):
+    """
+    S3 のファイルのインポートを受け付ける
+    S3 の head_object（サイズ取得）と DB は同期 I/O なので async にしない（スレッドプールで実行され、イベントループを止めない）
+    """
+    # 直後のステータス確認がレプリカ遅延で 404 にならないように
+    mark_recent_write(response)
     try:
         filename = request.s3_key.split('/')[-1]
         
@@ -100,9 +114,33 @@ async def import_from_s3(
             filename=filename,
             s3_key=request.s3_key
         )
-        
-        background_tasks.add_task(run_import_job, db_import.id, request.mapping)
-        
+        # 🆕 スケジューラの待ち行列に入れる（開始時に processing になる）
+        db_import.status = models.ImportStatus.queued
+        db_import.created_by = user_name
+        if request.match_config:
+            db_import.match_config = MatchConfig.from_dict(request.match_config.model_dump()).to_dict()
+        db.commit()
+
+        size_bytes = s3_service.get_object_size(request.s3_key) or 0
+        if request.shards > 1:
+            import_scheduler.submit(
+                db_import.id, run_sharded_import, db_import.id, request.mapping, request.shards,
+                user=user_name, size_bytes=size_bytes
+            )
+        else:
+            import_scheduler.submit(
+                db_import.id, run_import_job, db_import.id, request.mapping,
+                user=user_name, size_bytes=size_bytes
+            )
+
+        queue_position = import_scheduler.queue_position(db_import.id)
+        if queue_position:
+            return ImportFromS3Response(
+                import_id=db_import.id,
+                status="queued",
+                message=f"インポートを受け付けました (ID: {db_import.id}, 待ち順: {queue_position})",
+                queue_position=queue_position
+            )
         return ImportFromS3Response(
             import_id=db_import.id,
             status="processing",
@@ -110,4 +148,39 @@ async def import_from_s3(
         )
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"インポートエラー: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"インポートエラー: {str(e)}")
+
+
+@router.post("/preview")
+def preview_upload(request: UploadPreviewRequest):
+    """
+    🆕 アップロード済みファイルの先頭行のプレビュー
+    解析済みキャッシュから mapping の列だけを読む（初回はダウンロード・解析してキャッシュに保存）。
+    mapping を指定すると各行の正規化・バリデーション結果も返す（取り込み前の確認用）
+    """
+    filename = request.s3_key.split('/')[-1]
+    columns = [column for column in request.mapping.values() if column] if request.mapping else None
+    try:
+        rows, total_rows, cached = read_upload_preview(request.s3_key, filename, columns, request.limit)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"プレビューエラー: {str(e)}")
+    if rows is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    previews = []
+    for idx, row in enumerate(rows):
+        preview = {"row_index": idx, "data": dict(row)}
+        if request.mapping:
+            _, mapped_data, normalized_data, validation_errors = prepare_row(row, request.mapping)
+            preview.update(
+                mapped_data=mapped_data, normalized_data=normalized_data, validation_errors=validation_errors
+            )
+        previews.append(preview)
+
+    return {
+        "s3_key": request.s3_key,
+        "total_rows": total_rows,
+        "cached": cached,
+        "columns": list(rows[0].layout.columns) if rows else [],
+        "rows": previews,
+    }
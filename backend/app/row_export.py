@@ -0,0 +1,124 @@
+"""
+インポート行のエクスポート（CSV / XLSX / NDJSON）
+
+サーバーサイドカーソル（yield_per）で行を読み、生データとバリデーションエラーを並べて逐次出力する。
+大量行でもメモリに全件を載せない。
+"""
+from typing import Iterator, List, Optional
+from tempfile import SpooledTemporaryFile
+import csv
+import io
+import json
+from . import crud, models
+from .ndjson import dumps_line, NDJSON_MEDIA_TYPE
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "ndjson": NDJSON_MEDIA_TYPE,
+}
+
+# CSV を何行ごとに送出するか
+CSV_FLUSH_ROWS = 500
+# XLSX の一時ファイルをメモリに置く上限（超えるとディスクへ）
+XLSX_SPOOL_BYTES = 16 * 1024 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+
+BASE_COLUMNS = ["row_index", "status", "validation_errors"]
+
+
+def _load_json(value):
+    """JSON列の値（文字列で保存されている場合もある）をdictに変換"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return {"raw": value}
+    return value or {}
+
+
+def _errors_text(errors) -> str:
+    errors = _load_json(errors) if isinstance(errors, str) else (errors or [])
+    return "; ".join(str(e) for e in errors)
+
+
+def _iter_rows(session_factory, import_id: int, status: Optional[str]):
+    """専用セッションでサーバーサイドカーソルを開き、行を逐次返す"""
+    db = session_factory()
+    try:
+        for row in crud.iter_import_rows(db, import_id, status):
+            yield row
+    finally:
+        db.close()
+
+
+def _table_rows(rows) -> Iterator[List]:
+    """ヘッダー（先頭行の生データ列）→ 各行 の順に、表形式の行を返す"""
+    raw_columns = None
+    for row in rows:
+        raw_data = _load_json(row.raw_data)
+        if raw_columns is None:
+            raw_columns = list(raw_data.keys())
+            yield BASE_COLUMNS + raw_columns
+        status = row.status.value if isinstance(row.status, models.RowStatus) else row.status
+        yield [row.row_index, status, _errors_text(row.validation_errors)] + [
+            "" if raw_data.get(column) is None else raw_data.get(column)
+            for column in raw_columns
+        ]
+    if raw_columns is None:
+        yield BASE_COLUMNS
+
+
+def export_csv(rows) -> Iterator[bytes]:
+    """CSV（Excelで開けるよう BOM 付き UTF-8）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    yield "﻿".encode("utf-8")
+    for count, values in enumerate(_table_rows(rows), start=1):
+        writer.writerow(values)
+        if count % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def export_xlsx(rows) -> Iterator[bytes]:
+    """XLSX（write_only モードで一時ファイルに書き出してから送出）"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("rows")
+    for values in _table_rows(rows):
+        sheet.append(values)
+
+    with SpooledTemporaryFile(max_size=XLSX_SPOOL_BYTES) as tmp:
+        workbook.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_ndjson(rows) -> Iterator[bytes]:
+    """NDJSON（1行1インポート行）"""
+    for row in rows:
+        yield dumps_line({
+            "row_index": row.row_index,
+            "status": row.status.value if isinstance(row.status, models.RowStatus) else row.status,
+            "validation_errors": _load_json(row.validation_errors) or [],
+            "raw_data": _load_json(row.raw_data),
+            "normalized_data": _load_json(row.normalized_data),
+        })
+
+
+def export_import_rows(session_factory, import_id: int, status: Optional[str], fmt: str) -> Iterator[bytes]:
+    """指定フォーマットでインポート行をエクスポート"""
+    rows = _iter_rows(session_factory, import_id, status)
+    if fmt == "csv":
+        return export_csv(rows)
+    if fmt == "xlsx":
+        return export_xlsx(rows)
+    return export_ndjson(rows)
@@ -1,18 +1,49 @@
-import boto3
+import hashlib
 import os
+import threading
 from botocore.exceptions import ClientError
-from typing import Optional
+from typing import Optional, Tuple
+
+# 共有クライアントの接続プール（バックグラウンドのインポートと API で共用）
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '20'))
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '5'))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    プロセスで共有する S3 クライアント
+    boto3 の import とクライアント作成は重いので初回利用時に行う（起動時間短縮）
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+
+                _client = boto3.client(
+                    's3',
+                    region_name=os.getenv('AWS_REGION', 'ap-northeast-1'),
+                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': 'standard'}
+                    )
+                )
+    return _client
 
 
 class S3Service:
     def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            region_name=os.getenv('AWS_REGION', 'ap-northeast-1'),
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
-        )
         self.bucket_name = os.getenv('AWS_S3_BUCKET')
+
+    @property
+    def s3_client(self):
+        return get_s3_client()
     
     def generate_presigned_url(self, file_name: str, expiration: int = 3600) -> Optional[dict]:
         """
@@ -50,6 +81,97 @@ class S3Service:
             print(f"Error downloading file from S3: {e}")
             return None
     
+    def download_file_with_hash(self, s3_key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        S3からファイルをダウンロードし、読みながら SHA-256 を計算する
+        """
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=s3_key
+            )
+            digest = hashlib.sha256()
+            chunks = []
+            for chunk in response['Body'].iter_chunks(chunk_size=1024 * 1024):
+                digest.update(chunk)
+                chunks.append(chunk)
+            return b"".join(chunks), digest.hexdigest()
+        except ClientError as e:
+            print(f"Error downloading file from S3: {e}")
+            return None, None
+
+    def open_object(self, s3_key: str):
+        """
+        S3のオブジェクトを読むためのストリーム（read(n) で少しずつ読む。読み終えたら close する）
+        """
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=s3_key
+            )
+            return response['Body']
+        except ClientError as e:
+            print(f"Error downloading file from S3: {e}")
+            return None
+
+    def get_trusted_etag(self, s3_key: str) -> Optional[str]:
+        """
+        内容のMD5として信頼できる ETag を返す
+        マルチパートアップロード（"-" を含む）や SSE-KMS の場合は MD5 ではないので None
+        """
+        try:
+            response = self.s3_client.head_object(
+                Bucket=self.bucket_name,
+                Key=s3_key
+            )
+        except ClientError as e:
+            print(f"Error reading S3 object metadata: {e}")
+            return None
+
+        etag = response.get('ETag', '').strip('"')
+        if not etag or '-' in etag or response.get('ServerSideEncryption') == 'aws:kms':
+            return None
+        return etag
+
+    def get_object_etag(self, s3_key: str) -> Optional[str]:
+        """
+        オブジェクトの ETag（MD5 とは限らないが、内容が変われば変わる。解析済みキャッシュの識別用）
+        """
+        try:
+            response = self.s3_client.head_object(
+                Bucket=self.bucket_name,
+                Key=s3_key
+            )
+        except ClientError as e:
+            print(f"Error reading S3 object metadata: {e}")
+            return None
+        return response.get('ETag', '').strip('"') or None
+
+    def get_object_size(self, s3_key: str) -> Optional[int]:
+        """オブジェクトのサイズ（バイト）"""
+        try:
+            response = self.s3_client.head_object(
+                Bucket=self.bucket_name,
+                Key=s3_key
+            )
+        except ClientError as e:
+            print(f"Error reading S3 object metadata: {e}")
+            return None
+        return response.get('ContentLength')
+
+    def upload_fileobj(self, fileobj, s3_key: str, content_type: str = 'application/octet-stream') -> bool:
+        """
+        ファイルオブジェクトをS3にアップロード（大きいファイルはマルチパート）
+        """
+        try:
+            self.s3_client.upload_fileobj(
+                fileobj, self.bucket_name, s3_key, ExtraArgs={'ContentType': content_type}
+            )
+            return True
+        except ClientError as e:
+            print(f"Error uploading file to S3: {e}")
+            return False
+
     def delete_file(self, s3_key: str) -> bool:
         """
         S3からファイルを削除
@@ -0,0 +1,134 @@
+"""
+インポートジョブのスケジューラ（プロセス内）
+
+import_from_s3 のジョブはここに投入され、次の条件を満たすものから順に実行される。
+- 同時実行数: 全体 IMPORT_MAX_CONCURRENCY、ユーザー（X-User-Name）ごと IMPORT_MAX_PER_USER
+- 優先度: ファイルサイズの小さい順（IMPORT_MAX_WAIT_SECONDS 以上待ったジョブは最優先）
+- メモリ予算: 推定使用量（ファイルサイズ × IMPORT_MEMORY_FACTOR）の合計が IMPORT_MEMORY_BUDGET_MB 以内
+  （何も実行していなければ予算を超えるジョブでも1件は実行する）
+
+待ち行列はプロセス内にしか無いので、再起動すると queued のジョブは失われる。
+"""
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+import itertools
+import os
+import threading
+import time
+
+MAX_CONCURRENCY = int(os.getenv("IMPORT_MAX_CONCURRENCY", "2"))
+MAX_PER_USER = int(os.getenv("IMPORT_MAX_PER_USER", "1"))
+MEMORY_BUDGET_BYTES = int(os.getenv("IMPORT_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024
+# pandas で読み込んだときのファイルサイズに対するメモリ倍率（概算）
+MEMORY_FACTOR = float(os.getenv("IMPORT_MEMORY_FACTOR", "10"))
+MAX_WAIT_SECONDS = float(os.getenv("IMPORT_MAX_WAIT_SECONDS", "300"))
+
+
+@dataclass
+class ScheduledJob:
+    import_id: int
+    func: Callable
+    args: tuple
+    user: str
+    size_bytes: int
+    submitted_at: float = field(default_factory=time.monotonic)
+    seq: int = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return int(self.size_bytes * MEMORY_FACTOR)
+
+    def priority(self, now: float) -> tuple:
+        """小さいファイル優先。待ちすぎたジョブは投入順で最優先"""
+        starved = now - self.submitted_at >= MAX_WAIT_SECONDS
+        return (0 if starved else 1, self.seq if starved else self.size_bytes, self.seq)
+
+
+class ImportScheduler:
+    """インポートジョブの公平スケジューラ"""
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_per_user: int = MAX_PER_USER,
+        memory_budget_bytes: int = MEMORY_BUDGET_BYTES
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.memory_budget_bytes = memory_budget_bytes
+        self._lock = threading.Lock()
+        self._queue: List[ScheduledJob] = []
+        self._running: Dict[int, ScheduledJob] = {}
+        self._seq = itertools.count()
+
+    def submit(self, import_id: int, func: Callable, *args, user: Optional[str] = None, size_bytes: int = 0):
+        """ジョブを投入（条件を満たせばすぐに開始する）"""
+        job = ScheduledJob(import_id, func, args, user or "anonymous", size_bytes or 0)
+        with self._lock:
+            job.seq = next(self._seq)
+            self._queue.append(job)
+        self._dispatch()
+
+    def queue_position(self, import_id: int) -> Optional[int]:
+        """待ち行列での順番（1始まり。待っていなければ None）"""
+        with self._lock:
+            ordered = self._ordered(time.monotonic())
+        for position, job in enumerate(ordered, start=1):
+            if job.import_id == import_id:
+                return position
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "running": len(self._running),
+                "memory_bytes": sum(job.memory_bytes for job in self._running.values()),
+            }
+
+    def _ordered(self, now: float) -> List[ScheduledJob]:
+        return sorted(self._queue, key=lambda job: job.priority(now))
+
+    def _user_limited(self, job: ScheduledJob) -> bool:
+        user_running = sum(1 for running in self._running.values() if running.user == job.user)
+        return user_running >= self.max_per_user
+
+    def _admissible(self, job: ScheduledJob) -> bool:
+        if len(self._running) >= self.max_concurrency or self._user_limited(job):
+            return False
+        if not self._running:
+            return True
+        used = sum(running.memory_bytes for running in self._running.values())
+        return used + job.memory_bytes <= self.memory_budget_bytes
+
+    def _dispatch(self):
+        """実行できるジョブを優先度順に開始"""
+        started = []
+        with self._lock:
+            now = time.monotonic()
+            for job in self._ordered(now):
+                if len(self._running) >= self.max_concurrency:
+                    break
+                if self._admissible(job):
+                    self._queue.remove(job)
+                    self._running[job.import_id] = job
+                    started.append(job)
+                elif job.priority(now)[0] == 0 and not self._user_limited(job):
+                    # 待ちすぎたジョブが入れるまで後続を止める（大きいファイルが飢えないように）
+                    break
+
+        for job in started:
+            threading.Thread(target=self._run, args=(job,), daemon=True, name=f"import-{job.import_id}").start()
+
+    def _run(self, job: ScheduledJob):
+        try:
+            job.func(*job.args)
+        except Exception as e:
+            print(f"ERROR in scheduled import {job.import_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._running.pop(job.import_id, None)
+            self._dispatch()
+
+
+import_scheduler = ImportScheduler()
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from .matchers import registered_matchers
 
 # リクエストスキーマ
 
@@ -17,6 +18,28 @@ class ImportRunRequest(BaseModel):
 class CandidateResolveRequest(BaseModel):
     action: str  # "merged" | "created_new" | "ignored"
 
+
+class MatchConfigRequest(BaseModel):
+    """マッチング設定（範囲外の値・未登録のルール名は 422）"""
+    threshold: float = Field(0.85, ge=0, le=1)
+    address_penalty: float = Field(0.7, ge=0, le=1)
+    top_k: int = Field(5, ge=1)
+    disabled: List[str] = []
+
+    @field_validator("disabled")
+    @classmethod
+    def check_disabled(cls, names: List[str]) -> List[str]:
+        known = {matcher.name for matcher in registered_matchers()}
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f"unknown matcher: {', '.join(unknown)}")
+        return names
+
+
+class DedupeSweepRequest(BaseModel):
+    shards: Optional[int] = None
+    match_config: Optional[MatchConfigRequest] = None
+
 # レスポンススキーマ
 
 
@@ -43,6 +66,9 @@ class ImportStatusResponse(BaseModel):
     resolved_by: Optional[str] = None  # 🆕 追加
     resolved_at: Optional[datetime] = None  # 🆕 追加
     s3_key: Optional[str] = None
+    content_hash: Optional[str] = None
+    replayed_from_id: Optional[int] = None
+    queue_position: Optional[int] = None  # 🆕 queued のときの待ち順
     created_at: datetime
 
 
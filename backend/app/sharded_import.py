@@ -0,0 +1,256 @@
+"""
+大きなファイルのシャード並列インポート
+
+行を正規化した email（なければ電話番号 E.164）のハッシュでシャードに振り分ける（キー範囲分割）。
+同じ email / 電話番号の行は必ず同じシャードで処理されるため、複数シャードが同じ顧客を作成することはない。
+念のため email の UNIQUE 制約違反は既存顧客の更新として扱う（_process_row_isolated 参照）。
+
+ファイルのダウンロード・解析と振り分けは partition_import で1回だけ行い（解析済みキャッシュがあればそこから読む）、シャードごとの入力
+（gzip の「行番号<TAB>全列の JSON」）を S3 の IMPORT_SHARD_PREFIX/{import_id}/{shard_no}.tsv.gz に置く。
+各シャードは import_id / shard_no だけで自分の入力（全体の 1/N）を読むので、同一ホストのプロセスプールでも、
+複数ノードでの `python -m app.manage run-shard` でも動く。
+最後に完了したシャードが件数を親 Import に集計し、入力を削除する。
+
+制限: 各シャードは DB の既存顧客とだけ照合する。email・電話番号が違う同一人物（氏名・住所の表記ゆれ）の行が
+別のシャードに入ると、候補にならずに2件とも新規顧客になる。シャード並列で取り込んだ後は
+`python -m app.manage dedupe-sweep` で既存顧客どうしの重複を洗い出す。
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+from . import crud, models, upload_cache
+from .canonicalize import canonical_email, canonical_phone
+from .database import SessionLocal
+from .import_processor import read_dataframe, process_rows, row_raw_data
+from .matchers import MatchConfig
+from .records import SourceRows
+from .s3_service import s3_service
+
+SHARD_WORKERS = int(os.getenv("IMPORT_SHARD_WORKERS", str(os.cpu_count() or 2)))
+# シャードごとの入力を置く S3 のプレフィックス
+IMPORT_SHARD_PREFIX = os.getenv("IMPORT_SHARD_PREFIX", "import-shards")
+
+
+def _cell(value) -> str:
+    """セルの値を文字列に（None / NaN は空文字）"""
+    if value is None or value != value:
+        return ""
+    return str(value).strip()
+
+
+def shard_for_row(row: dict, mapping: dict, shard_count: int, row_index: int) -> int:
+    """行のシャード番号（email → 電話番号 の順でキーを決め、どちらもなければ行番号で分散）"""
+    email = _cell(row.get(mapping.get("email"))) if mapping.get("email") else ""
+    phone = _cell(row.get(mapping.get("phone"))) if mapping.get("phone") else ""
+
+    if email:
+        key = "email:" + canonical_email(email)
+    elif phone:
+        key = "phone:" + canonical_phone(phone)
+    else:
+        return row_index % shard_count
+
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) % shard_count
+
+
+def shard_input_key(import_id: int, shard_no: int) -> str:
+    return f"{IMPORT_SHARD_PREFIX.rstrip('/')}/{import_id}/{shard_no}.tsv.gz"
+
+
+def partition_import(db, import_id: int, shard_count: int, mapping: dict = None) -> List[int]:
+    """
+    ファイルを1回だけダウンロード・解析し、行をシャードごとの入力に分けて S3 に置く（シャードごとの行数を返す）
+    解析済みキャッシュ（upload_cache）があればダウンロード・解析せず、マッピングの列と raw_data だけを読む。
+    1行目は列名の JSON、以降は「行番号<TAB>全列の JSON」（JSON の文字列はタブ・改行をエスケープ済み）
+    """
+    db_import = crud.get_import(db, import_id)
+    mapping = mapping or db_import.mapping or {}
+    if not db_import.s3_key:
+        raise Exception("シャード処理には S3 上のファイルが必要です")
+
+    rows, columns = _read_upload(db_import.s3_key, db_import.filename, mapping)
+    header = (json.dumps({"columns": columns}, ensure_ascii=False) + "\n").encode("utf-8")
+    files = [tempfile.TemporaryFile() for _ in range(shard_count)]
+    try:
+        # 取り込み後に消す一時的な入力なので圧縮は速さ優先
+        writers = [gzip.GzipFile(fileobj=tmp, mode="wb", compresslevel=1) for tmp in files]
+        for writer in writers:
+            writer.write(header)
+        counts = [0] * shard_count
+        for idx, row in enumerate(rows):
+            shard_no = shard_for_row(row, mapping, shard_count, idx)
+            writers[shard_no].write(f"{idx}\t{row_raw_data(row)}\n".encode("utf-8"))
+            counts[shard_no] += 1
+        for shard_no, (writer, tmp) in enumerate(zip(writers, files)):
+            writer.close()
+            tmp.seek(0)
+            s3_key = shard_input_key(import_id, shard_no)
+            if not s3_service.upload_fileobj(tmp, s3_key, "application/gzip"):
+                raise Exception(f"シャードの入力をアップロードできません: {s3_key}")
+    finally:
+        for tmp in files:
+            tmp.close()
+    return counts
+
+
+def _read_upload(s3_key: str, filename: str, mapping: dict) -> tuple:
+    """アップロードの行（raw_data 付き）とファイルの全列名。キャッシュがなければ解析してキャッシュに保存する"""
+    object_etag = s3_service.get_object_etag(s3_key)
+    cached = upload_cache.lookup(s3_key, object_etag)
+    if cached:
+        try:
+            rows = upload_cache.read_rows(
+                cached, columns=[column for column in mapping.values() if column], raw_data=True
+            )
+            return rows, cached.columns
+        except Exception as e:
+            print(f"WARN: アップロードキャッシュを読めないため S3 から読み込み: {e}")
+
+    file_bytes, sha256 = s3_service.download_file_with_hash(s3_key)
+    if not file_bytes:
+        raise Exception(f"Failed to download file from S3: {s3_key}")
+    df = read_dataframe(filename, file_bytes)
+    del file_bytes
+    rows = SourceRows.from_dataframe(df)
+    upload_cache.store(s3_key, object_etag, sha256, df, rows)
+    return rows, list(rows.layout.columns)
+
+
+def read_shard_input(import_id: int, shard_no: int) -> list:
+    """シャードの入力を (行番号, 行) のリストで読む（raw_data は振り分け前と同じ JSON）"""
+    s3_key = shard_input_key(import_id, shard_no)
+    data = s3_service.download_file(s3_key)
+    if data is None:
+        raise Exception(f"シャードの入力がありません（partition_import が未実行）: {s3_key}")
+
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    del data
+    columns = json.loads(lines[0])["columns"]
+    indexes, values, raw_data = [], [], []
+    for line in lines[1:]:
+        idx, raw = line.split("\t", 1)
+        row = json.loads(raw)
+        indexes.append(int(idx))
+        values.append(tuple(row.get(column) for column in columns))
+        raw_data.append(raw)
+    return list(zip(indexes, SourceRows(columns, values, raw_data)))
+
+
+def delete_shard_inputs(import_id: int, shard_count: int):
+    for shard_no in range(shard_count):
+        s3_service.delete_file(shard_input_key(import_id, shard_no))
+
+
+def finalize_sharded_import(db, import_id: int):
+    """全シャードが終わっていれば件数を親 Import に集計する（どのシャードから呼んでもよい）"""
+    shards = crud.get_import_shards(db, import_id)
+    if not shards or len(shards) < shards[0].shard_count:
+        return
+    if any(shard.status == models.ImportStatus.processing for shard in shards):
+        return
+
+    db_import = crud.get_import(db, import_id)
+    db_import.total_rows = sum(shard.total_rows or 0 for shard in shards)
+    db_import.inserted_count = sum(shard.inserted_count or 0 for shard in shards)
+    db_import.error_count = sum(shard.error_count or 0 for shard in shards)
+    db_import.candidate_count = sum(shard.candidate_count or 0 for shard in shards)
+
+    failed = [shard for shard in shards if shard.status == models.ImportStatus.failed]
+    if failed:
+        db_import.status = models.ImportStatus.failed
+        db_import.error_message = "; ".join(
+            f"shard {shard.shard_no}: {shard.error_message}" for shard in failed
+        )
+    else:
+        db_import.status = models.ImportStatus.completed
+        db_import.customers_fingerprint = crud.get_customers_fingerprint(db)
+    db.commit()
+
+    if not failed:
+        # 失敗したときはシャードをやり直せるよう入力を残す
+        delete_shard_inputs(import_id, shards[0].shard_count)
+        from .rematch import rematch_after_import
+        rematch_after_import(db, db_import)
+
+
+def process_import_shard(import_id: int, shard_no: int, shard_count: int, mapping: dict = None):
+    """1シャード分の行を処理する"""
+    db = SessionLocal()
+    try:
+        shard = crud.get_or_create_import_shard(db, import_id, shard_no, shard_count)
+        try:
+            db_import = crud.get_import(db, import_id)
+            mapping = mapping or db_import.mapping or {}
+            # ファイル全体ではなく、振り分け済みの自分の行だけを読む
+            rows = read_shard_input(import_id, shard_no)
+
+            inserted, errors, candidates = process_rows(
+                db, import_id, mapping, rows, match_config=MatchConfig.from_dict(db_import.match_config)
+            )
+
+            shard.total_rows = len(rows)
+            shard.inserted_count = inserted
+            shard.error_count = errors
+            shard.candidate_count = candidates
+            shard.status = models.ImportStatus.completed
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            shard.status = models.ImportStatus.failed
+            shard.error_message = str(e)
+            db.commit()
+
+        finalize_sharded_import(db, import_id)
+    finally:
+        db.close()
+
+
+def run_sharded_import(import_id: int, mapping: dict, shard_count: int, max_workers: int = None):
+    """シャードをプロセスプールで並列に処理（BackgroundTasks 用）"""
+    db = SessionLocal()
+    try:
+        db_import = crud.get_import(db, import_id)
+        if not db_import:
+            return
+        db_import.status = models.ImportStatus.processing
+        db_import.mapping = mapping
+        db.commit()
+        crud.create_import_shards(db, import_id, shard_count)
+        try:
+            partition_import(db, import_id, shard_count, mapping)
+        except Exception as e:
+            print(f"ERROR: シャードへの振り分けエラー (import {import_id}): {str(e)}")
+            db.rollback()
+            db_import.status = models.ImportStatus.failed
+            db_import.error_message = f"シャードへの振り分けエラー: {str(e)}"
+            db.commit()
+            return
+    finally:
+        db.close()
+
+    workers = min(shard_count, max_workers or SHARD_WORKERS)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            shard_no: pool.submit(process_import_shard, import_id, shard_no, shard_count, mapping)
+            for shard_no in range(shard_count)
+        }
+        for shard_no, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                # ワーカープロセス自体が落ちた場合
+                db = SessionLocal()
+                try:
+                    shard = crud.get_or_create_import_shard(db, import_id, shard_no, shard_count)
+                    shard.status = models.ImportStatus.failed
+                    shard.error_message = f"worker error: {e}"
+                    db.commit()
+                    finalize_sharded_import(db, import_id)
+                finally:
+                    db.close()
@@ -0,0 +1,297 @@
+"""
+ステージングテーブル経由の一括インポート（大きなファイル向け）
+
+1. 正規化した行をインポートごとのステージングテーブル import_staging_{id} に一括ロード
+   （executemany。MySQL で STAGING_LOAD_DATA_INFILE=true なら LOAD DATA LOCAL INFILE。
+   その場合は接続URLに ?local_infile=1 を付け、サーバー側でも local_infile を有効にする）
+2. email → 電話番号(E.164) の完全一致を customers のインデックスを使った SQL で解決し、
+   一致した顧客を1文の UPDATE で更新（空でない値だけ反映。同じ顧客に複数行あれば後の行が優先）
+3. 一致しなかった行だけを Python に戻して類似度で重複候補を検出
+
+STAGING_IMPORT_MIN_ROWS 行以上のファイルで process_import_job から使われる（0 で無効）。
+"""
+import json
+import os
+import tempfile
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, func, select, text
+from sqlalchemy.orm import Session
+from . import crud, models
+from .canonicalize import canonical_phone, customer_match_keys
+from .address_lsh import AddressLSH
+from .import_engine import build_match_index
+from .import_processor import (
+    MATCH_CHUNK_SIZE, hash_mapping, iter_chunks, load_candidate_customers, new_value_dictionary, prepare_chunk,
+    run_chunk_transaction, _process_row, _process_row_isolated
+)
+
+STAGING_IMPORT_MIN_ROWS = int(os.getenv("STAGING_IMPORT_MIN_ROWS", "50000"))
+STAGING_BATCH_SIZE = int(os.getenv("STAGING_BATCH_SIZE", "5000"))
+STAGING_LOAD_DATA_INFILE = os.getenv("STAGING_LOAD_DATA_INFILE", "false").lower() == "true"
+
+# SQL 側で更新する列（空でない値だけ反映）
+MERGE_COLUMNS = crud.UPSERT_COLUMNS + models.MATCH_KEY_COLUMNS
+
+
+def staging_table(import_id: int) -> Table:
+    """インポートごとのステージングテーブル定義"""
+    return Table(
+        f"import_staging_{import_id}", MetaData(),
+        Column("row_index", Integer, primary_key=True, autoincrement=False),
+        Column("email", String(255), index=True),
+        # 電話番号での一致に使うキー（email がない行だけ）
+        Column("match_phone_key", String(32), index=True),
+        Column("full_name", String(255)),
+        Column("phone", String(50)),
+        Column("address", Text),
+        Column("city", String(100)),
+        Column("state", String(100)),
+        Column("zip_code", String(20)),
+        Column("name_key", String(255)),
+        Column("name_token_key", String(255)),
+        Column("name_kana_key", String(255)),
+        Column("phone_key", String(32)),
+        Column("address_key", String(255)),
+        Column("raw_data", Text),
+        Column("mapped_data", Text),
+        Column("normalized_data", Text),
+        Column("row_hash", String(64)),
+        Column("customer_id", Integer, index=True),
+    )
+
+
+def _staging_row(idx: int, raw_data: str, mapped_data: dict, normalized_data: dict, row_hash: str) -> dict:
+    """正規化済みの行をステージング行に変換"""
+    row = {column: normalized_data.get(column) or None for column in crud.UPSERT_COLUMNS}
+    row.update(customer_match_keys(row["full_name"], row["phone"], row["address"]))
+    row.update({
+        "row_index": idx,
+        "email": normalized_data.get("email") or None,
+        "raw_data": raw_data,
+        "mapped_data": json.dumps(mapped_data, ensure_ascii=False),
+        "normalized_data": json.dumps(normalized_data, ensure_ascii=False),
+        "row_hash": row_hash,
+    })
+    # 電話番号は email がない行だけ一致に使う（ORM 経路と同じ）
+    row["match_phone_key"] = None if row["email"] or not row["phone"] else canonical_phone(row["phone"])
+    return row
+
+
+def _infile_value(value) -> str:
+    """LOAD DATA の既定形式（タブ区切り・バックスラッシュエスケープ・NULL は \\N）"""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _load_data_infile(db: Session, table: Table, rows: list):
+    """MySQL の LOAD DATA LOCAL INFILE でロード"""
+    columns = [column.name for column in table.columns]
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", delete=False) as f:
+        for row in rows:
+            f.write("\t".join(_infile_value(row.get(column)) for column in columns) + "\n")
+        path = f.name
+    try:
+        db.execute(text(
+            f"LOAD DATA LOCAL INFILE :path INTO TABLE {table.name} CHARACTER SET utf8mb4 "
+            f"({', '.join(columns)})"
+        ), {"path": path})
+    finally:
+        os.unlink(path)
+
+
+def load_staging(db: Session, table: Table, rows: list):
+    """ステージングテーブルに一括ロード"""
+    if not rows:
+        return
+    if STAGING_LOAD_DATA_INFILE and db.get_bind().dialect.name == "mysql":
+        _load_data_infile(db, table, rows)
+    else:
+        db.execute(table.insert(), rows)
+    db.commit()
+
+
+def match_exact(db: Session, table: Table) -> int:
+    """email / 電話番号の完全一致を SQL で解決し、一致した顧客を更新。一致行数を返す"""
+    customers = models.Customer.__table__
+
+    db.execute(table.update().where(table.c.email.isnot(None)).values(
+        customer_id=select(customers.c.id).where(
+            customers.c.email == table.c.email
+        ).limit(1).scalar_subquery()
+    ))
+    db.execute(table.update().where(table.c.match_phone_key.isnot(None)).values(
+        customer_id=select(customers.c.id).where(
+            customers.c.phone_key == table.c.match_phone_key
+        ).order_by(customers.c.id).limit(1).scalar_subquery()
+    ))
+
+    def latest(column: str):
+        """その顧客に一致した行のうち最後の空でない値"""
+        return select(table.c[column]).where(
+            table.c.customer_id == customers.c.id,
+            func.coalesce(table.c[column], "") != ""
+        ).order_by(table.c.row_index.desc()).limit(1).scalar_subquery()
+
+    matched_ids = select(table.c.customer_id).where(table.c.customer_id.isnot(None))
+    db.execute(customers.update().where(customers.c.id.in_(matched_ids)).values({
+        column: func.coalesce(latest(column), customers.c[column]) for column in MERGE_COLUMNS
+    }))
+
+    # 住所LSHバンドの入れ替え（後の行の住所が優先）
+    addresses = dict(db.execute(
+        select(table.c.customer_id, table.c.address).where(
+            table.c.customer_id.isnot(None),
+            func.coalesce(table.c.address, "") != ""
+        ).order_by(table.c.row_index)
+    ).all())
+    crud.replace_customer_address_bands(db, addresses)
+    db.commit()
+
+    return db.execute(select(func.count()).select_from(table).where(table.c.customer_id.isnot(None))).scalar()
+
+
+def _iter_staging(db: Session, table: Table, matched: bool, batch_size: int):
+    """ステージング行を row_index のキーセットでバッチ取得"""
+    condition = table.c.customer_id.isnot(None) if matched else table.c.customer_id.is_(None)
+    last_index = -1
+    while True:
+        batch = db.execute(
+            select(table).where(condition, table.c.row_index > last_index)
+            .order_by(table.c.row_index).limit(batch_size)
+        ).mappings().all()
+        if not batch:
+            break
+        yield batch
+        last_index = batch[-1]["row_index"]
+
+
+def process_rows_staged(db: Session, import_id: int, mapping: dict, indexed_rows, mapping_hash: str = None,
+                        match_config=None, match_stats=None, value_dictionary=None):
+    """process_rows と同じ入出力で、完全一致をステージングテーブル上の SQL で解決する"""
+    mapping_hash = mapping_hash or hash_mapping(mapping)
+    value_dictionary = value_dictionary or new_value_dictionary()
+    return process_prepared_staged(
+        db, import_id,
+        (
+            prepare_chunk(chunk, mapping, mapping_hash, value_dictionary)
+            for chunk in iter_chunks(indexed_rows, STAGING_BATCH_SIZE)
+        ),
+        match_config=match_config, match_stats=match_stats
+    )
+
+
+def process_prepared_staged(db: Session, import_id: int, prepared_chunks, match_config=None, match_stats=None,
+                            upsert_stats: dict = None):
+    """
+    prepare_chunk 済みのチャンク（STAGING_BATCH_SIZE 行ずつ）をステージング経由で処理する
+    SQL の完全一致で更新した行は upsert_stats の "updated" に数える
+    """
+    inserted_count = 0
+    error_count = 0
+    candidate_count = 0
+
+    table = staging_table(import_id)
+    table.drop(bind=db.connection(), checkfirst=True)
+    table.create(bind=db.connection())
+    db.commit()
+
+    try:
+        # 1. ロード（エラー行・取り込み済みの同一行はここで確定）
+        for row_indexes, prepared, row_hashes in prepared_chunks:
+            inserted, errors = _stage_batch(db, table, import_id, row_indexes, prepared, row_hashes)
+            inserted_count += inserted
+            error_count += errors
+
+        # 2. 完全一致
+        matched = match_exact(db, table)
+        for rows in _iter_staging(db, table, matched=True, batch_size=STAGING_BATCH_SIZE):
+            crud.create_import_rows(db, [
+                {
+                    "import_id": import_id,
+                    "row_index": row["row_index"],
+                    "raw_data": row["raw_data"],
+                    "mapped_data": row["mapped_data"],
+                    "normalized_data": row["normalized_data"],
+                    "validation_errors": [],
+                    "status": models.RowStatus.inserted,
+                    "row_hash": row["row_hash"],
+                }
+                for row in rows
+            ])
+        inserted_count += matched
+        if upsert_stats is not None:
+            upsert_stats["updated"] += matched
+
+        # 3. 一致しなかった行だけ類似度で判定
+        for rows in _iter_staging(db, table, matched=False, batch_size=MATCH_CHUNK_SIZE):
+            normalized_rows = [json.loads(row["normalized_data"]) for row in rows]
+            existing_customers_dict = load_candidate_customers(db, normalized_rows)
+            existing_index = build_match_index(existing_customers_dict)
+            address_index = AddressLSH()
+            address_index.add_many(existing_customers_dict)
+
+            def process(offset: int, force_exact: bool) -> tuple:
+                # 完全一致は SQL で解決済み。やり直し（一意制約違反）のときだけ email で引き直す
+                row = rows[offset]
+                return _process_row(
+                    db, import_id, row["row_index"], row["raw_data"], json.loads(row["mapped_data"]),
+                    normalized_rows[offset], [], existing_customers_dict, existing_index, address_index,
+                    row["row_hash"], check_exact=force_exact,
+                    match_config=match_config, match_stats=match_stats
+                )
+
+            def persist(isolate: bool) -> tuple:
+                counts = [0, 0, 0]
+                for offset, row in enumerate(rows):
+                    if isolate:
+                        prepared_row = (row["raw_data"], json.loads(row["mapped_data"]), normalized_rows[offset], [])
+                        row_counts = _process_row_isolated(
+                            db, import_id, row["row_index"], prepared_row, row["row_hash"],
+                            lambda force_exact, offset=offset: process(offset, force_exact)
+                        )
+                    else:
+                        row_counts = process(offset, False)
+                    counts = [total + count for total, count in zip(counts, row_counts)]
+                return counts
+
+            inserted, errors, candidates_found = run_chunk_transaction(db, persist)
+            inserted_count += inserted
+            error_count += errors
+            candidate_count += candidates_found
+    finally:
+        db.rollback()
+        table.drop(bind=db.connection(), checkfirst=True)
+        db.commit()
+
+    return inserted_count, error_count, candidate_count
+
+
+def _stage_batch(db: Session, table: Table, import_id: int, row_indexes: list, prepared: list, row_hashes: list):
+    """正規化済みの1バッチをロード。(inserted, errors) を返す"""
+    known_hashes = crud.get_inserted_row_hashes(db, row_hashes)
+
+    staged = []
+    finished = []
+    errors = 0
+    for idx, (raw_data, mapped_data, normalized_data, validation_errors), row_hash in zip(
+        row_indexes, prepared, row_hashes
+    ):
+        if validation_errors or row_hash in known_hashes:
+            errors += 1 if validation_errors else 0
+            finished.append({
+                "import_id": import_id,
+                "row_index": idx,
+                "raw_data": raw_data,
+                "mapped_data": json.dumps(mapped_data, ensure_ascii=False),
+                "normalized_data": json.dumps(normalized_data, ensure_ascii=False),
+                "validation_errors": validation_errors,
+                "status": models.RowStatus.error if validation_errors else models.RowStatus.inserted,
+                "row_hash": row_hash,
+            })
+        else:
+            staged.append(_staging_row(idx, raw_data, mapped_data, normalized_data, row_hash))
+
+    crud.create_import_rows(db, finished)
+    load_staging(db, table, staged)
+    return len(finished) - errors, errors
@@ -0,0 +1,189 @@
+"""
+解析済みアップロードの列指向キャッシュ（Parquet）
+
+S3 のファイルを最初に解析したときに、DataFrame を列ごとの型のまま Parquet でローカルに保存する。
+マッピングを直してのやり直しやプレビューでは S3 からのダウンロードと CSV / Excel の解析をせず、
+マッピングで使う列だけをメモリマップで読む。
+
+- キーは S3 キー + ETag（オブジェクトの内容が変われば変わる）。内容の SHA-256 もメタデータに持ち、
+  同一ファイルの再利用判定（replay_previous_import）にダウンロードなしで使う
+- ImportRow.raw_data と行ハッシュは全列から作るので、行ごとの全列の JSON も1列として持つ
+  （列を絞って読んでも raw_data は解析直後と同じ）。この列は raw_data=True のとき（インポート・シャードの振り分け）だけ読み、
+  プレビューなど列を絞った読み込みではマッピングの列しか読まない
+- 合計が UPLOAD_CACHE_MAX_BYTES を超えたら最後に使った時刻（mtime）の古い順に削除（LRU）
+- 書き込みは一時ファイル + rename なので、同じファイルを複数のプロセスが同時に書いても壊れない
+- キャッシュの失敗（pyarrow がない・変換できない列など）ではインポートを失敗させず、従来どおり解析する
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import List, Optional
+from .records import SourceRows
+
+UPLOAD_CACHE_ENABLED = os.getenv("UPLOAD_CACHE_ENABLED", "true").lower() == "true"
+UPLOAD_CACHE_DIR = os.getenv("UPLOAD_CACHE_DIR", os.path.join(tempfile.gettempdir(), "customer-import-cache"))
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# 行ごとの全列の JSON を持つ列
+RAW_DATA_COLUMN = "__raw_data__"
+# 保存形式の版（CSV を文字列で読むようにしたなど、同じファイルでも中身が変わるときに上げる。古い版は使わない）
+CACHE_FORMAT_VERSION = 2
+
+_evict_lock = threading.Lock()
+
+
+class CachedUpload:
+    """キャッシュ1件（Parquet ファイルとメタデータ）"""
+
+    __slots__ = ("path", "s3_key", "etag", "sha256", "num_rows", "columns")
+
+    def __init__(self, path: str, s3_key: str, etag: str, sha256: str, num_rows: int, columns: List[str]):
+        self.path = path
+        self.s3_key = s3_key
+        self.etag = etag
+        self.sha256 = sha256
+        self.num_rows = num_rows
+        self.columns = columns
+
+
+def cache_path(s3_key: str, etag: str) -> str:
+    digest = hashlib.sha256(f"{CACHE_FORMAT_VERSION}\0{s3_key}\0{etag}".encode("utf-8")).hexdigest()
+    return os.path.join(UPLOAD_CACHE_DIR, f"{digest}.parquet")
+
+
+def lookup(s3_key: str, etag: Optional[str]) -> Optional[CachedUpload]:
+    """S3 キー + ETag のキャッシュ（なければ None）。使った時刻を更新する"""
+    if not UPLOAD_CACHE_ENABLED or not etag:
+        return None
+    path = cache_path(s3_key, etag)
+    if not os.path.exists(path):
+        return None
+    try:
+        import pyarrow.parquet as pq  # 起動時間短縮のため初回利用時に import
+
+        schema = pq.read_schema(path, memory_map=True)
+        meta = {key.decode(): value.decode() for key, value in (schema.metadata or {}).items()}
+        if meta.get("s3_key") != s3_key or meta.get("etag") != etag:
+            return None
+        os.utime(path)
+        return CachedUpload(
+            path, s3_key, etag, meta.get("sha256") or None, int(meta.get("num_rows", 0)),
+            json.loads(meta.get("columns", "[]"))
+        )
+    except Exception as e:
+        print(f"WARN: アップロードキャッシュを読めません ({path}): {e}")
+        return None
+
+
+def store(s3_key: str, etag: Optional[str], sha256: str, df, rows: SourceRows = None) -> Optional[CachedUpload]:
+    """
+    解析済みの DataFrame を保存（raw_data の列を付ける）して古いものを削除
+    rows（df から作った SourceRows）を渡すと、作った raw_data をその rows にも持たせる（インポートで作り直さない）
+    """
+    if not UPLOAD_CACHE_ENABLED or not etag:
+        return None
+    path = cache_path(s3_key, etag)
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = rows if rows is not None else SourceRows.from_dataframe(df)
+        columns = list(rows.layout.columns)
+        # import_processor.row_raw_data と同じ JSON（行の Mapping を経由せずに列名と値のタプルから）
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        raw_data = [encode(dict(zip(columns, values))) for values in rows.rows]
+        table = pa.Table.from_pandas(df, preserve_index=False).rename_columns(columns)
+        table = table.append_column(RAW_DATA_COLUMN, pa.array(raw_data, pa.string()))
+        # pandas のメタデータ（元の列名・型）は持たない。列名は rows と同じ文字列
+        table = table.replace_schema_metadata({
+            b"s3_key": s3_key.encode(),
+            b"etag": etag.encode(),
+            b"sha256": (sha256 or "").encode(),
+            b"num_rows": str(len(rows)).encode(),
+            b"columns": json.dumps(columns, ensure_ascii=False).encode(),
+        })
+
+        os.makedirs(UPLOAD_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        rows.raw_data = raw_data
+        evict()
+        return CachedUpload(path, s3_key, etag, sha256, len(rows), columns)
+    except Exception as e:
+        print(f"WARN: アップロードキャッシュに保存できません ({s3_key}): {e}")
+        return None
+
+
+def read_rows(entry: CachedUpload, columns: Optional[List[str]] = None, limit: Optional[int] = None,
+              raw_data: bool = False) -> SourceRows:
+    """
+    キャッシュから行を読む（columns を渡すとその列だけ。メモリマップで読む）
+    raw_data=True なら保存済みの全列の JSON も読んで行に持たせる（ImportRow.raw_data・行ハッシュ用）。
+    limit を渡すと先頭の行だけ読む（プレビュー用）
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    wanted = [column for column in entry.columns if columns is None or column in columns]
+    read_columns = wanted + [RAW_DATA_COLUMN] if raw_data else wanted
+    if limit is None:
+        table = pq.read_table(entry.path, columns=read_columns, memory_map=True)
+    else:
+        parquet_file = pq.ParquetFile(entry.path, memory_map=True)
+        batch = next(parquet_file.iter_batches(batch_size=max(limit, 1), columns=read_columns), None)
+        if batch is None:
+            table = parquet_file.schema_arrow.empty_table().select(read_columns)
+        else:
+            table = pa.Table.from_batches([batch]).slice(0, limit)
+
+    raw_json = None
+    if raw_data:
+        raw_json = table.column(RAW_DATA_COLUMN).to_pylist()
+        table = table.drop_columns([RAW_DATA_COLUMN])
+    df = table.to_pandas()
+    df.columns = wanted
+    return SourceRows.from_dataframe(df, raw_json)
+
+
+def evict(max_bytes: int = None):
+    """合計サイズが上限を超えていたら最後に使った時刻の古い順に削除"""
+    max_bytes = UPLOAD_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        try:
+            entries = []
+            for name in os.listdir(UPLOAD_CACHE_DIR):
+                if name.endswith(".parquet"):
+                    path = os.path.join(UPLOAD_CACHE_DIR, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        except FileNotFoundError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+def stats() -> dict:
+    """キャッシュの件数と合計サイズ"""
+    try:
+        sizes = [
+            os.path.getsize(os.path.join(UPLOAD_CACHE_DIR, name))
+            for name in os.listdir(UPLOAD_CACHE_DIR) if name.endswith(".parquet")
+        ]
+    except FileNotFoundError:
+        sizes = []
+    return {"entries": len(sizes), "bytes": sum(sizes), "max_bytes": UPLOAD_CACHE_MAX_BYTES}
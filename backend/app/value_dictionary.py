@@ -0,0 +1,136 @@
+"""
+列ごとの辞書エンコーディング（正規化・バリデーションを異なる値ごとに1回だけ）
+
+顧客ファイルは都道府県・市区町村・メールのドメイン・空セルなど同じ値の繰り返しが多い。
+列の値を「異なる値の表 + コード」に分け、表の値だけ normalize_value / validate_value を実行して
+結果をコードで各行に戻す。表はジョブ全体で共有するので、チャンクをまたいだ繰り返しもヒットする。
+
+ほぼ全行で値が異なる列（email など）は表が大きくなるだけなので、
+最初の DICTIONARY_PROBE_VALUES 件で異なる値の割合が DICTIONARY_MAX_DISTINCT_RATIO を超えたら
+その列は表を捨てて直接計算する。
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import os
+from .import_engine import normalize_value, validate_value
+
+DICTIONARY_PROBE_VALUES = int(os.getenv("DICTIONARY_PROBE_VALUES", "2000"))
+DICTIONARY_MAX_DISTINCT_RATIO = float(os.getenv("DICTIONARY_MAX_DISTINCT_RATIO", "0.9"))
+# 1列の表の上限（超えたら直接計算に切り替える）
+DICTIONARY_MAX_ENTRIES = int(os.getenv("DICTIONARY_MAX_ENTRIES", "100000"))
+
+
+class ColumnDictionary:
+    """1列分の 値 → (正規化値, エラー) の表"""
+
+    def __init__(self, rule: str, validation: Optional[str] = None):
+        self.rule = rule
+        self.validation = validation
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[type, Any], Tuple[str, str]] = {}
+
+    def _compute(self, value: Any) -> Tuple[str, str]:
+        normalized = normalize_value(value, self.rule)
+        error = validate_value(normalized, self.validation) if self.validation and normalized else ""
+        return normalized, error
+
+    def encode(self, values: Sequence[Any]) -> List[Tuple[str, str]]:
+        """値の列を (正規化値, エラー) の列に変換"""
+        if not self.enabled:
+            self.misses += len(values)
+            return [self._compute(value) for value in values]
+
+        # 異なる値の表とコード（1 と 1.0 と True を区別するため型もキーに含める）
+        codes = []
+        uniques: Dict[Tuple[type, Any], int] = {}
+        try:
+            for value in values:
+                codes.append(uniques.setdefault((type(value), value), len(uniques)))
+        except TypeError:
+            # ハッシュできない値（list など）が混ざる列は表を使わない
+            self.enabled = False
+            self._entries.clear()
+            return self.encode(values)
+
+        results = []
+        computed = 0
+        for key in uniques:
+            result = self._entries.get(key)
+            if result is None:
+                result = self._compute(key[1])
+                self._entries[key] = result
+                computed += 1
+            results.append(result)
+        self.misses += computed
+        self.hits += len(values) - computed
+
+        lookups = self.hits + self.misses
+        if len(self._entries) > DICTIONARY_MAX_ENTRIES or (
+            lookups >= DICTIONARY_PROBE_VALUES and len(self._entries) > lookups * DICTIONARY_MAX_DISTINCT_RATIO
+        ):
+            self.enabled = False
+            self._entries.clear()
+        return [results[code] for code in codes]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "distinct": len(self._entries),
+            "enabled": self.enabled,
+        }
+
+
+class ValueDictionary:
+    """ジョブ全体の列ごとの表（フィールド名 → ColumnDictionary）"""
+
+    def __init__(self, rules: Dict[str, str], validations: Dict[str, str]):
+        self.rules = rules
+        self.validations = validations
+        self.columns: Dict[str, ColumnDictionary] = {}
+
+    def column(self, field: str) -> ColumnDictionary:
+        column = self.columns.get(field)
+        if column is None:
+            column = ColumnDictionary(self.rules.get(field, "trim"), self.validations.get(field))
+            self.columns[field] = column
+        return column
+
+    def encode_rows(self, mapped_rows: Sequence[Dict[str, Any]]) -> List[Tuple[Dict[str, str], List[str]]]:
+        """マッピング済みの行の列を (normalized_data, validation_errors) の列に変換"""
+        fields: Dict[str, None] = {}
+        for mapped_data in mapped_rows:
+            fields.update(dict.fromkeys(mapped_data))
+
+        encoded = {}
+        for field in fields:
+            present = [i for i, mapped_data in enumerate(mapped_rows) if field in mapped_data]
+            results = self.column(field).encode([mapped_rows[i][field] for i in present])
+            encoded[field] = dict(zip(present, results))
+
+        rows = []
+        for i, mapped_data in enumerate(mapped_rows):
+            normalized_data = {}
+            validation_errors = []
+            for field in mapped_data:
+                normalized, error = encoded[field][i]
+                normalized_data[field] = normalized
+                if error:
+                    validation_errors.append(f"{field}: {error}")
+            rows.append((normalized_data, validation_errors))
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        """列ごとと全体のヒット率"""
+        columns = {field: column.stats() for field, column in self.columns.items()}
+        hits = sum(column["hits"] for column in columns.values())
+        lookups = hits + sum(column["misses"] for column in columns.values())
+        return {
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "columns": columns,
+        }
@@ -0,0 +1,70 @@
+"""
+住所 MinHash/LSH と総当たり比較のベンチマーク
+
+使い方:
+    python -m benchmarks.bench_address_lsh [--customers 5000] [--queries 200] [--bands 20] [--rows 4]
+
+総当たり（全顧客との Levenshtein 類似度 >= threshold）を正解として、
+LSH 候補の再現率・適合率と、1件あたりの検索時間を比較する。
+"""
+import argparse
+import time
+from app.address_lsh import AddressLSH
+from app.canonicalize import canonical_address
+from app.import_engine import similarity_score
+from benchmarks.synthetic import generate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bands", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--shingle-size", type=int, default=2)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    args = parser.parse_args(argv)
+
+    customers, rows, _ = generate(args.customers, args.queries)
+    customer_keys = {c["id"]: canonical_address(c["address"]) for c in customers}
+
+    # 総当たり
+    start = time.perf_counter()
+    truth = []
+    for row in rows:
+        key = canonical_address(row["address"])
+        truth.append({
+            cid for cid, ckey in customer_keys.items()
+            if similarity_score(key, ckey) >= args.threshold
+        })
+    brute_seconds = time.perf_counter() - start
+
+    # LSH
+    index = AddressLSH(bands=args.bands, rows=args.rows, shingle_size=args.shingle_size)
+    start = time.perf_counter()
+    index.add_many(customers)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retrieved = [index.query(row["address"]) for row in rows]
+    verified = [
+        {cid for cid in ids if similarity_score(canonical_address(row["address"]), customer_keys[cid]) >= args.threshold}
+        for row, ids in zip(rows, retrieved)
+    ]
+    lsh_seconds = time.perf_counter() - start
+
+    true_pairs = sum(len(t) for t in truth)
+    found_pairs = sum(len(t & v) for t, v in zip(truth, verified))
+    retrieved_pairs = sum(len(r) for r in retrieved)
+    relevant_retrieved = sum(len(t & r) for t, r in zip(truth, retrieved))
+
+    print(f"customers={args.customers} queries={args.queries} bands={args.bands} rows={args.rows}")
+    print(f"  recall     : {found_pairs / true_pairs if true_pairs else 1.0:.3f} ({found_pairs}/{true_pairs})")
+    print(f"  precision  : {relevant_retrieved / retrieved_pairs if retrieved_pairs else 1.0:.3f} (候補 {retrieved_pairs} 件, 検証前)")
+    print(f"  candidates : {retrieved_pairs / len(rows):.1f} 件/クエリ")
+    print(f"  brute force: {len(rows) / brute_seconds:,.0f} クエリ/秒")
+    print(f"  LSH        : {len(rows) / lsh_seconds:,.0f} クエリ/秒 (構築 {build_seconds:.2f} 秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+既存顧客の重複スイープのベンチマーク
+
+SQLite のファイルDBに合成顧客と、その表記ゆれ（住所の丁目表記・全角・タイプミス・建物名）を
+別顧客として入れ、スイープ全体（シャード処理 + クラスタ作成）の時間と、元顧客と重複が同じクラスタに
+入った割合を測る。
+
+使い方:
+    python -m benchmarks.bench_dedupe_sweep [--customers 20000] [--duplicates 2000] [--shards 4] [--workers 4]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from app import crud, models
+from app.canonicalize import customer_match_keys
+from app import dedupe_sweep
+from app.database import Base
+from benchmarks.synthetic import make_customer, perturb
+
+
+def load(session_factory, customers: int, duplicates: int, batch_size: int = 5000):
+    """合成顧客と重複を投入し、重複の顧客ID → 元の顧客ID を返す"""
+    rng = random.Random(42)
+    db = session_factory()
+    originals = {}
+    try:
+        rows = [make_customer(rng, customer_id) for customer_id in range(1, customers + 1)]
+        for customer_id in rng.sample(range(1, customers + 1), duplicates):
+            row = perturb(rng, rows[customer_id - 1])
+            row["id"] = len(rows) + 1
+            row["email"] = None
+            originals[row["id"]] = customer_id
+            rows.append(row)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            for row in batch:
+                row.update(customer_match_keys(row["full_name"], row["phone"], row["address"]))
+            db.execute(insert(models.Customer), batch)
+            crud.replace_customer_address_bands(db, {row["id"]: row["address"] for row in batch})
+            db.commit()
+    finally:
+        db.close()
+    return originals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--duplicates", type=int, default=2000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=0, help="0 ならこのプロセスで順に処理")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        # --workers のワーカープロセスは app.database の設定で接続するので同じ DB を指す
+        os.environ["DATABASE_URL"] = os.environ["DATABASE_URL_LOCAL"] = url
+        engine = create_engine(url, connect_args={"timeout": 60})
+
+        @event.listens_for(engine, "connect")
+        def _wal(connection, _):
+            # 顧客を読み続けるカーソルがあっても書き込めるように（MySQL では不要）
+            connection.execute("PRAGMA journal_mode=WAL")
+
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        dedupe_sweep.SessionLocal = session_factory
+
+        start = time.perf_counter()
+        originals = load(session_factory, args.customers, args.duplicates)
+        print(f"顧客 {args.customers + args.duplicates:,} 件を投入: {time.perf_counter() - start:.1f} 秒")
+
+        db = session_factory()
+        sweep_id = dedupe_sweep.create_sweep(db, args.shards).id
+        db.close()
+        start = time.perf_counter()
+        dedupe_sweep.run_sweep(sweep_id, max_workers=args.workers)
+        elapsed = time.perf_counter() - start
+
+        db = session_factory()
+        sweep = db.get(models.DedupeSweep, sweep_id)
+        cluster_of = dict(db.query(models.DedupeClusterMember.customer_id, models.DedupeClusterMember.cluster_id))
+        found = sum(
+            1 for duplicate_id, original_id in originals.items()
+            if duplicate_id in cluster_of and cluster_of[duplicate_id] == cluster_of.get(original_id)
+        )
+        total = args.customers + args.duplicates
+        print(f"スイープ: {elapsed:.1f} 秒（{total / elapsed:,.0f} 顧客/秒）"
+              f" 組 {sweep.pair_count:,} 件・クラスタ {sweep.cluster_count:,} 件")
+        print(f"重複の検出率: {found / len(originals):.1%}（{found:,} / {len(originals):,}）")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
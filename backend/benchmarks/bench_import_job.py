@@ -0,0 +1,170 @@
+"""
+インポートジョブ（照合・保存）のベンチマーク
+
+SQLite のファイルDBに合成顧客を入れ、同じ行（既存顧客の表記ゆれ + 新規）を
+process_import_job に --repeat 回通して時間と結果を見る（毎回新しい DB）。
+--db-latency-ms で SQL 1文ごとに待ちを入れ、ネットワーク越しの DB（MySQL）の往復を模擬する。
+--s3-mbps を付けると行を CSV にして帯域を絞った S3 のスタブから取り込み、
+ダウンロードしてから取り込む場合と読みながら取り込む場合（import_stream）を比べる。
+
+使い方:
+    python -m benchmarks.bench_import_job [--customers 5000] [--rows 5000] [--db-latency-ms 0.5] [--repeat 2]
+    python -m benchmarks.bench_import_job --s3-mbps 20
+"""
+import argparse
+import csv
+import hashlib
+import io
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from app import crud, import_processor, import_stream, models, rematch
+from app.canonicalize import customer_match_keys
+from app.database import Base
+from benchmarks.synthetic import generate, make_customer
+
+MAPPING = {"full_name": "氏名", "email": "メール", "phone": "電話", "address": "住所"}
+
+
+def make_rows(customers: int, rows: int) -> tuple:
+    """(既存顧客, インポート行) を返す。行の半分は既存顧客の表記ゆれ、残りは新規"""
+    existing, duplicates, _ = generate(customers, rows // 2)
+    rng = random.Random(7)
+    new = [make_customer(rng, customers + i + 1) for i in range(rows - len(duplicates))]
+    import_rows = [
+        {"氏名": row["full_name"], "メール": row.get("email") or "", "電話": row.get("phone") or "",
+         "住所": row.get("address") or ""}
+        for row in duplicates + new
+    ]
+    rng.shuffle(import_rows)
+    return existing, import_rows
+
+
+class SimulatedBody:
+    """帯域を絞った S3 のレスポンス（1回の read は最大 64KB）"""
+
+    def __init__(self, content: bytes, bytes_per_second: float):
+        self.content = content
+        self.bytes_per_second = bytes_per_second
+        self.position = 0
+
+    def read(self, size=None):
+        end = len(self.content) if size is None else self.position + min(size, 64 * 1024)
+        data = self.content[self.position:end]
+        self.position += len(data)
+        time.sleep(len(data) / self.bytes_per_second)
+        return data
+
+    def close(self):
+        pass
+
+
+class SimulatedS3:
+    """帯域を絞った S3 のスタブ（解析済みキャッシュ・前回の結果の引き継ぎは使わない）"""
+
+    def __init__(self, content: bytes, mbps: float):
+        self.content = content
+        self.bytes_per_second = mbps * 1024 * 1024
+
+    def get_trusted_etag(self, s3_key):
+        return None
+
+    def get_object_etag(self, s3_key):
+        return None
+
+    def get_object_size(self, s3_key):
+        return len(self.content)
+
+    def download_file_with_hash(self, s3_key):
+        time.sleep(len(self.content) / self.bytes_per_second)
+        return self.content, hashlib.sha256(self.content).hexdigest()
+
+    def open_object(self, s3_key):
+        return SimulatedBody(self.content, self.bytes_per_second)
+
+
+def to_csv(rows: list) -> bytes:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(MAPPING.values()))
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+def run(existing: list, rows: list, latency: float, s3: SimulatedS3 = None) -> tuple:
+    """新しい DB に既存顧客を入れてインポートし (秒, Import) を返す（s3 があればそこから読む）"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+
+        @event.listens_for(engine, "connect")
+        def _no_fsync(connection, _):
+            # ディスクの fsync のばらつきで比較がぶれないように
+            connection.execute("PRAGMA synchronous=OFF")
+
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        db = session_factory()
+        batch = [dict(customer) for customer in existing]
+        for customer in batch:
+            customer.update(customer_match_keys(customer["full_name"], customer["phone"], customer["address"]))
+        db.execute(insert(models.Customer), batch)
+        crud.replace_customer_address_bands(db, {c["id"]: c["address"] for c in batch})
+        db.commit()
+        db_import = crud.create_import(db, "bench.csv", s3_key="uploads/bench.csv" if s3 else None)
+
+        if latency:
+            @event.listens_for(engine, "before_cursor_execute")
+            def _round_trip(*_):
+                time.sleep(latency)
+
+        start = time.perf_counter()
+        if s3:
+            import_processor.s3_service = s3
+            import_processor.process_import_job(db_import.id, MAPPING, [], db)
+        else:
+            import_processor.process_import_job(db_import.id, MAPPING, rows, db)
+        elapsed = time.perf_counter() - start
+        db.refresh(db_import)
+        db.close()
+        engine.dispose()
+        return elapsed, db_import
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--db-latency-ms", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--s3-mbps", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    existing, rows = make_rows(args.customers, args.rows)
+    # 行の処理だけを測る（インポート後の候補の再判定は外す）
+    rematch.REMATCH_AFTER_IMPORT = False
+    results = set()
+    if args.s3_mbps:
+        content = to_csv(rows)
+        s3 = SimulatedS3(content, args.s3_mbps)
+        print(f"bench.csv: {len(content) / 1024 / 1024:.1f} MB（S3 {args.s3_mbps:g} MB/秒 → 転送 {len(content) / s3.bytes_per_second:.2f} 秒）")
+        modes = [("ダウンロード後", 0), ("読みながら", 1)]
+    else:
+        s3, modes = None, [("", None)]
+    for attempt in range(1, args.repeat + 1):
+        for label, min_bytes in modes:
+            if min_bytes is not None:
+                import_stream.IMPORT_STREAM_MIN_BYTES = min_bytes
+            elapsed, db_import = run(existing, rows, args.db_latency_ms / 1000, s3)
+            result = (db_import.total_rows, db_import.inserted_count, db_import.error_count, db_import.candidate_count)
+            results.add(result)
+            print(f"{attempt}回目{label and f' {label}'}: {elapsed:6.2f} 秒（{len(rows) / elapsed:,.0f} 行/秒） "
+                  f"total/inserted/errors/candidates = {result}")
+
+    assert len(results) == 1, "実行ごとに結果が一致しません"
+
+
+if __name__ == "__main__":
+    main()
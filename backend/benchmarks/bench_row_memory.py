@@ -0,0 +1,70 @@
+"""
+行・顧客レコードのメモリ使用量ベンチマーク（tracemalloc）
+
+使い方:
+    python -m benchmarks.bench_row_memory [--rows 200000] [--customers 200000]
+
+DataFrame → df.to_dict('records') と SourceRows（タプル + 共有 layout）、
+顧客 dict と CustomerRecord（__slots__）の保持メモリを比較する。
+"""
+import argparse
+import gc
+import io
+import tracemalloc
+import pandas as pd
+from app.records import CustomerRecord, SourceRows
+from benchmarks.synthetic import generate
+
+EXTRA_COLUMNS = ["会社名", "部署", "役職", "郵便番号", "備考"]
+
+
+def measure(build):
+    """build() が返すオブジェクトが保持しているメモリ（バイト）"""
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current
+
+
+def make_csv(customers) -> bytes:
+    lines = ["氏名,メール,電話,住所," + ",".join(EXTRA_COLUMNS)]
+    for c in customers:
+        lines.append(
+            f"{c['full_name']},{c['email']},{c['phone']},{c['address']},"
+            f"株式会社サンプル,営業部,主任,100-000{c['id'] % 10},"
+        )
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--customers", type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    customers, _, _ = generate(max(args.rows, args.customers), 0)
+    df = pd.read_csv(io.BytesIO(make_csv(customers[:args.rows])))
+    clean = df.astype(object).where(df.notna(), None)
+
+    dict_rows = measure(lambda: clean.to_dict("records"))
+    slot_rows = measure(lambda: SourceRows.from_dataframe(df))
+
+    sample = [dict(c, city=None, state=None, zip_code=None) for c in customers[:args.customers]]
+    dict_customers = measure(lambda: [dict(c) for c in sample])
+    slot_customers = measure(lambda: [CustomerRecord(*(c[f] for f in CustomerRecord.FIELDS)) for c in sample])
+
+    mb = 1024 * 1024
+    print(f"行 {args.rows} 件（{len(df.columns)} 列）")
+    print(f"  to_dict('records') : {dict_rows / mb:8.1f} MB")
+    print(f"  SourceRows         : {slot_rows / mb:8.1f} MB  ({slot_rows / dict_rows:.0%})")
+    print(f"顧客 {args.customers} 件")
+    print(f"  dict               : {dict_customers / mb:8.1f} MB")
+    print(f"  CustomerRecord     : {slot_customers / mb:8.1f} MB  ({slot_customers / dict_customers:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+シャード並列インポートの入力の読み込みのベンチマーク（DB の照合・保存は含まない）
+
+従来: 各シャードがファイル全体をダウンロード・解析し、自分の行だけを残す（解析はシャード数倍、各シャードが全行を保持）
+現在: partition_import が1回だけ解析してシャードごとの入力に分け、各シャードは自分の入力（1/N）だけを読む
+
+S3 はメモリ上のスタブに置き換える（ダウンロード・アップロードの通信時間は含まない）。
+
+使い方:
+    python -m benchmarks.bench_sharded_import [--rows 200000] [--shards 4]
+"""
+import argparse
+import hashlib
+import time
+import tracemalloc
+from app import crud, sharded_import
+from app.import_processor import read_rows
+from benchmarks.bench_upload_cache import MAPPING, make_file
+
+
+class MemoryS3:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.objects = {}
+
+    def get_object_etag(self, s3_key):
+        return None  # 解析済みキャッシュは使わない（毎回の解析と比べる）
+
+    def download_file_with_hash(self, s3_key):
+        return self.content, hashlib.sha256(self.content).hexdigest()
+
+    def upload_fileobj(self, fileobj, s3_key, content_type=None):
+        self.objects[s3_key] = fileobj.read()
+        return True
+
+    def download_file(self, s3_key):
+        return self.objects.get(s3_key)
+
+
+class FakeImport:
+    s3_key = "uploads/bench.csv"
+    filename = "bench.csv"
+    mapping = MAPPING
+
+
+def measure(func):
+    """(秒, ピークメモリ MB, 結果) を返す（メモリは tracemalloc で別に実行して測る。時間には含めない）"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--extra-columns", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    content = make_file(args.rows, args.extra_columns, "csv")
+    print(f"bench.csv: {args.rows:,} 行, {len(content) / 1024 / 1024:.1f} MB, シャード {args.shards}")
+    sharded_import.s3_service = MemoryS3(content)
+    crud.get_import = lambda db, import_id: FakeImport()
+
+    def old_shard(shard_no):
+        return [
+            (idx, row) for idx, row in enumerate(read_rows("bench.csv", content))
+            if sharded_import.shard_for_row(row, MAPPING, args.shards, idx) == shard_no
+        ]
+
+    old = [measure(lambda shard_no=shard_no: old_shard(shard_no)) for shard_no in range(args.shards)]
+    partition = measure(lambda: sharded_import.partition_import(None, 1, args.shards, MAPPING))
+    new = [
+        measure(lambda shard_no=shard_no: sharded_import.read_shard_input(1, shard_no))
+        for shard_no in range(args.shards)
+    ]
+    assert [len(result) for _, _, result in old] == [len(result) for _, _, result in new] == partition[2]
+
+    print(f"従来: 各シャード {old[0][0]:.2f} 秒・ピーク {max(p for _, p, _ in old):.0f} MB、"
+          f"合計 {sum(t for t, _, _ in old):.2f} CPU秒")
+    print(f"現在: 振り分け {partition[0]:.2f} 秒・ピーク {partition[1]:.0f} MB（1回）、"
+          f"各シャード {new[0][0]:.2f} 秒・ピーク {max(p for _, p, _ in new):.0f} MB、"
+          f"合計 {partition[0] + sum(t for t, _, _ in new):.2f} CPU秒")
+
+
+if __name__ == "__main__":
+    main()
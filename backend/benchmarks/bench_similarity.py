@@ -0,0 +1,40 @@
+"""
+氏名類似度の一括計算（NumPy）と1件ずつの計算のベンチマーク
+
+使い方:
+    python -m benchmarks.bench_similarity [--customers 5000] [--queries 50]
+"""
+import argparse
+import time
+from app.canonicalize import canonical_name
+from app.import_engine import batch_similarity_scores, similarity_score
+from benchmarks.synthetic import generate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    customers, rows, _ = generate(args.customers, args.queries)
+    names = [canonical_name(c["full_name"]) for c in customers]
+    queries = [canonical_name(row["full_name"]) for row in rows]
+
+    start = time.perf_counter()
+    scalar = [[similarity_score(q, name) for name in names] for q in queries]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = [batch_similarity_scores(q, names).tolist() for q in queries]
+    batch_seconds = time.perf_counter() - start
+
+    assert scalar == batch, "一括計算の結果が一致しません"
+    pairs = len(names) * len(queries)
+    print(f"顧客 {len(names)} 件 × クエリ {len(queries)} 件（結果は完全一致）")
+    print(f"  1件ずつ : {scalar_seconds:7.2f} 秒 ({pairs / scalar_seconds:,.0f} ペア/秒)")
+    print(f"  NumPy   : {batch_seconds:7.2f} 秒 ({pairs / batch_seconds:,.0f} ペア/秒)")
+
+
+if __name__ == "__main__":
+    main()
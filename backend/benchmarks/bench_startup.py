@@ -0,0 +1,51 @@
+"""
+起動時間のベンチマーク（新しいプロセスで app.main を import し、最初のリクエストに応答するまで）
+
+使い方:
+    python -m benchmarks.bench_startup [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 子プロセスで実行するコード（import 時間・/health まで・読み込まれた重い依存）
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter() - start
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    assert client.get("/health").status_code == 200
+ready = time.perf_counter() - start
+heavy = [m for m in ("pandas", "numpy", "boto3", "pymysql", "openpyxl") if m in sys.modules]
+print(json.dumps({"import": imported, "ready": ready, "heavy": heavy}))
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=backend_dir, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    imports = [r["import"] for r in results]
+    readies = [r["ready"] for r in results]
+    print(f"{args.runs} 回の中央値（新しいプロセスごと）")
+    print(f"  import app.main   : {statistics.median(imports):6.3f} 秒")
+    print(f"  /health 応答まで  : {statistics.median(readies):6.3f} 秒")
+    print(f"  起動時に読み込まれた重い依存: {', '.join(results[-1]['heavy']) or 'なし'}")
+
+
+if __name__ == "__main__":
+    main()
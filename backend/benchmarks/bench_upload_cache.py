@@ -0,0 +1,92 @@
+"""
+アップロードの解析と Parquet キャッシュからの読み込みのベンチマーク
+
+合成顧客に使わない列を足したファイル（CSV / Excel）を作り、
+毎回解析する場合（read_dataframe + SourceRows）と、キャッシュからマッピングの列だけ読む場合の時間を比べる。
+マッピングを直してのやり直しやプレビューで省ける時間の目安。
+
+使い方:
+    python -m benchmarks.bench_upload_cache [--rows 50000] [--extra-columns 20] [--format csv|xlsx]
+"""
+import argparse
+import io
+import random
+import tempfile
+import time
+import pandas as pd
+from app import upload_cache
+from app.import_processor import read_dataframe
+from app.records import SourceRows
+from benchmarks.synthetic import make_customer
+
+MAPPING = {"full_name": "氏名", "email": "メール", "phone": "電話", "address": "住所"}
+
+
+def make_file(rows: int, extra_columns: int, fmt: str) -> bytes:
+    rng = random.Random(3)
+    records = []
+    for i in range(rows):
+        customer = make_customer(rng, i + 1)
+        record = {"氏名": customer["full_name"], "メール": customer.get("email") or "",
+                  "電話": customer.get("phone") or "", "住所": customer.get("address") or ""}
+        for j in range(extra_columns):
+            record[f"項目{j + 1}"] = rng.randint(0, 10 ** 6) if j % 2 else f"値{rng.randint(0, 999)}"
+        records.append(record)
+    df = pd.DataFrame(records)
+    buffer = io.BytesIO()
+    if fmt == "xlsx":
+        df.to_excel(buffer, index=False)
+    else:
+        df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+
+def timed(func, repeat: int = 3) -> tuple:
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--extra-columns", type=int, default=20)
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    args = parser.parse_args(argv)
+
+    content = make_file(args.rows, args.extra_columns, args.format)
+    filename = f"bench.{args.format}"
+    print(f"{filename}: {args.rows:,} 行 x {4 + args.extra_columns} 列, {len(content) / 1024 / 1024:.1f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        upload_cache.UPLOAD_CACHE_DIR = tmp
+        parse_seconds, parsed = timed(lambda: SourceRows.from_dataframe(read_dataframe(filename, content)),
+                                      repeat=1 if args.format == "xlsx" else 3)
+        df = read_dataframe(filename, content)
+        start = time.perf_counter()
+        entry = upload_cache.store("uploads/bench", "etag", "sha", df)
+        store_seconds = time.perf_counter() - start
+        cached_seconds, cached = timed(lambda: upload_cache.read_rows(entry, columns=list(MAPPING.values())))
+        # インポートは ImportRow.raw_data 用に全列の JSON も読む
+        import_seconds, imported = timed(
+            lambda: upload_cache.read_rows(entry, columns=list(MAPPING.values()), raw_data=True)
+        )
+        preview_seconds, _ = timed(lambda: upload_cache.read_rows(entry, limit=20))
+
+        assert len(cached) == len(parsed)
+        assert [row.project(MAPPING) for row in cached] == [row.project(MAPPING) for row in parsed]
+        assert cached.raw_data is None and len(imported.raw_data) == len(parsed)
+        print(f"解析（毎回）: {parse_seconds:7.3f} 秒")
+        print(f"キャッシュ保存（初回のみ）: {store_seconds:7.3f} 秒（{upload_cache.stats()['bytes'] / 1024 / 1024:.1f} MB）")
+        print(f"キャッシュから {len(MAPPING)} 列: {cached_seconds:7.3f} 秒（{parse_seconds / cached_seconds:.1f} 倍速）")
+        print(f"キャッシュから {len(MAPPING)} 列 + raw_data（インポート）: {import_seconds:7.3f} 秒"
+              f"（{parse_seconds / import_seconds:.1f} 倍速）")
+        print(f"キャッシュから先頭 20 行（プレビュー）: {preview_seconds:7.3f} 秒")
+
+
+if __name__ == "__main__":
+    main()
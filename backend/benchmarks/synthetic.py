@@ -0,0 +1,64 @@
+"""
+ベンチマーク用の合成顧客データ
+
+既存顧客と、その表記ゆれ・タイプミスを含む重複行を決定的に生成する。
+"""
+import random
+
+SURNAMES = ["山田", "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "中村", "小林", "加藤",
+            "吉田", "山本", "斎藤", "松本", "井上", "木村", "林", "清水", "山口", "森"]
+GIVEN_NAMES = ["太郎", "花子", "一郎", "次郎", "美咲", "健太", "陽子", "翔太", "愛", "大輔",
+               "由美", "拓也", "直子", "誠", "恵", "亮", "真由美", "浩", "さくら", "学"]
+CITIES = ["東京都千代田区丸の内", "東京都港区六本木", "大阪府大阪市北区梅田", "神奈川県横浜市西区みなとみらい",
+          "愛知県名古屋市中村区名駅", "福岡県福岡市博多区博多駅前", "北海道札幌市中央区北一条西",
+          "京都府京都市下京区四条通", "兵庫県神戸市中央区三宮町", "宮城県仙台市青葉区一番町"]
+KANJI_NUMBERS = ["一", "二", "三", "四", "五", "六", "七", "八", "九"]
+
+
+def make_customer(rng: random.Random, customer_id: int) -> dict:
+    """既存顧客1件"""
+    chome = rng.randint(1, 9)
+    return {
+        "id": customer_id,
+        "full_name": f"{rng.choice(SURNAMES)} {rng.choice(GIVEN_NAMES)}",
+        "email": f"user{customer_id}@example.com",
+        "phone": f"0{rng.randint(3, 9)}0-{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+        "address": f"{rng.choice(CITIES)}{chome}-{rng.randint(1, 30)}-{rng.randint(1, 20)}",
+    }
+
+
+def perturb(rng: random.Random, customer: dict) -> dict:
+    """表記ゆれ・タイプミスを含む重複行"""
+    row = dict(customer)
+    row.pop("id", None)
+    address = row["address"]
+
+    variant = rng.randint(0, 3)
+    if variant == 0:
+        # 丁目/番/号 表記 + 漢数字
+        city, numbers = address.rstrip("0123456789-"), address[len(address.rstrip("0123456789-")):]
+        chome, ban, go = numbers.split("-")
+        row["address"] = f"{city}{KANJI_NUMBERS[int(chome) - 1]}丁目{ban}番{go}号"
+    elif variant == 1:
+        # 全角数字
+        row["address"] = address.translate(str.maketrans("0123456789-", "０１２３４５６７８９－"))
+    elif variant == 2:
+        # 1文字タイプミス
+        pos = rng.randrange(len(address))
+        row["address"] = address[:pos] + "ノ" + address[pos + 1:]
+    else:
+        # 建物名の追加
+        row["address"] = address + " サンプルビル3F"
+
+    row["email"] = ""
+    row["phone"] = ""
+    return row
+
+
+def generate(num_customers: int, num_duplicates: int, seed: int = 42):
+    """(既存顧客リスト, 重複行リスト, 重複行の元顧客IDリスト) を返す"""
+    rng = random.Random(seed)
+    customers = [make_customer(rng, i + 1) for i in range(num_customers)]
+    sources = [rng.choice(customers) for _ in range(num_duplicates)]
+    rows = [perturb(rng, customer) for customer in sources]
+    return customers, rows, [customer["id"] for customer in sources]
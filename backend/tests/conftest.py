@@ -0,0 +1,62 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base, get_db, get_read_db
+
+
+@pytest.fixture(autouse=True)
+def upload_cache_dir(tmp_path, monkeypatch):
+    """解析済みアップロードのキャッシュはテストごとの一時ディレクトリに"""
+    from app import upload_cache
+    monkeypatch.setattr(upload_cache, "UPLOAD_CACHE_DIR", str(tmp_path / "upload-cache"))
+    return upload_cache.UPLOAD_CACHE_DIR
+
+
+@pytest.fixture
+def session_factory():
+    """SQLite（インメモリ）のセッションファクトリ"""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def sqlite_client(session_factory, monkeypatch):
+    """get_db とバックグラウンドタスク用の SessionLocal を SQLite に差し替えた TestClient"""
+    from app.main import app
+    from app import database
+    from app.routers import imports, s3_upload
+
+    def override_get_db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    for module in (database, imports, s3_upload):
+        monkeypatch.setattr(module, "SessionLocal", session_factory)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
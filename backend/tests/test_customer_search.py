@@ -0,0 +1,97 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, customer_search
+from app.customer_search import CustomerSearchIndex, search_customers
+
+
+def _customers(db):
+    crud.create_customer(db, "山田太郎", "taro.yamada@example.com", "03-1234-5678", "東京都千代田区丸の内1-2-3")
+    crud.create_customer(db, "山田花子", "hanako@example.jp", "090-1111-2222", "大阪府大阪市北区梅田3-1-5")
+    crud.create_customer(db, "佐藤次郎", "jiro@example.com", None, "東京都港区芝公園4-2-8")
+
+
+def test_customer_search_ranking_and_refresh(db, monkeypatch):
+    """前方一致・あいまい一致・電話番号で検索でき、更新は差分として反映されること"""
+    _customers(db)
+    index = CustomerSearchIndex()
+    index.build(db)
+    monkeypatch.setattr(customer_search, "customer_index", index)
+
+    result = search_customers(db, "やまだ")
+    assert result["results"] == []  # かなの読みは持っていない
+    result = search_customers(db, "山田")
+    assert [r["full_name"] for r in result["results"]] == ["山田太郎", "山田花子"]
+    assert result["results"][0]["matched_field"] == "full_name" and result["results"][0]["score"] == 0.95
+
+    assert search_customers(db, "TARO.YAMADA@")["results"][0]["matched_field"] == "email"
+    assert search_customers(db, "0311112222")["results"][0]["score"] < 0.9  # あいまい一致
+    assert search_customers(db, "090 1111 2222")["results"][0]["full_name"] == "山田花子"
+    # 1文字違い（あいまい一致）
+    fuzzy = search_customers(db, "千代田区丸の外1-2-3")["results"]
+    assert fuzzy[0]["full_name"] == "山田太郎" and fuzzy[0]["score"] < 0.9
+
+    page = search_customers(db, "example", offset=1, limit=1)
+    assert page["total"] == 3 and len(page["results"]) == 1
+
+    customer = crud.get_customer_by_email(db, "jiro@example.com")
+    crud.update_customer(db, customer.id, full_name="鈴木次郎")
+    assert index.refresh(db, force=True) >= 1
+    assert [r["full_name"] for r in search_customers(db, "鈴木")["results"]] == ["鈴木次郎"]
+    assert search_customers(db, "佐藤")["results"] == []
+
+    # 差分があふれたら作り直しはバックグラウンドに回す（検索リクエストでは待たない）
+    builds = []
+    monkeypatch.setattr(customer_search, "SEARCH_DELTA_MAX", 0)
+    monkeypatch.setattr(index, "start_build", lambda factory, **kwargs: builds.append(kwargs))
+    crud.update_customer(db, customer.id, full_name="鈴木三郎")
+    index.refresh(db, force=True)
+    assert builds == [{"rebuild": True}]
+    assert [r["full_name"] for r in search_customers(db, "鈴木")["results"]] == ["鈴木三郎"]
+
+
+def test_customer_search_endpoint(sqlite_client, session_factory, monkeypatch):
+    """GET /api/customers/search がインデックス作成前後で結果を返すこと"""
+    db = session_factory()
+    _customers(db)
+    db.close()
+    index = CustomerSearchIndex()
+    monkeypatch.setattr(customer_search, "customer_index", index)
+    from app.routers import customers
+    monkeypatch.setattr(customers, "customer_index", index)
+    monkeypatch.setattr(customers, "ensure_index", lambda factory: None)
+
+    response = sqlite_client.get("/api/customers/search", params={"q": "jiro@"})
+    assert response.status_code == 200
+    assert response.json()["index_ready"] is False
+    assert response.json()["results"][0]["email"] == "jiro@example.com"
+    # % _ は LIKE のワイルドカードとして扱わない
+    for q in ("_iro@", "%example", "j%"):
+        assert sqlite_client.get("/api/customers/search", params={"q": q}).json()["results"] == [], q
+
+    customer_search.ensure_index(session_factory, background=False)
+    assert index.ready
+    response = sqlite_client.get("/api/customers/search", params={"q": "梅田", "limit": 5})
+    assert response.json()["index_ready"] is True
+    assert response.json()["results"][0]["full_name"] == "山田花子"
+    assert sqlite_client.get("/api/customers/search", params={"q": ""}).status_code == 422
+
+
+def test_customer_search_keeps_exact_and_prefix_hits_beyond_candidate_limit(db, monkeypatch):
+    """候補数を超えるヒットでも完全一致・前方一致が上位に残り、total はページ送りできる件数になること"""
+    for i in range(12):
+        crud.create_customer(db, f"山田{i:02d}", f"user{i}@example.com", None, f"東京都山田町{i}")
+    exact = crud.create_customer(db, "山田", "yamada@example.com", None, None)
+    index = CustomerSearchIndex()
+    index.build(db)
+    monkeypatch.setattr(customer_search, "customer_index", index)
+    monkeypatch.setattr(customer_search, "SEARCH_CANDIDATES", 5)
+
+    ids, total = index.candidates("山田", limit=5)
+    assert ids[0] == exact.id and total == 13
+    result = search_customers(db, "山田", limit=3)
+    assert result["results"][0]["id"] == exact.id and result["results"][0]["score"] == 1.0
+    assert [r["score"] for r in result["results"][1:]] == [0.95, 0.95]
+    assert result["total"] == 5 and result["total_matches"] == 13 and result["truncated"] is True
+    assert len(search_customers(db, "山田", offset=3, limit=3)["results"]) == 2
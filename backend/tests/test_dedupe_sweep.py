@@ -0,0 +1,142 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, dedupe_sweep, models
+
+
+def _customers(db):
+    return [
+        crud.create_customer(db, "山田太郎", "taro1@example.com", None, "丸の内1-2-3"),
+        crud.create_customer(db, "佐藤花子", "hanako@example.com", None, "梅田2-2-2"),
+        crud.create_customer(db, "鈴木一郎", "ichiro@example.com", None, "札幌3-3-3"),
+        crud.create_customer(db, "山田 太郎", "taro2@example.com", None, "丸の内一丁目2番3号"),
+        crud.create_customer(db, "佐藤 花子", None, "090-1111-2222", "梅田二丁目2番2号"),
+        crud.create_customer(db, "山田　太郎", None, "03-1234-5678", "丸の内1丁目2-3"),
+    ]
+
+
+def test_sweep_resumes_from_checkpoint(session_factory, db, monkeypatch):
+    """失敗したシャードはチェックポイントから再開し、組を重複させずにクラスタにまとめること"""
+    monkeypatch.setattr(dedupe_sweep, "SessionLocal", session_factory)
+    taro, hanako, ichiro, taro2, hanako2, taro3 = _customers(db)
+    sweep = dedupe_sweep.create_sweep(db, shard_count=2)
+    sweep_id = sweep.id
+
+    # 2バッチ目で落ちる
+    original = dedupe_sweep._sweep_batch
+    calls = []
+
+    def flaky(*args):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("connection lost")
+        return original(*args)
+
+    monkeypatch.setattr(dedupe_sweep, "_sweep_batch", flaky)
+    dedupe_sweep.process_sweep_shard(sweep_id, 0, batch_size=1)
+    shard = db.query(models.DedupeSweepShard).filter_by(sweep_id=sweep_id, shard_no=0).one()
+    assert shard.status == models.ImportStatus.failed
+    assert shard.last_customer_id == taro.id and shard.scanned_count == 1
+
+    monkeypatch.setattr(dedupe_sweep, "_sweep_batch", original)
+    dedupe_sweep.run_sweep(sweep_id, max_workers=0)
+    db.expire_all()
+    sweep = db.get(models.DedupeSweep, sweep_id)
+    assert sweep.status == models.ImportStatus.completed
+
+    pairs = [(p.customer_id, p.other_customer_id) for p in db.query(models.DedupePair).filter_by(sweep_id=sweep_id)]
+    assert len(pairs) == len(set(pairs)) == sweep.pair_count
+    assert all(low < high for low, high in pairs)
+
+    clusters = {
+        frozenset(m.customer_id for m in db.query(models.DedupeClusterMember).filter_by(cluster_id=c.id))
+        for c in db.query(models.DedupeCluster).filter_by(sweep_id=sweep_id)
+    }
+    assert clusters == {frozenset({taro.id, taro2.id, taro3.id}), frozenset({hanako.id, hanako2.id})}
+    assert sweep.cluster_count == 2
+
+
+def test_sweep_api(sqlite_client, session_factory, db, monkeypatch):
+    """API で開始したスイープの進捗とクラスタを取得できること"""
+    monkeypatch.setattr(dedupe_sweep, "SessionLocal", session_factory)
+    monkeypatch.setattr(dedupe_sweep, "DEDUPE_WORKERS", 0)
+    _customers(db)
+
+    response = sqlite_client.post("/api/dedupe/sweeps", json={"shards": 3})
+    assert response.status_code == 202
+    sweep_id = response.json()["id"]
+
+    body = sqlite_client.get(f"/api/dedupe/sweeps/{sweep_id}").json()
+    assert body["status"] == "completed"
+    assert body["scanned_customers"] == 6 and len(body["shards"]) == 3
+
+    body = sqlite_client.get(f"/api/dedupe/sweeps/{sweep_id}/clusters", params={"limit": 1}).json()
+    assert body["total"] == 2 and body["next_offset"] == 1
+    assert body["clusters"][0]["resolution"] == "pending"
+    assert len(body["clusters"][0]["customers"]) == body["clusters"][0]["size"]
+
+    assert sqlite_client.post(f"/api/dedupe/sweeps/{sweep_id}/resume").status_code == 409
+
+
+def test_sweep_api_rejects_invalid_match_config(sqlite_client):
+    """範囲外・型違いのマッチング設定や未登録のルール名は 422 で弾くこと"""
+    for match_config in (
+        {"threshold": "high"},
+        {"threshold": 1.5},
+        {"address_penalty": -0.1},
+        {"top_k": 0},
+        {"disabled": "canonical_name"},
+        {"disabled": ["no_such_rule"]},
+    ):
+        response = sqlite_client.post("/api/dedupe/sweeps", json={"shards": 1, "match_config": match_config})
+        assert response.status_code == 422, match_config
+        response = sqlite_client.post("/api/s3-upload/import-from-s3", json={"s3_key": "uploads/a.csv", "match_config": match_config})
+        assert response.status_code == 422, match_config
+
+
+def test_sweep_resume_leaves_processing_shards_alone(sqlite_client, session_factory, db, monkeypatch):
+    """処理中のシャードがある間は resume が 409 になり、処理中のシャードを二重に取らないこと"""
+    import pytest
+    from sqlalchemy.exc import IntegrityError
+
+    monkeypatch.setattr(dedupe_sweep, "SessionLocal", session_factory)
+    monkeypatch.setattr(dedupe_sweep, "DEDUPE_WORKERS", 0)
+    _customers(db)
+    sweep_id = dedupe_sweep.create_sweep(db, shard_count=2).id
+    shard = db.query(models.DedupeSweepShard).filter_by(sweep_id=sweep_id, shard_no=0).one()
+    shard.status = models.ImportStatus.processing  # 別のワーカーが処理中
+    db.commit()
+
+    assert sqlite_client.post(f"/api/dedupe/sweeps/{sweep_id}/resume").status_code == 409
+    dedupe_sweep.process_sweep_shard(sweep_id, 0)
+    dedupe_sweep.run_sweep(sweep_id, max_workers=0)
+    db.expire_all()
+    assert shard.status == models.ImportStatus.processing and shard.scanned_count == 0
+    assert db.get(models.DedupeSweep, sweep_id).status == models.ImportStatus.processing
+
+    # ワーカーが落ちた後は force で取り直せる
+    dedupe_sweep.run_sweep(sweep_id, max_workers=0, force=True)
+    db.expire_all()
+    assert db.get(models.DedupeSweep, sweep_id).status == models.ImportStatus.completed
+
+    pair = db.query(models.DedupePair).filter_by(sweep_id=sweep_id).first()
+    db.add(models.DedupePair(sweep_id=sweep_id, customer_id=pair.customer_id, other_customer_id=pair.other_customer_id))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+
+def test_sweep_keeps_pairs_found_only_from_higher_id(session_factory, db, monkeypatch):
+    """決定的な一致で打ち切られて大きい ID の側からしか見えない組も残すこと"""
+    monkeypatch.setattr(dedupe_sweep, "SessionLocal", session_factory)
+    a = crud.create_customer(db, "田中太郎", "a@example.com", "090-1234-5678", None)
+    b = crud.create_customer(db, "田中太郎", "b@example.com", None, None)
+    c = crud.create_customer(db, "山田次郎", "c@example.com", "090-1234-5678", None)
+    sweep_id = dedupe_sweep.create_sweep(db, shard_count=2).id
+    dedupe_sweep.run_sweep(sweep_id, max_workers=0)
+
+    db.expire_all()
+    pairs = sorted((p.customer_id, p.other_customer_id) for p in db.query(models.DedupePair).filter_by(sweep_id=sweep_id))
+    assert (a.id, b.id) in pairs and (a.id, c.id) in pairs
+    assert len(pairs) == len(set(pairs)) == db.get(models.DedupeSweep, sweep_id).pair_count
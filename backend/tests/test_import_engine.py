@@ -0,0 +1,116 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.address_lsh import AddressLSH
+from app.canonicalize import canonical_address, canonical_name, canonical_phone
+from app.import_engine import build_match_index, find_duplicate_candidates
+
+
+def test_canonical_name_folds_width_and_kana():
+    """全角/半角・ひらがな/カタカナ・敬称の揺れが同じキーになること"""
+    assert canonical_name("ﾔﾏﾀﾞ ﾀﾛｳ") == canonical_name("やまだ　たろう 様")
+    assert canonical_name("ＹＡＭＡＤＡ Taro") == "yamadataro"
+
+
+def test_canonical_address_numbers():
+    """漢数字・丁目/番地/号の揺れが同じキーになること"""
+    expected = "東京都千代田区丸の内1-2-3"
+    assert canonical_address("東京都千代田区丸の内一丁目2番3号") == expected
+    assert canonical_address("東京都千代田区丸の内１－２－３") == expected
+
+
+def test_canonical_phone_e164():
+    """国内/国際形式の電話番号がE.164になること"""
+    assert canonical_phone("03-1234-5678") == "+81312345678"
+    assert canonical_phone("０９０（１２３４）５６７８") == "+819012345678"
+    assert canonical_phone("+81 (0)3 1234 5678") == "+81312345678"
+
+
+def test_find_duplicate_candidates_canonical_hits():
+    """正規化キーの完全一致が候補として返ること"""
+    customers = [
+        {"id": 1, "full_name": "山田太郎", "email": "Taro@Example.com", "phone": "03-1234-5678", "address": "丸の内一丁目2番3号"},
+        {"id": 2, "full_name": "ヤマダ ハナコ", "email": None, "phone": None, "address": "丸の内1-2-3"},
+    ]
+    index = build_match_index(customers)
+
+    result = find_duplicate_candidates({"email": "taro@example.com"}, customers, index=index)
+    assert result[0]["customer_id"] == 1
+
+    result = find_duplicate_candidates({"phone": "+81312345678"}, customers, index=index)
+    assert result[0]["customer_id"] == 1
+
+    result = find_duplicate_candidates(
+        {"full_name": "やまだ はなこ", "address": "丸の内１－２－３"}, customers, index=index
+    )
+    assert result[0]["customer_id"] == 2
+    assert result[0]["similarity_score"] == 1.0
+
+
+def test_address_lsh_candidates():
+    """名前が異なっても住所LSHで類似住所の顧客が候補になること"""
+    customers = [
+        {"id": 1, "full_name": "山田太郎", "address": "東京都千代田区丸の内1-2-3"},
+        {"id": 2, "full_name": "佐藤花子", "address": "大阪府大阪市北区梅田3-1-5"},
+    ]
+    address_index = AddressLSH()
+    address_index.add_many(customers)
+    assert 1 in address_index.query("東京都千代田区丸の内一丁目2番3号")
+
+    result = find_duplicate_candidates(
+        {"full_name": "鈴木一郎", "address": "東京都千代田区丸ノ内1-2-3"},
+        customers, address_index=address_index
+    )
+    assert [c["customer_id"] for c in result] == [1]
+    assert "住所類似" in result[0]["match_reason"]
+
+
+def test_batch_similarity_matches_scalar():
+    """NumPy の一括計算が similarity_score と完全に一致すること"""
+    import random
+    from app.import_engine import batch_similarity_scores, similarity_score
+
+    rng = random.Random(0)
+    alphabet = "やまだたろうヤマダタロウ山田太郎花子abc "
+    candidates = ["", "山田太郎"] + [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(300)
+    ]
+    for query in ["", "山田太郎", "やまだはなこ", "abcabcabcabcabcabc"]:
+        batch = batch_similarity_scores(query, candidates).tolist()
+        assert batch == [similarity_score(query, candidate) for candidate in candidates]
+
+
+def test_matcher_cascade_config_and_stats():
+    """ルールはコスト順に実行され、決定的な一致で打ち切り・設定と集計がインポート単位で効くこと"""
+    from app.matchers import MatchConfig, MatchStats, registered_matchers
+
+    costs = [matcher.cost for matcher in registered_matchers()]
+    assert costs == sorted(costs)
+
+    customers = [
+        {"id": i, "full_name": f"山田太郎{'x' * i}", "email": f"u{i}@example.com", "address": ""}
+        for i in range(1, 8)
+    ]
+    index = build_match_index(customers)
+
+    stats = MatchStats()
+    result = find_duplicate_candidates({"email": "u3@example.com", "full_name": "山田太郎"},
+                                       customers, index=index, stats=stats)
+    assert [c["customer_id"] for c in result] == [3]
+    assert list(stats.to_dict()) == ["email_exact"]
+    assert stats.to_dict()["email_exact"]["decisive"] == 1
+
+    stats = MatchStats()
+    new_row = {"full_name": "山田太郎xx"}
+    assert len(find_duplicate_candidates(new_row, customers, index=index, stats=stats)) == 1
+    loose = MatchConfig(threshold=0.5, top_k=3)
+    result = find_duplicate_candidates(new_row, customers, index=index, config=loose, stats=stats)
+    assert [c["customer_id"] for c in result] == [2]  # 正規化氏名の完全一致で打ち切り
+
+    loose.disabled = ["canonical_name"]
+    result = find_duplicate_candidates(new_row, customers, index=index, config=loose, stats=stats)
+    assert len(result) == 3 and result[0]["customer_id"] == 2
+    assert stats.to_dict()["canonical_name"]["decisive"] == 2
+    assert stats.to_dict()["name_edit_distance"]["calls"] == 1
+    assert MatchConfig.from_dict({"threshold": 0.9, "unknown": 1}).threshold == 0.9
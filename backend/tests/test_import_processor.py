@@ -0,0 +1,644 @@
+import hashlib
+import json
+from sqlalchemy import inspect
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, models, import_processor
+from app.import_processor import process_import_job
+from app.routers import imports
+
+MAPPING = {"full_name": "氏名", "email": "メール", "phone": "電話", "address": "住所"}
+
+
+def test_customer_match_keys_are_maintained(db):
+    """顧客の作成・更新でマッチキーが更新されること"""
+    customer = crud.create_customer(db, "ﾔﾏﾀﾞ ﾀﾛｳ", None, "03-1234-5678", "丸の内一丁目2番3号")
+    assert customer.name_key == "ヤマダタロウ"
+    assert customer.phone_key == "+81312345678"
+    assert customer.address_key == "丸の内1-2"
+
+    crud.update_customer(db, customer.id, phone="090-1111-2222")
+    assert customer.phone_key == "+819011112222"
+
+
+def test_process_import_job_uses_match_keys(db):
+    """マッチキーで取得した既存顧客に対して更新・候補・新規作成が行われること"""
+    crud.create_customer(db, "山田太郎", "taro@example.com", "03-1234-5678", "丸の内1-2-3")
+    crud.create_customer(db, "ヤマダ ハナコ", None, None, "丸の内1-2-3")
+    db_import = crud.create_import(db, "test.csv")
+
+    rows = [
+        {"氏名": "山田 太郎", "メール": "TARO@example.com", "電話": "", "住所": ""},
+        {"氏名": "佐藤次郎", "メール": "", "電話": "０３－１２３４－５６７８", "住所": ""},
+        {"氏名": "やまだ はなこ", "メール": "", "電話": "", "住所": "丸の内一丁目2番3号"},
+        {"氏名": "鈴木一郎", "メール": "ichiro@example.com", "電話": "", "住所": ""},
+        {"氏名": "不正", "メール": "not-an-email", "電話": "", "住所": ""},
+    ]
+    process_import_job(db_import.id, MAPPING, rows, db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert db_import.total_rows == 5
+    assert db_import.inserted_count == 3
+    assert db_import.candidate_count == 1
+    assert db_import.error_count == 1
+    assert crud.get_customer_by_email(db, "ichiro@example.com") is not None
+    assert db_import.metrics["value_dictionary"]["columns"]["address"]["hits"] == 3
+    assert "canonical_name" in db_import.metrics["matchers"]
+
+
+def test_customers_import_async_job(sqlite_client, db, monkeypatch):
+    """上限を超える件数はジョブとして受け付け、結果をページングで取得できること"""
+    monkeypatch.setattr(imports, "CUSTOMERS_IMPORT_SYNC_LIMIT", 2)
+    crud.create_customer(db, "山田太郎", "taro@example.com", None, None)
+
+    customers = [
+        {"full_name": "山田 太郎", "email": "", "phone": "", "address_line1": ""},
+        {"full_name": "佐藤花子", "email": "hanako@example.com", "phone": "", "address_line1": ""},
+        {"full_name": "鈴木一郎", "email": "ichiro@example.com", "phone": "", "address_line1": ""},
+    ]
+    response = sqlite_client.post("/api/customers/import", json={"customers": customers})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    response = sqlite_client.get(f"/api/customers/import/jobs/{job_id}", params={"limit": 2})
+    body = response.json()
+    assert body["status"] == "completed"
+    assert body["processed_rows"] == 3
+    assert body["next_offset"] == 2
+    assert len(body["candidates"][0]["candidates"]) == 1
+    assert body["candidates"][1]["candidates"] == []
+
+    response = sqlite_client.get(f"/api/customers/import/jobs/{job_id}", params={"offset": 2})
+    assert response.json()["next_offset"] is None
+    assert response.json()["candidates"][0]["rowIndex"] == 2
+
+
+def test_customer_batch_matches_within_batch_and_isolates_errors(db):
+    """同じバッチで作成した顧客は後の行の候補になり、DBエラーの行だけ error になること"""
+    from sqlalchemy import text
+
+    db.execute(text(
+        "CREATE TRIGGER reject_customer BEFORE INSERT ON customers WHEN NEW.full_name = '拒否' "
+        "BEGIN SELECT RAISE(ABORT, 'customer rejected'); END"
+    ))
+    db.commit()
+    db_import = crud.create_import(db, "customers-import.json")
+    customers = [
+        {"full_name": "佐藤花子", "email": "hanako@example.com", "phone": "", "address_line1": ""},
+        {"full_name": "佐藤 花子", "email": "Hanako@Example.com", "phone": "", "address_line1": ""},
+        {"full_name": "拒否", "email": "reject@example.com", "phone": "", "address_line1": ""},
+        {"full_name": "鈴木一郎", "email": "ichiro@example.com", "phone": "", "address_line1": ""},
+    ]
+    import_processor.process_customer_import_job(db_import.id, customers, db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert (db_import.inserted_count, db_import.candidate_count, db_import.error_count) == (2, 1, 1)
+    hanako = crud.get_customer_by_email(db, "hanako@example.com")
+    assert db.query(models.Customer).count() == 2
+    import_rows = {row.row_index: row for row in crud.get_import_rows(db, db_import.id)}
+    assert [c.existing_customer_id for c in crud.get_candidates_by_row_ids(db, [import_rows[1].id])] == [hanako.id]
+    assert import_rows[2].status == models.RowStatus.error
+    assert import_rows[2].validation_errors == ["database: customer rejected"]
+    assert crud.get_customer_by_email(db, "ichiro@example.com") is not None
+
+
+def test_customers_import_ndjson_stream(sqlite_client, db):
+    """NDJSON の入力を行ごとに処理し、結果を1行ずつ返すこと"""
+    crud.create_customer(db, "山田太郎", "taro@example.com", None, None)
+
+    body = "\n".join([
+        '{"full_name": "山田 太郎", "email": ""}',
+        '{"full_name": "佐藤花子", "email": "hanako@example.com"}',
+        '{broken',
+        '{"full_name": "鈴木一郎", "email": "ichiro@example.com"}',
+    ]) + "\n"
+    response = sqlite_client.post(
+        "/api/customers/import", content=body.encode("utf-8"),
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["rowIndex"] for line in lines] == [0, 1, 2, 3]
+    assert len(lines[0]["candidates"]) == 1
+    assert lines[1]["candidates"] == []
+    assert "error" in lines[2]
+    assert crud.get_customer_by_email(db, "ichiro@example.com") is not None
+
+
+def test_customers_import_ndjson_stream_reports_failed_batch(sqlite_client, db, monkeypatch):
+    """バッチの処理が例外になってもストリームを切らず、そのバッチの行をエラーとして返して続けること"""
+    monkeypatch.setattr(imports, "NDJSON_BATCH_SIZE", 2)
+    calls = []
+
+    def flaky_batch(session, batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("connection lost")
+        return import_processor.match_customer_batch(session, batch)
+
+    monkeypatch.setattr(imports, "match_customer_batch", flaky_batch)
+    body = "\n".join(
+        json.dumps({"full_name": name, "email": f"user{i}@example.com"})
+        for i, name in enumerate(["佐藤花子", "鈴木一郎", "高橋健"])
+    ) + "\n"
+    response = sqlite_client.post(
+        "/api/customers/import", content=body.encode("utf-8"),
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["rowIndex"] for line in lines] == [0, 1, 2]
+    assert "connection lost" in lines[0]["error"] and "connection lost" in lines[1]["error"]
+    assert lines[2]["candidates"] == []
+    assert crud.get_customer_by_email(db, "user2@example.com") is not None
+
+
+def test_export_import_rows(sqlite_client, db):
+    """エラー行を生データ・エラー内容付きでエクスポートできること"""
+    db_import = crud.create_import(db, "test.csv")
+    rows = [
+        {"氏名": "鈴木一郎", "メール": "ichiro@example.com", "電話": "", "住所": ""},
+        {"氏名": "不正", "メール": "not-an-email", "電話": "", "住所": ""},
+    ]
+    process_import_job(db_import.id, MAPPING, rows, db)
+
+    response = sqlite_client.get(
+        f"/api/imports/{db_import.id}/rows/export", params={"status": "error", "format": "csv"}
+    )
+    assert response.status_code == 200
+    lines = response.content.decode("utf-8-sig").splitlines()
+    assert lines[0] == "row_index,status,validation_errors,氏名,メール,電話,住所"
+    assert lines[1].startswith("1,error,email: ")
+    assert len(lines) == 2
+
+    response = sqlite_client.get(
+        f"/api/imports/{db_import.id}/rows/export", params={"format": "ndjson"}
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["status"] for line in lines] == ["inserted", "error"]
+    assert lines[1]["raw_data"]["メール"] == "not-an-email"
+
+    response = sqlite_client.get(
+        f"/api/imports/{db_import.id}/rows/export", params={"format": "xlsx"}
+    )
+    assert response.content[:2] == b"PK"
+
+
+class FakeS3:
+    """同じ内容を返す S3 のスタブ"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.downloads = 0
+
+    def get_trusted_etag(self, s3_key):
+        return None
+
+    def get_object_etag(self, s3_key):
+        return hashlib.md5(self.content).hexdigest() + "-2"
+
+    def get_object_size(self, s3_key):
+        return len(self.content)
+
+    def download_file_with_hash(self, s3_key):
+        self.downloads += 1
+        return self.content, hashlib.sha256(self.content).hexdigest()
+
+
+class FakeS3Bucket(FakeS3):
+    """アップロードされたオブジェクトも保持する S3 のスタブ（シャードの入力用）"""
+
+    def __init__(self, content: bytes):
+        super().__init__(content)
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, s3_key, content_type=None):
+        self.objects[s3_key] = fileobj.read()
+        return True
+
+    def download_file(self, s3_key):
+        return self.objects.get(s3_key)
+
+    def delete_file(self, s3_key):
+        return self.objects.pop(s3_key, None) is not None
+
+
+def test_reupload_replays_previous_import(db, monkeypatch):
+    """同じ内容・同じマッピングで顧客に変更がなければ前回の結果を再利用すること"""
+    fake_s3 = FakeS3("氏名,メール,電話,住所\n鈴木一郎,ichiro@example.com,,\n".encode("utf-8"))
+    monkeypatch.setattr(import_processor, "s3_service", fake_s3)
+
+    first = crud.create_import(db, "a.csv", s3_key="uploads/a.csv")
+    process_import_job(first.id, MAPPING, [], db)
+    second = crud.create_import(db, "b.csv", s3_key="uploads/b.csv")
+    process_import_job(second.id, MAPPING, [], db)
+
+    db.refresh(second)
+    assert second.status == models.ImportStatus.completed
+    assert second.replayed_from_id == first.id
+    assert second.inserted_count == 1
+    assert crud.get_import_rows(db, second.id) == []
+
+    # 顧客が変わったら再処理（取り込み済みの同一行は短絡して inserted）
+    crud.create_customer(db, "別人", "other@example.com", None, None)
+    third = crud.create_import(db, "c.csv", s3_key="uploads/c.csv")
+    process_import_job(third.id, MAPPING, [], db)
+
+    db.refresh(third)
+    assert third.replayed_from_id is None
+    assert third.inserted_count == 1
+    assert [row.status for row in crud.get_import_rows(db, third.id)] == [models.RowStatus.inserted]
+
+
+def test_sharded_import_partitions_by_key(db, session_factory, monkeypatch):
+    """同じ email/電話番号の行は同じシャードに入り、全シャード完了後に件数が集計されること"""
+    from app import sharded_import
+    from app.sharded_import import shard_for_row, process_import_shard
+
+    same_email = [{"メール": "Taro@Example.com"}, {"メール": "taro@example.com "}]
+    assert len({shard_for_row(row, MAPPING, 4, idx) for idx, row in enumerate(same_email)}) == 1
+    same_phone = [{"電話": "03-1234-5678"}, {"電話": "+81 3 1234 5678"}]
+    assert len({shard_for_row(row, MAPPING, 4, idx) for idx, row in enumerate(same_phone)}) == 1
+
+    names = ["山田太郎", "佐藤花子", "鈴木一郎", "高橋健", "田中美咲", "伊藤誠", "渡辺薫", "中村翼"]
+    content = "氏名,メール,電話,住所\n" + "".join(
+        f"{name},user{i}@example.com,,\n" for i, name in enumerate(names)
+    ) + "山田 太郎,USER0@example.com,,\n"
+    fake_s3 = FakeS3Bucket(content.encode("utf-8"))
+    monkeypatch.setattr(sharded_import, "s3_service", fake_s3)
+    monkeypatch.setattr(sharded_import, "SessionLocal", session_factory)
+
+    db_import = crud.create_import(db, "big.csv", s3_key="uploads/big.csv")
+    crud.create_import_shards(db, db_import.id, 3)
+    # ファイルは1回だけ読んで振り分け、各シャードは自分の入力だけを読む
+    assert sum(sharded_import.partition_import(db, db_import.id, 3, MAPPING)) == 9
+    assert fake_s3.downloads == 1
+    for shard_no in range(3):
+        process_import_shard(db_import.id, shard_no, 3, MAPPING)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert db_import.total_rows == 9
+    assert db_import.inserted_count == 9
+    assert fake_s3.downloads == 1 and fake_s3.objects == {}
+    assert db.query(models.Customer).count() == 8
+    import_rows = sorted(crud.get_import_rows(db, db_import.id), key=lambda row: row.row_index)
+    assert [row.row_index for row in import_rows] == list(range(9))
+    # raw_data は振り分け前（ファイルを直接読んだ行）と同じ
+    parsed = import_processor.read_rows("big.csv", content.encode("utf-8"))
+    assert [row.raw_data for row in import_rows] == [import_processor.row_raw_data(row) for row in parsed]
+
+    # 同じファイルの振り分けのやり直しは解析済みキャッシュから読む（ダウンロードしない）
+    assert sum(sharded_import.partition_import(db, db_import.id, 3, MAPPING)) == 9
+    assert fake_s3.downloads == 1
+    shard_rows = sorted(
+        (row for shard_no in range(3) for row in sharded_import.read_shard_input(db_import.id, shard_no)),
+        key=lambda item: item[0]
+    )
+    assert [row.raw_data for _, row in shard_rows] == [row.raw_data for row in import_rows]
+    assert list(shard_rows[0][1].layout.columns) == ["氏名", "メール", "電話", "住所"]
+
+
+def test_upsert_customers_keeps_existing_values_for_empty_fields(db):
+    """email 完全一致はまとめて upsert され、空の項目は既存値を残すこと"""
+    taro = crud.create_customer(db, "山田太郎", "taro@example.com", "03-1234-5678", "丸の内1-2-3")
+    outcomes = crud.upsert_customers(db, [
+        {"email": "taro@example.com", "full_name": "", "phone": "090-1111-2222", "address": "梅田3-1-5"},
+        {"email": "new@example.com", "full_name": "新規", "phone": "", "address": ""},
+    ])
+    assert outcomes == ["updated", "inserted"]
+
+    db.refresh(taro)
+    assert taro.full_name == "山田太郎"
+    assert taro.name_key == "山田太郎"
+    assert taro.phone_key == "+819011112222"
+    assert taro.address_key == "梅田3-1"
+    bands = db.query(models.CustomerAddressBand).filter_by(customer_id=taro.id).count()
+    assert bands == 20
+
+    db_import = crud.create_import(db, "test.csv")
+    rows = [{"氏名": "山田 太郎", "メール": "TARO@example.com", "電話": "", "住所": ""}]
+    process_import_job(db_import.id, MAPPING, rows, db)
+    db.refresh(db_import)
+    assert db_import.inserted_count == 1
+    assert crud.get_customer_by_email(db, "new@example.com").full_name == "新規"
+    db.refresh(taro)
+    assert taro.full_name == "山田 太郎"
+    assert taro.phone == "090-1111-2222"
+
+
+def test_import_records_upsert_outcomes(db):
+    """email の一致行と新しい email の候補なし行は upsert され、行ごとの新規 / 更新が metrics に残ること"""
+    crud.create_customer(db, "山田太郎", "taro@example.com", None, None)
+    db_import = crud.create_import(db, "test.csv")
+    process_import_job(db_import.id, MAPPING, [
+        {"氏名": "山田太郎", "メール": "taro@example.com", "電話": "090-1111-2222", "住所": ""},
+        {"氏名": "佐藤花子", "メール": "hanako@example.com", "電話": "", "住所": "札幌1-1-1"},
+        {"氏名": "佐藤花子", "メール": "hanako@example.com", "電話": "03-1234-5678", "住所": ""},
+        {"氏名": "鈴木一郎", "メール": "", "電話": "", "住所": ""},
+    ], db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert db_import.inserted_count == 4
+    assert db_import.metrics["upsert"] == {"inserted": 1, "updated": 2}
+    hanako = crud.get_customer_by_email(db, "hanako@example.com")
+    assert (hanako.address, hanako.phone) == ("札幌1-1-1", "03-1234-5678")
+    assert hanako.name_key and db.query(models.CustomerAddressBand).filter_by(customer_id=hanako.id).count() > 0
+    assert crud.get_customer_by_email(db, "taro@example.com").phone == "090-1111-2222"
+    assert db.query(models.Customer).count() == 3
+
+
+def test_staging_import_matches_in_sql(db, monkeypatch):
+    """ステージング経由でも完全一致は更新、残りは類似度判定・新規作成になること"""
+    from app import staging_import
+    monkeypatch.setattr(staging_import, "STAGING_IMPORT_MIN_ROWS", 1)
+
+    taro = crud.create_customer(db, "山田太郎", "taro@example.com", "03-1234-5678", "丸の内1-2-3")
+    hanako = crud.create_customer(db, "佐藤花子", None, "06-1111-2222", None)
+    db_import = crud.create_import(db, "test.csv")
+
+    rows = [
+        {"氏名": "", "メール": "TARO@example.com", "電話": "090-1111-2222", "住所": ""},
+        {"氏名": "佐藤 花子", "メール": "", "電話": "０６－１１１１－２２２２", "住所": "梅田3-1-5"},
+        {"氏名": "山田 太郎", "メール": "", "電話": "", "住所": ""},
+        {"氏名": "鈴木一郎", "メール": "ichiro@example.com", "電話": "", "住所": ""},
+        {"氏名": "不正", "メール": "not-an-email", "電話": "", "住所": ""},
+    ]
+    process_import_job(db_import.id, MAPPING, rows, db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert (db_import.inserted_count, db_import.candidate_count, db_import.error_count) == (3, 1, 1)
+    assert sorted(row.row_index for row in crud.get_import_rows(db, db_import.id)) == [0, 1, 2, 3, 4]
+
+    db.refresh(taro)
+    db.refresh(hanako)
+    assert (taro.full_name, taro.phone_key) == ("山田太郎", "+819011112222")
+    assert (hanako.full_name, hanako.address_key) == ("佐藤 花子", "梅田3-1")
+    assert db.query(models.CustomerAddressBand).filter_by(customer_id=hanako.id).count() == 20
+    assert crud.get_customer_by_email(db, "ichiro@example.com") is not None
+    assert not inspect(db.get_bind()).has_table(f"import_staging_{db_import.id}")
+
+
+def test_source_rows_match_dict_rows():
+    """SourceRow は to_dict('records') の dict と同じ結果でマッピング・正規化されること"""
+    from app.import_processor import prepare_row, read_rows
+    from app.records import SourceRow
+
+    content = "氏名,メール,電話,住所,備考\n山田太郎,Taro@Example.com,03-1234-5678,,VIP\n".encode("utf-8")
+    rows = read_rows("a.csv", content)
+    assert len(rows) == 1 and isinstance(rows[0], SourceRow)
+
+    row = rows[0]
+    as_dict = {"氏名": "山田太郎", "メール": "Taro@Example.com", "電話": "03-1234-5678", "住所": None, "備考": "VIP"}
+    assert dict(row) == as_dict
+    assert row.get("存在しない列") is None and "備考" in row
+    assert prepare_row(row, MAPPING) == prepare_row(as_dict, MAPPING)
+
+
+def test_value_dictionary_matches_prepare_row(monkeypatch):
+    """列ごとの辞書エンコーディングが prepare_row と同じ結果になり、繰り返しの値はヒットすること"""
+    from app import value_dictionary
+    from app.import_processor import new_value_dictionary, prepare_row, prepare_rows, read_rows
+
+    lines = ["氏名,メール,電話,住所"] + [
+        f"顧客{i},user{i}@example.com,03-1234-{i:04d},{'東京都' if i % 2 else '大阪府'}" for i in range(40)
+    ] + ["顧客x,not-an-email,,東京都", "顧客y,,,"]
+    rows = read_rows("a.csv", "\n".join(lines).encode("utf-8"))
+    dictionary = new_value_dictionary()
+    assert prepare_rows(list(rows), MAPPING, dictionary) == [prepare_row(row, MAPPING) for row in rows]
+    assert prepare_rows(list(rows)[-2:], MAPPING, dictionary)[0][3] == ["email: メールアドレスの形式が不正です"]
+
+    stats = dictionary.stats()
+    assert stats["columns"]["address"]["distinct"] == 3
+    assert stats["columns"]["address"]["hit_rate"] > 0.9
+
+    # ほぼ一意の列は表を捨てて直接計算する
+    monkeypatch.setattr(value_dictionary, "DICTIONARY_PROBE_VALUES", 10)
+    column = value_dictionary.ColumnDictionary("email", "email")
+    assert column.encode([f"u{i}@example.com" for i in range(20)])[0] == ("u0@example.com", "")
+    assert not column.enabled and column.stats()["distinct"] == 0
+
+
+def test_similarity_memo_reuses_pairs():
+    """類似度メモは similarity_scores と同じ値を返し、同じ組は再計算しないこと"""
+    from app.import_engine import SimilarityMemo, similarity_scores
+
+    memo = SimilarityMemo(max_entries=3)
+    names = ["やまだたろう", "やまだはなこ", "さとうじろう"]
+    assert memo.scores("やまだたろう", names) == similarity_scores("やまだたろう", names)
+    assert memo.scores("やまだはなこ", ["やまだたろう"]) == similarity_scores("やまだはなこ", ["やまだたろう"])
+    assert memo.stats()["hits"] == 1 and memo.stats()["entries"] == 3
+    memo.scores("すずき", ["やまだ"])
+    assert memo.stats()["entries"] == 3
+
+
+def test_failing_row_is_isolated_in_chunk_transaction(db, monkeypatch):
+    """DBエラーの行だけ error 行になり、同じチャンクの他の行は保存されること（コミットはチャンク単位）"""
+    from sqlalchemy import event, text
+
+    crud.create_customer(db, "山田太郎", "taro@example.com", None, None)
+    db.execute(text(
+        "CREATE TRIGGER reject_customer BEFORE INSERT ON customers WHEN NEW.full_name = '拒否' "
+        "BEGIN SELECT RAISE(ABORT, 'customer rejected'); END"
+    ))
+    db.commit()
+    db_import = crud.create_import(db, "test.csv")
+    rows = [
+        {"氏名": "鈴木一郎", "メール": "ichiro@example.com", "電話": "", "住所": ""},
+        {"氏名": "拒否", "メール": "reject@example.com", "電話": "", "住所": ""},
+        {"氏名": "山田 太郎", "メール": "taro@example.com", "電話": "090-1111-2222", "住所": ""},
+        {"氏名": "高橋健", "メール": "ken@example.com", "電話": "", "住所": ""},
+    ] + [
+        {"氏名": f"顧客{i}", "メール": f"user{i}@example.com", "電話": "", "住所": ""} for i in range(16)
+    ]
+
+    commits = []
+    event.listen(db.get_bind(), "commit", lambda connection: commits.append(1))
+    process_import_job(db_import.id, MAPPING, rows, db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert (db_import.inserted_count, db_import.error_count) == (19, 1)
+    import_rows = {row.row_index: row for row in crud.get_import_rows(db, db_import.id)}
+    assert len(import_rows) == 20
+    assert import_rows[1].status == models.RowStatus.error
+    assert import_rows[1].validation_errors == ["database: customer rejected"]
+    assert crud.get_customer_by_email(db, "reject@example.com") is None
+    assert crud.get_customer_by_email(db, "ken@example.com") is not None
+    assert crud.get_customer_by_email(db, "taro@example.com").phone == "090-1111-2222"
+    # 行ごとではなくチャンク単位（失敗したチャンクのやり直しを含めても行数よりずっと少ない）
+    assert len(commits) < 10
+
+
+def test_import_chunks_see_previous_chunks(db, monkeypatch):
+    """後のチャンクが前のチャンクで作成した顧客を照合に使うこと"""
+    monkeypatch.setattr(import_processor, "MATCH_CHUNK_SIZE", 2)
+    db_import = crud.create_import(db, "test.csv")
+    rows = [
+        {"氏名": "鈴木一郎", "メール": "ichiro@example.com", "電話": "", "住所": ""},
+        {"氏名": "佐藤花子", "メール": "hanako@example.com", "電話": "", "住所": "梅田2-2-2"},
+        {"氏名": "鈴木一郎", "メール": "ICHIRO@example.com", "電話": "090-1111-2222", "住所": ""},
+        {"氏名": "不正", "メール": "not-an-email", "電話": "", "住所": ""},
+        {"氏名": "佐藤 花子", "メール": "", "電話": "", "住所": "梅田二丁目2番2号"},
+    ]
+    process_import_job(db_import.id, MAPPING, rows, db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.completed
+    assert (db_import.inserted_count, db_import.error_count, db_import.candidate_count) == (3, 1, 1)
+    assert db.query(models.Customer).count() == 2
+    assert crud.get_customer_by_email(db, "ichiro@example.com").phone == "090-1111-2222"
+    assert [row.row_index for row in crud.get_import_rows(db, db_import.id)] == [0, 1, 2, 3, 4]
+
+
+def test_import_normalize_failure_marks_job_failed(db, monkeypatch):
+    """正規化の失敗でジョブが failed になること"""
+    monkeypatch.setattr(import_processor, "MATCH_CHUNK_SIZE", 1)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("normalize failed")
+
+    monkeypatch.setattr(import_processor, "prepare_rows", broken)
+    db_import = crud.create_import(db, "test.csv")
+    process_import_job(db_import.id, MAPPING, [{"氏名": "鈴木一郎", "メール": "", "電話": "", "住所": ""}], db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.failed
+    assert db_import.error_message == "normalize failed"
+
+
+class StreamingBody:
+    """S3 のレスポンスのスタブ（1回の read は最大 4KB。fail_at バイト目以降を読むと失敗する）"""
+
+    def __init__(self, content: bytes, fail_at: int = None):
+        self.content = content
+        self.fail_at = fail_at
+        self.served = 0
+        self.closed = False
+
+    def read(self, size=None):
+        if self.fail_at is not None and self.served >= self.fail_at:
+            raise OSError("connection reset")
+        end = len(self.content) if size is None else self.served + min(size, 4096)
+        data = self.content[self.served:end]
+        self.served += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class StreamingS3(FakeS3):
+    """open_object でストリームを返す S3 のスタブ"""
+
+    def __init__(self, content: bytes, fail_at: int = None):
+        super().__init__(content)
+        self.body = StreamingBody(content, fail_at)
+
+    def open_object(self, s3_key):
+        return self.body
+
+
+def stream_settings(monkeypatch, chunk_rows: int = 2):
+    """小さなファイルでも読みながら取り込む（チャンクも先読みも小さく）"""
+    from app import import_stream
+
+    monkeypatch.setattr(import_stream, "IMPORT_STREAM_MIN_BYTES", 1)
+    monkeypatch.setattr(import_stream, "IMPORT_STREAM_CHUNK_ROWS", chunk_rows)
+    monkeypatch.setattr(import_stream, "IMPORT_STREAM_QUEUE_SIZE", 1)
+
+
+def stream_threads() -> list:
+    import threading
+
+    return [thread for thread in threading.enumerate() if thread.name == "import-stream"]
+
+
+def test_streamed_import_matches_downloaded_import(db, monkeypatch):
+    """S3 から読みながらの取り込みが、ダウンロードしてからの取り込みと同じ結果になること"""
+    content = (
+        "氏名,メール,電話,住所\n"
+        "鈴木一郎,ichiro@example.com,,\n"
+        "佐藤花子,hanako@example.com,0612345678,梅田2-2-2\n"
+        "鈴木一郎,ICHIRO@example.com,090-1111-2222,\n"
+        "不正,not-an-email,,\n"
+        "佐藤 花子,,,梅田二丁目2番2号\n"
+    ).encode("utf-8")
+    stream_settings(monkeypatch)
+    monkeypatch.setattr(import_processor, "MATCH_CHUNK_SIZE", 2)
+    fake_s3 = StreamingS3(content)
+    monkeypatch.setattr(import_processor, "s3_service", fake_s3)
+
+    db_import = crud.create_import(db, "a.csv", s3_key="uploads/a.csv")
+    process_import_job(db_import.id, MAPPING, [], db)
+
+    db.refresh(db_import)
+    assert fake_s3.downloads == 0 and fake_s3.body.closed and stream_threads() == []
+    assert db_import.status == models.ImportStatus.completed
+    assert (db_import.total_rows, db_import.inserted_count, db_import.error_count, db_import.candidate_count) == (5, 3, 1, 1)
+    assert db_import.content_hash == f"sha256:{hashlib.sha256(content).hexdigest()}"
+    assert db_import.metrics["stream"]["rows"] == 5
+    # 文字列で読むので先頭の 0 は残る
+    assert crud.get_customer_by_email(db, "hanako@example.com").phone == "0612345678"
+    streamed = [(row.row_index, row.status, row.raw_data) for row in crud.get_import_rows(db, db_import.id)]
+
+    # ダウンロードしてからの取り込み（新しい顧客で）と行ごとの結果が同じ
+    db.query(models.ImportRow).delete()
+    db.query(models.DuplicateCandidate).delete()
+    db.query(models.Customer).delete()
+    db.commit()
+    from app import import_stream
+    monkeypatch.setattr(import_stream, "IMPORT_STREAM_MIN_BYTES", 0)
+    monkeypatch.setattr(import_processor, "s3_service", FakeS3(content))
+    downloaded = crud.create_import(db, "b.csv", s3_key="uploads/b.csv")
+    process_import_job(downloaded.id, MAPPING, [], db)
+    assert [(row.row_index, row.status, row.raw_data) for row in crud.get_import_rows(db, downloaded.id)] == streamed
+
+
+def test_stream_read_failure_marks_job_failed(db, monkeypatch):
+    """S3 の読み込みが途中で失敗したらジョブが failed になり、読むスレッドが終わっていること"""
+    content = ("氏名,メール,電話,住所\n" + "".join(
+        f"顧客{i},user{i}@example.com,,\n" for i in range(2000)
+    )).encode("utf-8")
+    stream_settings(monkeypatch, chunk_rows=100)
+    fake_s3 = StreamingS3(content, fail_at=len(content) // 2)
+    monkeypatch.setattr(import_processor, "s3_service", fake_s3)
+
+    db_import = crud.create_import(db, "a.csv", s3_key="uploads/a.csv")
+    process_import_job(db_import.id, MAPPING, [], db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.failed
+    assert db_import.error_message == "S3ファイル読み込みエラー: connection reset"
+    assert fake_s3.body.closed and stream_threads() == []
+
+
+def test_stream_stops_reading_when_processing_fails(db, monkeypatch):
+    """照合・保存側が失敗したら読むスレッドを止め、残りを S3 から読まないこと"""
+    content = ("氏名,メール,電話,住所\n" + "".join(
+        f"顧客{i},user{i}@example.com,,\n" for i in range(20000)
+    )).encode("utf-8")
+    stream_settings(monkeypatch, chunk_rows=100)
+    fake_s3 = StreamingS3(content)
+    monkeypatch.setattr(import_processor, "s3_service", fake_s3)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("normalize failed")
+
+    monkeypatch.setattr(import_processor, "prepare_rows", broken)
+    db_import = crud.create_import(db, "a.csv", s3_key="uploads/a.csv")
+    process_import_job(db_import.id, MAPPING, [], db)
+
+    db.refresh(db_import)
+    assert db_import.status == models.ImportStatus.failed
+    assert db_import.error_message == "normalize failed"
+    assert fake_s3.body.closed and stream_threads() == []
+    assert fake_s3.body.served < len(content) // 2
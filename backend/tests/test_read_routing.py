@@ -0,0 +1,107 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import crud, database, models
+from app.database import Base, get_db
+
+
+def _sqlite_factory():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def test_read_endpoints_use_replica_until_write(monkeypatch):
+    """読み取りはレプリカ、解決操作の直後はプライマリから読むこと"""
+    from app.main import app
+
+    primary = _sqlite_factory()
+    replica = _sqlite_factory()
+    monkeypatch.setattr(database, "SessionLocal", primary)
+    monkeypatch.setattr(database, "ReadSessionLocal", replica)
+
+    def override_get_db():
+        session = primary()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    # プライマリにだけ存在するインポート（レプリカはまだ追いついていない）
+    db = primary()
+    customer = crud.create_customer(db, "山田太郎", "taro@example.com", None, None)
+    db_import = crud.create_import(db, "test.csv")
+    row = crud.create_import_row(db, db_import.id, 0, {}, {}, {"full_name": "山田 太郎"}, [], "candidate")
+    candidate = crud.create_duplicate_candidate(db, row.id, customer.id, "氏名類似", 0.9)
+    import_id, candidate_id = db_import.id, candidate.id
+    db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        client = TestClient(app)
+        assert client.get(f"/api/imports/{import_id}").status_code == 404
+        assert client.get("/api/import-history/").json() == []
+        assert client.get(
+            f"/api/imports/{import_id}", headers={"X-Read-Your-Writes": "1"}
+        ).status_code == 200
+
+        response = client.post(
+            f"/api/duplicates/{candidate_id}/resolve", json={"action": "ignored"}
+        )
+        assert response.status_code == 200
+        assert database.READ_YOUR_WRITES_COOKIE in response.cookies
+
+        # Cookie がある間はプライマリから読む
+        response = client.get(f"/api/imports/{import_id}")
+        assert response.status_code == 200
+        assert client.get(f"/api/imports/{import_id}/candidates").json() == []
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_import_status_conditional_get(sqlite_client, db):
+    """ETag が一致すれば 304、完了したインポートは Cache-Control を返すこと"""
+    db_import = crud.create_import(db, "test.csv")
+    url = f"/api/imports/{db_import.id}"
+
+    response = sqlite_client.get(url)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert sqlite_client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    crud.update_import_status(db, db_import.id, "completed", total_rows=1, inserted_count=1)
+    response = sqlite_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["inserted_count"] == 1
+    assert "max-age" in response.headers["Cache-Control"]
+
+    response = sqlite_client.get(url, headers={"If-Modified-Since": response.headers["Last-Modified"]})
+    assert response.status_code == 304
+
+
+def test_import_history_ttl_cache(sqlite_client, db):
+    """履歴は TTL 内ならキャッシュから返し、ETag 一致で 304 を返すこと"""
+    from app.http_cache import history_cache
+    history_cache.clear()
+
+    crud.create_import(db, "a.csv")
+    response = sqlite_client.get("/api/import-history/")
+    assert [imp["filename"] for imp in response.json()] == ["a.csv"]
+    etag = response.headers["ETag"]
+
+    crud.create_import(db, "b.csv")
+    assert len(sqlite_client.get("/api/import-history/").json()) == 1
+    assert sqlite_client.get("/api/import-history/", headers={"If-None-Match": etag}).status_code == 304
+
+    # 書き込み直後のクライアントはキャッシュを使わない
+    response = sqlite_client.get("/api/import-history/", headers={"X-Read-Your-Writes": "1"})
+    assert len(response.json()) == 2
+    history_cache.clear()
@@ -0,0 +1,77 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, models, rematch
+from app.import_processor import process_import_job
+
+MAPPING = {"full_name": "氏名", "address": "住所"}
+
+
+def _pending(db, row_id):
+    return {
+        candidate.existing_customer_id: candidate
+        for candidate in crud.get_candidates_by_row_ids(db, [row_id])
+        if candidate.resolution == models.Resolution.pending
+    }
+
+
+def test_resolution_rematches_only_affected_rows(sqlite_client, db):
+    """新規作成・更新された顧客とキーが重なる未解決の行だけ候補が入れ替わること"""
+    taro = crud.create_customer(db, "山田太郎", None, None, "丸の内1-2-3")
+    db_import = crud.create_import(db, "test.csv")
+    process_import_job(db_import.id, MAPPING, [
+        {"氏名": "山田 太郎", "住所": "梅田二丁目2番2号"},
+        {"氏名": "山田太郎", "住所": "梅田2-2-2"},
+        {"氏名": "佐藤花子", "住所": "札幌1-1-1"},
+    ], db)
+    first, second = db.query(models.ImportRow).filter(
+        models.ImportRow.status == models.RowStatus.candidate
+    ).order_by(models.ImportRow.row_index).all()
+    assert db.query(models.ImportRowMatchKey).filter_by(import_row_id=second.id).count() > 0
+    assert list(_pending(db, second.id)) == [taro.id]
+
+    # 1行目を別顧客として作成すると、同じ氏名・住所の2行目の候補に入る
+    candidate_id = next(iter(_pending(db, first.id).values())).id
+    response = sqlite_client.post(f"/api/duplicates/{candidate_id}/resolve", json={"action": "created_new"})
+    assert response.status_code == 200
+    assert response.json()["rematched_rows"] == 1
+    created_id = response.json()["customer_id"]
+    db.expire_all()
+    candidates = _pending(db, second.id)
+    assert set(candidates) == {taro.id, created_id}
+    assert float(candidates[created_id].similarity_score) > float(candidates[taro.id].similarity_score)
+
+    # 既存顧客の氏名・住所が変わると、その顧客を指す古い候補は外れる
+    crud.update_customer(db, taro.id, full_name="田中一郎", address="神戸3-3-3")
+    result = rematch.rematch_customers(db, [taro.id])
+    assert result["rows"] == 1 and result["removed"] == 1
+    db.expire_all()
+    assert set(_pending(db, second.id)) == {created_id}
+    assert list(_pending(db, first.id)) == []
+
+
+def test_rematch_changed_since_inserts_rows_without_candidates(db):
+    """キーを持たない行を backfill でき、候補の顧客がすべて外れた行は新規顧客として取り込まれること"""
+    customer = crud.create_customer(db, "鈴木一郎", None, None, "名古屋1-1-1")
+    db_import = crud.create_import(db, "test.csv")
+    process_import_job(db_import.id, MAPPING, [{"氏名": "鈴木 一郎", "住所": "名古屋1-1-1"}], db)
+    import_row = db.query(models.ImportRow).one()
+    assert import_row.status == models.RowStatus.candidate
+
+    # この機能より前に作られた行（キーなし）は backfill で対象になる
+    db.query(models.ImportRowMatchKey).delete()
+    db.commit()
+    assert rematch.backfill_row_match_keys(db) == 1
+
+    crud.update_customer(db, customer.id, full_name="高橋次郎", address="福岡2-2-2")
+    # 候補行と関係しない顧客の変更は対象にしない
+    crud.create_customer(db, "佐藤花子", None, None, "札幌1-1-1")
+    result = rematch.rematch_changed_since(db, None)
+    assert result["customers"] == 1 and result["inserted"] == 1
+    db.refresh(import_row)
+    db.refresh(db_import)
+    assert import_row.status == models.RowStatus.inserted
+    assert _pending(db, import_row.id) == {}
+    assert (db_import.inserted_count, db_import.candidate_count) == (1, 0)
+    assert db.query(models.Customer).filter(models.Customer.full_name == "鈴木 一郎").count() == 1
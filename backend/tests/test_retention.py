@@ -0,0 +1,85 @@
+import gzip
+import json
+import sys
+import os
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, models, retention
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, s3_key, content_type="application/octet-stream"):
+        self.objects[s3_key] = fileobj.read()
+        return True
+
+
+def _old_import(db, days_ago: int, rows: int) -> models.Import:
+    db_import = crud.create_import(db, "old.csv")
+    db_import.status = models.ImportStatus.completed
+    db_import.total_rows = rows
+    db_import.inserted_count = rows
+    db_import.created_at = datetime.now() - timedelta(days=days_ago)
+    db.commit()
+    crud.create_import_rows(db, [
+        {
+            "import_id": db_import.id, "row_index": i, "raw_data": {"氏名": f"顧客{i}"},
+            "mapped_data": {}, "normalized_data": {}, "validation_errors": [],
+            "status": models.RowStatus.candidate, "row_hash": None,
+        }
+        for i in range(rows)
+    ])
+    return db_import
+
+
+def test_purge_keeps_counts_and_pending_candidates(db, monkeypatch):
+    """保持期間を過ぎた行と解決済み候補を退避・削除し、件数と未解決の候補は残すこと"""
+    fake_s3 = FakeS3()
+    monkeypatch.setattr(retention, "s3_service", fake_s3)
+    customer = crud.create_customer(db, "山田太郎", "taro@example.com", None, None)
+    old = _old_import(db, 400, 5)
+    recent = _old_import(db, 10, 2)
+
+    row_ids = [row.id for row in db.query(models.ImportRow).filter_by(import_id=old.id).order_by(models.ImportRow.id)]
+    for row_id, resolution in zip(row_ids[:2], (models.Resolution.merged, models.Resolution.pending)):
+        db.add(models.DuplicateCandidate(import_row_id=row_id, existing_customer_id=customer.id,
+                                         match_reason="名前類似", similarity_score=0.9, resolution=resolution))
+    db.commit()
+
+    assert [r["import_id"] for r in retention.run_retention(db, older_than_days=365, dry_run=True)] == [old.id]
+    results = retention.run_retention(db, older_than_days=365, batch_size=2, sleep_seconds=0, archive=True)
+    assert results[0]["deleted_rows"] == 4 and results[0]["deleted_candidates"] == 1
+    assert results[0]["kept_rows"] == 1
+
+    db.refresh(old)
+    assert old.total_rows == 5 and old.archived_at is None
+    assert db.query(models.ImportRow).filter_by(import_id=recent.id).count() == 2
+
+    lines = [json.loads(line) for line in gzip.decompress(fake_s3.objects[old.archive_s3_key]).splitlines()]
+    assert len(lines) == 4 and lines[0]["candidates"][0]["resolution"] == "merged"
+
+    # 未解決の候補が解決されれば次回で削除され、退避済みになる
+    db.query(models.DuplicateCandidate).update({"resolution": models.Resolution.ignored})
+    db.commit()
+    retention.run_retention(db, older_than_days=365, sleep_seconds=0)
+    db.refresh(old)
+    assert old.archived_at is not None
+    assert db.query(models.ImportRow).filter_by(import_id=old.id).count() == 0
+    assert db.query(models.DuplicateCandidate).count() == 0
+
+
+def test_partition_statements():
+    """未分割なら外部キー削除・主キー変更・分割、分割済みなら pmax の分割だけを出すこと"""
+    statements = retention.partition_statements(25000, 10000, foreign_keys=[("duplicate_candidates", "fk_1")])
+    assert statements[0] == "ALTER TABLE duplicate_candidates DROP FOREIGN KEY fk_1"
+    assert "PARTITION p40000 VALUES LESS THAN (40000), PARTITION pmax" in statements[-1]
+
+    assert retention.partition_statements(25000, 10000, existing_bounds=[10000, 20000, 30000, 40000]) == []
+    statements = retention.partition_statements(35000, 10000, existing_bounds=[10000, 20000, 30000, 40000])
+    assert statements == [
+        "ALTER TABLE import_rows REORGANIZE PARTITION pmax INTO "
+        "(PARTITION p50000 VALUES LESS THAN (50000), PARTITION pmax VALUES LESS THAN MAXVALUE)"
+    ]
@@ -0,0 +1,54 @@
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.scheduler import ImportScheduler
+
+
+def _blocking_job(started: list, release: threading.Event):
+    def run(import_id):
+        started.append(import_id)
+        release.wait(5)
+    return run
+
+
+def test_scheduler_limits_and_priority():
+    """全体・ユーザーごとの上限を守り、待ち行列は小さいファイルから実行されること"""
+    scheduler = ImportScheduler(max_concurrency=2, max_per_user=1, memory_budget_bytes=10 ** 12)
+    started = []
+    release = threading.Event()
+    run = _blocking_job(started, release)
+
+    scheduler.submit(1, run, 1, user="alice", size_bytes=10_000_000)
+    scheduler.submit(2, run, 2, user="alice", size_bytes=100)
+    scheduler.submit(3, run, 3, user="bob", size_bytes=5_000)
+    scheduler.submit(4, run, 4, user="carol", size_bytes=1_000)
+
+    # alice は1件まで、全体は2件まで
+    assert scheduler.stats()["running"] == 2
+    assert scheduler.queue_position(1) is None
+    assert scheduler.queue_position(3) is None
+    assert scheduler.queue_position(2) == 1
+    assert scheduler.queue_position(4) == 2
+
+    release.set()
+    for _ in range(100):
+        if scheduler.stats()["running"] == 0 and scheduler.stats()["queued"] == 0:
+            break
+        threading.Event().wait(0.05)
+    assert sorted(started) == [1, 2, 3, 4]
+
+
+def test_scheduler_memory_budget():
+    """メモリ予算を超えるジョブは実行中のジョブが終わるまで待つこと"""
+    scheduler = ImportScheduler(max_concurrency=4, max_per_user=4, memory_budget_bytes=1000)
+    started = []
+    release = threading.Event()
+    run = _blocking_job(started, release)
+
+    scheduler.submit(1, run, 1, size_bytes=80)   # 推定 800 バイト
+    scheduler.submit(2, run, 2, size_bytes=50)   # 推定 500 バイト → 予算超過
+    assert scheduler.stats()["running"] == 1
+    assert scheduler.queue_position(2) == 1
+    release.set()
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import crud, import_processor, models, upload_cache
+from app.import_processor import prepare_row, process_import_job, read_dataframe, read_rows
+
+CSV = (
+    "氏名,メール,電話,住所,会員番号,備考\n"
+    "山田太郎,taro@example.com,03-1234-5678,丸の内1-2-3,1001,\n"
+    "佐藤花子,,0312345678,,1002,VIP\n"
+    "鈴木一郎,ichiro@example.com,,梅田2-2-2,,\n"
+).encode("utf-8")
+MAPPING = {"full_name": "氏名", "email": "メール", "phone": "電話", "address": "住所"}
+
+
+class CountingS3:
+    """マルチパートの ETag（MD5 ではない）を返し、ダウンロード回数を数える S3 のスタブ"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.downloads = 0
+
+    def get_trusted_etag(self, s3_key):
+        return None
+
+    def get_object_etag(self, s3_key):
+        return hashlib.md5(self.content).hexdigest() + "-2"
+
+    def get_object_size(self, s3_key):
+        return len(self.content)
+
+    def download_file_with_hash(self, s3_key):
+        self.downloads += 1
+        return self.content, hashlib.sha256(self.content).hexdigest()
+
+
+def test_cached_rows_match_parsed_rows():
+    """キャッシュから列を絞って読んでも、マッピング結果と raw_data が解析直後と同じであること"""
+    df = read_dataframe("a.csv", CSV)
+    parsed = read_rows("a.csv", CSV)
+    entry = upload_cache.store("uploads/a.csv", "etag-1", "sha", df)
+    assert upload_cache.lookup("uploads/a.csv", "etag-2") is None
+
+    entry = upload_cache.lookup("uploads/a.csv", "etag-1")
+    assert entry.num_rows == 3 and entry.sha256 == "sha"
+    cached = upload_cache.read_rows(entry, columns=list(MAPPING.values()), raw_data=True)
+    assert list(cached.layout.columns) == list(MAPPING.values())
+    assert [prepare_row(row, MAPPING) for row in cached] == [prepare_row(row, MAPPING) for row in parsed]
+    # raw_data を頼まなければ全列の JSON は読まない
+    assert upload_cache.read_rows(entry, columns=list(MAPPING.values())).raw_data is None
+
+    preview = upload_cache.read_rows(entry, limit=2)
+    assert [dict(row) for row in preview] == [dict(row) for row in parsed[:2]]
+
+
+def test_rerun_with_new_mapping_reads_cache(db, monkeypatch):
+    """マッピングを変えたやり直しはダウンロードせずキャッシュから読むこと"""
+    fake_s3 = CountingS3(CSV)
+    monkeypatch.setattr(import_processor, "s3_service", fake_s3)
+
+    first = crud.create_import(db, "a.csv", s3_key="uploads/a.csv")
+    process_import_job(first.id, {"full_name": "氏名", "email": "住所"}, [], db)
+    second = crud.create_import(db, "a.csv", s3_key="uploads/a.csv")
+    process_import_job(second.id, MAPPING, [], db)
+
+    assert fake_s3.downloads == 1
+    db.refresh(second)
+    assert second.status == models.ImportStatus.completed
+    assert second.content_hash == f"sha256:{hashlib.sha256(CSV).hexdigest()}"
+    assert second.inserted_count == 3
+    assert crud.get_customer_by_email(db, "ichiro@example.com").address == "梅田2-2-2"
+    first_rows = [row.raw_data for row in crud.get_import_rows(db, first.id)]
+    assert [row.raw_data for row in crud.get_import_rows(db, second.id)] == first_rows
+
+
+def test_cache_evicts_least_recently_used():
+    """合計サイズの上限を超えたら最後に使った時刻の古いものから削除すること"""
+    df = read_dataframe("a.csv", CSV)
+    paths = []
+    for i in range(3):
+        entry = upload_cache.store(f"uploads/{i}.csv", "etag", "sha", df)
+        os.utime(entry.path, (1000 + i, 1000 + i))
+        paths.append(entry.path)
+    upload_cache.lookup("uploads/0.csv", "etag")  # 0 を使う → 1 が最も古い
+
+    upload_cache.evict(max_bytes=os.path.getsize(paths[0]) * 2)
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+
+
+def test_preview_api(sqlite_client, monkeypatch):
+    """プレビューは初回に解析してキャッシュし、2回目はキャッシュからマッピングの列だけ読むこと"""
+    fake_s3 = CountingS3(CSV)
+    monkeypatch.setattr(import_processor, "s3_service", fake_s3)
+    request = {"s3_key": "uploads/a.csv", "mapping": MAPPING, "limit": 2}
+
+    body = sqlite_client.post("/api/s3-upload/preview", json=request).json()
+    assert body["cached"] is False and body["total_rows"] == 3 and len(body["rows"]) == 2
+
+    body = sqlite_client.post("/api/s3-upload/preview", json=request).json()
+    assert body["cached"] is True and fake_s3.downloads == 1
+    assert body["columns"] == list(MAPPING.values())
+    assert body["rows"][1]["normalized_data"]["full_name"] == "佐藤花子"
+    assert body["rows"][1]["validation_errors"] == []
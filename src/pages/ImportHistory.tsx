@@ -9,6 +9,7 @@ interface ImportRecord {
   inserted_count: number;
   error_count: number;
   candidate_count: number;
+  queue_position?: number | null;
   created_at: string;
 }
 
@@ -36,6 +37,7 @@ export default function ImportHistory() {
   const getStatusBadge = (status: string) => {
     const colors: Record<string, string> = {
       completed: 'bg-green-100 text-green-800',
+      queued: 'bg-yellow-100 text-yellow-800',
       processing: 'bg-blue-100 text-blue-800',
       failed: 'bg-red-100 text-red-800'
     };
@@ -77,6 +79,7 @@ export default function ImportHistory() {
                 <td className="px-6 py-4 whitespace-nowrap">
                   <span className={`px-2 py-1 text-xs rounded-full ${getStatusBadge(imp.status)}`}>
                     {imp.status}
+                    {imp.queue_position ? ` (${imp.queue_position}番目)` : ''}
                   </span>
                 </td>
                 <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">{imp.total_rows}</td>
@@ -21,6 +21,23 @@ function pickSampleValues(rows: RowInput[], col: string, n = 3): string[] {
   return out;
 }
 
+// 🆕 大量データはジョブとして受け付けられるので、完了までポーリングして結果をページ取得
+async function waitForImportJob(jobId: number): Promise<any[]> {
+  const results: any[] = [];
+  let offset = 0;
+  for (;;) {
+    const res = await fetch(`/api/customers/import/jobs/${jobId}?offset=${offset}&limit=1000`);
+    if (!res.ok) throw new Error(`API error: ${res.status}`);
+    const job = await res.json();
+    if (job.status === "failed") throw new Error(job.error_message ?? "import job failed");
+
+    results.push(...job.candidates);
+    offset += job.candidates.length;
+    if (job.status === "completed" && job.next_offset === null) return results;
+    if (job.candidates.length === 0) await new Promise((r) => setTimeout(r, 1000));
+  }
+}
+
 export default function ImportNewPage() {
   const [def, setDef] = useState<ImportDefinition | null>(null);
   const [parseError, setParseError] = useState<string | null>(null);
@@ -128,7 +145,10 @@ function ImportNewBody({ def }: { def: ImportDefinition }) {
         throw new Error(`API error: ${response.status}`);
       }
 
-      const result = await response.json();
+      let result = await response.json();
+      if (response.status === 202) {
+        result = { candidates: await waitForImportJob(result.job_id) };
+      }
 
       // 候補検出結果をセット
       const withCandidates = result.candidates.map((c: any) => ({
@@ -16,6 +16,7 @@ interface ImportFromS3Response {
   import_id: number;
   status: string;
   message: string;
+  queue_position?: number | null;
 }
 
 export default function ImportWithS3() {